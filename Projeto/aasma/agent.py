@@ -1,6 +1,8 @@
 import numpy as np
 from abc import ABC, abstractmethod
 
+from aasma.utils_traffic_junction.neighbor_observations import NeighborObservation
+
 
 class Agent(ABC):
 
@@ -14,7 +16,11 @@ class Agent(ABC):
         Name for identification purposes.
         
     observation: np.ndarray
-       The most recent observation of the environment
+       The most recent observation of the environment, or its NeighborObservation with `neighbor_obs`
+
+    encoding: ObservationEncoding
+       Layout of the features of a cell, set by the agents that read the observation: the coordinates and the route
+       of a car are read through its slices, so they are found whatever the `id_encoding` of the environment
 
 
     Methods
@@ -22,6 +28,12 @@ class Agent(ABC):
     see(observation)
         Collects an observation
 
+    seed(seed)
+        Reseeds the random stream of the agent, if it has one
+
+    center_cell(): np.ndarray
+        Returns the center cell of the most recent observation
+
     action(): int
         Abstract method.
         Returns an action, represented by an integer
@@ -44,6 +56,20 @@ class Agent(ABC):
     def see(self, observation: np.ndarray):
         self.observation = observation
 
+    def center_cell(self) -> np.ndarray:
+        """Returns the cell of the observation where the agent itself is (the view is centered on the agent)"""
+        if isinstance(self.observation, NeighborObservation):
+            cell = self.observation.center_cell()
+        else:
+            view_radius = len(self.observation) // 2
+            cell = self.observation[view_radius][view_radius]
+        # the features may be stored as uint8, the agents step the coordinates out of the grid
+        return np.asarray(cell, dtype=int)
+
+    def seed(self, seed=None):
+        """Reseeds the random stream of the agent, the agents that draw no random numbers ignore it"""
+        pass
+
     def reset_visited(self):
         self.visited_positions = []
 
@@ -1 +1,6 @@
 from aasma.traffic_junction.traffic_junction import TrafficJunction
+from aasma.traffic_junction.vector_traffic_junction import VectorTrafficJunction
+from aasma.traffic_junction.env_pool import TrafficJunctionPool
+from aasma.traffic_junction.traffic_network import TrafficNetwork
+from aasma.traffic_junction.parallel_traffic_junction import ParallelTrafficJunction
+from aasma.utils_traffic_junction.agent_state import TrafficJunctionState
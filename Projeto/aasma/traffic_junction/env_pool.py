@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing as mp
+import pickle
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .traffic_junction import TrafficJunction
+from ..utils_traffic_junction.rng import stream_seed
+from ..utils_traffic_junction.step_buffers import StepBuffers
+
+logger = logging.getLogger(__name__)
+
+# commands and replies exchanged with the workers, sent as raw bytes so nothing is pickled per step
+_RESET, _STEP, _SEED, _CLOSE = b'r', b's', b'e', b'c'
+_OK, _ERROR = b'k', b'!'
+
+
+class TrafficJunctionPool:
+    """
+    Pool of `n_workers` processes, each one running its own TrafficJunction. Actions are read by the workers from a
+    shared-memory buffer and each worker writes its observations, rewards, dones and collisions straight into
+    preallocated shared-memory buffers, so only a one byte command and a one byte reply go through the pipes at each
+    step.
+
+    Environments whose episode ended are reset automatically by their worker, exactly as in VectorTrafficJunction:
+    the observations returned are those of the new episode and `info` reports the length and the collisions of the
+    finished one. The pool can therefore be used wherever a VectorTrafficJunction is expected.
+
+    As in VectorTrafficJunction, each episode draws from its own stream, keyed on the worker and on the number of
+    episodes it started: episode `k` of worker `i` is replayed alone by a TrafficJunction with the same arguments reset
+    with `reset(seed=pool.episode_seed(i, k))` and given the same actions.
+
+    The arrays returned by `step` and `reset` are views of the shared buffers: they are overwritten by the next call.
+    """
+
+    def __init__(self, n_workers, env_kwargs=None, seed=None, context=None):
+        assert 1 <= n_workers, "n_workers should be at least 1"
+        self.n_envs = n_workers
+        self._env_kwargs = dict(env_kwargs or {})
+        assert not self._env_kwargs.get('full_observable', False), "the pool only supports partial observations"
+
+        # a local environment gives the shapes of the buffers
+        env = TrafficJunction(**self._env_kwargs)
+        self.n_agents = env.n_agents
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        obs_shape = env._obs_shape
+
+        self._buffer_specs = {
+            'actions': ((n_workers, self.n_agents), np.int8),
+            'observations': ((n_workers, self.n_agents, *obs_shape), env._encoding.dtype),
+            'rewards': ((n_workers, self.n_agents), np.float64),
+            'dones': ((n_workers, self.n_agents), np.bool_),
+            'step_collisions': ((n_workers,), np.int64),
+            'cascade_rounds': ((n_workers,), np.int64),
+            'episode_done': ((n_workers,), np.bool_),
+            'episode_steps': ((n_workers,), np.int64),
+            'episode_collisions': ((n_workers,), np.int64),
+        }
+        self._shared_memory = {}
+        self._buffers = {}
+        for name, (shape, dtype) in self._buffer_specs.items():
+            size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            self._shared_memory[name] = shared_memory.SharedMemory(create=True, size=size)
+            self._buffers[name] = np.ndarray(shape, dtype=dtype, buffer=self._shared_memory[name].buf)
+
+        ctx = context if context is not None else mp.get_context()
+        # fresh entropy is drawn once, so the episode streams of an unseeded pool stay children of the same root
+        self._seed = stream_seed(seed)
+        shared_names = {name: memory.name for name, memory in self._shared_memory.items()}
+
+        self._pipes = []
+        self._processes = []
+        for worker_i in range(n_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_worker, daemon=True,
+                                  args=(worker_i, child_conn, shared_names, self._buffer_specs, self._env_kwargs,
+                                        self._seed))
+            process.start()
+            child_conn.close()
+            self._pipes.append(parent_conn)
+            self._processes.append(process)
+
+        self._pending = None
+        self._closed = False
+
+    def seed(self, n=None):
+        """
+        Replaces the seed the episodes draw their streams from, see `VectorTrafficJunction.seed`: the episode counters
+        of the workers restart, so the next reset of worker `i` starts its episode 0.
+
+        :param n: seed of the pool: an int, a sequence of ints or a SeedSequence, see `stream_seed`
+        :type n: int
+
+        :return: the seed
+        :rtype: list
+        """
+        self._seed = stream_seed(n)
+        self.__send(_SEED + pickle.dumps(self._seed), lambda: None).result()
+        return [n]
+
+    def episode_seed(self, worker_i, episode):
+        """
+        :return: seed of the stream of episode `episode` (counted from the last `seed`) of worker `worker_i`
+        :rtype: np.random.SeedSequence
+        """
+        return stream_seed(self._seed, worker_i, episode)
+
+    def reset_async(self):
+        """
+        Asks every worker to reset its environment.
+
+        :return: future whose result is the observations with shape (n_workers, n_agents, 5, 5, F)
+        :rtype: PoolFuture
+        """
+        return self.__send(_RESET, lambda: self._buffers['observations'])
+
+    def reset(self):
+        return self.reset_async().result()
+
+    def step_async(self, agents_action):
+        """
+        Writes the actions into the shared buffer and asks every worker to step its environment.
+
+        :param agents_action: actions of all the agents of all the environments, shape (n_workers, n_agents)
+        :type agents_action: np.ndarray
+
+        :return: future whose result is the tuple (observations, rewards, dones, info), see VectorTrafficJunction.step
+        :rtype: PoolFuture
+        """
+        self._buffers['actions'][:] = agents_action
+        return self.__send(_STEP, self.__step_result)
+
+    def step(self, agents_action):
+        return self.step_async(agents_action).result()
+
+    def __step_result(self):
+        info = {'step_collisions': self._buffers['step_collisions'],
+                'cascade_rounds': self._buffers['cascade_rounds'],
+                'episode_done': self._buffers['episode_done'],
+                'episode_steps': self._buffers['episode_steps'],
+                'episode_collisions': self._buffers['episode_collisions']}
+        return self._buffers['observations'], self._buffers['rewards'], self._buffers['dones'], info
+
+    def __send(self, command, make_result):
+        assert not self._closed, "the pool was closed"
+        # workers handle one request at a time, a request still running is waited for
+        if self._pending is not None:
+            self._pending.wait()
+
+        for pipe in self._pipes:
+            pipe.send_bytes(command)
+        self._pending = PoolFuture(self._pipes, make_result)
+        return self._pending
+
+    def close(self):
+        """
+        Stops the workers and releases the shared memory. Pending requests are waited for first.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._pending is not None:
+                self._pending.wait()
+            for pipe in self._pipes:
+                pipe.send_bytes(_CLOSE)
+            for pipe in self._pipes:
+                pipe.recv_bytes()
+        except (BrokenPipeError, EOFError, RuntimeError):
+            logger.warning("a worker of the pool stopped unexpectedly")
+        finally:
+            for process in self._processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            for pipe in self._pipes:
+                pipe.close()
+            self._buffers.clear()
+            for memory in self._shared_memory.values():
+                memory.close()
+                memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __del__(self):
+        if not getattr(self, '_closed', True):
+            self.close()
+
+
+class PoolFuture:
+    """
+    Result of a request sent to all the workers of a TrafficJunctionPool, available once every worker replied.
+    """
+
+    def __init__(self, pipes, make_result):
+        self._pipes = pipes
+        self._waiting = list(range(len(pipes)))
+        self._make_result = make_result
+        self._errors = []
+
+    def done(self):
+        return self.wait(0)
+
+    def wait(self, timeout=None):
+        """
+        Waits for every worker to reply, without raising the errors of the workers.
+
+        :return: True if every worker replied before the timeout
+        :rtype: bool
+        """
+        self._waiting = [worker_i for worker_i in self._waiting if not self.__poll(worker_i, timeout)]
+        return not self._waiting
+
+    def result(self, timeout=None):
+        """
+        Waits for every worker to reply.
+
+        :param timeout: maximum number of seconds to wait for each worker, None to wait as long as needed
+        :type timeout: float
+
+        :return: result of the request
+        """
+        if not self.wait(timeout):
+            raise TimeoutError("workers {} did not reply in {} seconds".format(self._waiting, timeout))
+        if self._errors:
+            raise RuntimeError("a worker of the pool failed:\n" + "\n".join(self._errors))
+        return self._make_result()
+
+    def __poll(self, worker_i, timeout):
+        if not self._pipes[worker_i].poll(timeout):
+            return False
+        reply = self._pipes[worker_i].recv_bytes()
+        if reply[:1] == _ERROR:
+            self._errors.append(reply[1:].decode())
+        return True
+
+
+def _attach_shared_memory(name):
+    """
+    Attaches to a block created by the pool. The pool owns the block and unlinks it when closed, the worker only
+    needs to map it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 always tracks, the workers share the resource tracker of the pool
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker(worker_i, conn, shared_names, buffer_specs, env_kwargs, seed):
+    """
+    Loop run by each worker of the pool: steps its own TrafficJunction, which reads the actions from and writes the
+    observations, rewards, dones and collisions into its row of the shared buffers. Episode `k` is seeded with
+    `stream_seed(seed, worker_i, k)`, see `TrafficJunctionPool.episode_seed`.
+    """
+    shared = {name: _attach_shared_memory(memory_name) for name, memory_name in shared_names.items()}
+    buffers = {name: np.ndarray(shape, dtype=dtype, buffer=shared[name].buf)
+               for name, (shape, dtype) in buffer_specs.items()}
+    env = TrafficJunction(**env_kwargs)
+    worker_buffers = StepBuffers.over(buffers['actions'][worker_i], buffers['observations'][worker_i],
+                                      buffers['rewards'][worker_i], buffers['dones'][worker_i],
+                                      buffers['step_collisions'][worker_i, ...],
+                                      buffers['cascade_rounds'][worker_i, ...])
+    # the automatic reset only writes the observations of the new episode, the rewards and dones of the finished one
+    # stay in the shared buffers
+    reset_buffers = StepBuffers.over(worker_buffers.actions, worker_buffers.observations,
+                                     np.zeros(env.n_agents), np.zeros(env.n_agents, dtype=np.bool_))
+    episode_collisions = 0
+    episode = 0
+    try:
+        while True:
+            command = conn.recv_bytes()
+            if command == _CLOSE:
+                conn.send_bytes(_OK)
+                break
+
+            try:
+                if command == _RESET:
+                    env.reset(out=worker_buffers, seed=stream_seed(seed, worker_i, episode))
+                    episode += 1
+                    episode_collisions = 0
+                    buffers['episode_done'][worker_i] = False
+                elif command[:1] == _SEED:
+                    seed = pickle.loads(command[1:])
+                    episode = 0
+                else:
+                    env.step(worker_buffers.actions, out=worker_buffers)
+                    episode_collisions += int(worker_buffers.step_collisions)
+
+                    episode_done = worker_buffers.dones.all()
+                    buffers['episode_done'][worker_i] = episode_done
+                    buffers['episode_steps'][worker_i] = env._step_count
+                    buffers['episode_collisions'][worker_i] = episode_collisions
+                    if episode_done:
+                        env.reset(out=reset_buffers, seed=stream_seed(seed, worker_i, episode))
+                        episode += 1
+                        episode_collisions = 0
+
+                conn.send_bytes(_OK)
+            except Exception:
+                conn.send_bytes(_ERROR + traceback.format_exc().encode())
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        env.close()
+        buffers.clear()
+        for memory in shared.values():
+            memory.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from .traffic_junction import ACTION_MEANING
+from ..utils_traffic_junction.step_buffers import StepBuffers
+
+
+class ParallelTrafficJunction:
+    """
+    Parallel multi-agent front end of a TrafficJunction that only exchanges the live cars: `step` takes a dict of
+    actions keyed by agent id and returns the observations, rewards and dones as dicts keyed by the ids of the cars
+    that are live after it, which are
+
+    - the cars on the road and not done, including the car that just spawned,
+    - the cars that finished in the step (reached their destination or ran out of steps), reported once with done,
+    - the car that spawned on the last step of the episode, which is done right away.
+
+    Cars waiting to enter and cars that finished in an earlier step do not appear, so the work of the caller grows
+    with the number of live cars instead of `n_max`. The observations are read from the lazy snapshot of the
+    environment, so only the windows of the live cars are built.
+
+    `ParallelListAdapter` gives back the list API on top of it, for `SingleAgentWrapper` and `run_multi_agent`.
+    """
+
+    def __init__(self, env):
+        """
+        :param env: environment to step, its observations are read by agent id
+        :type env: TrafficJunction
+        """
+        assert not env.full_observable, "the parallel front end gives each live car its own observation"
+        self.env = env
+        self.n_agents = env.n_agents
+        # every agent has the same spaces
+        self.action_space = env.action_space[0]
+        self.observation_space = env.observation_space[0]
+        self.agents = []  # ids of the live cars after the last reset or step
+
+        # without an observations array, the environment returns its snapshot instead of gathering every window
+        self._buffers = StepBuffers(env.n_agents, None)
+
+    def reset(self, seed=None, schedule=None):
+        """
+        :param seed: if given, the environment is reseeded first, see `TrafficJunction.seed`
+        :type seed: int
+
+        :param schedule: if given, the arrivals of the episode are replayed from it, see `TrafficJunction.reset`
+        :type schedule: ArrivalSchedule
+
+        :return: observation of each car on the road, keyed by agent id
+        :rtype: dict
+        """
+        observations = self.env.reset(out=self._buffers, seed=seed, schedule=schedule)
+        self.agents = self.env.active_agents().tolist()
+        return {agent_i: observations[agent_i] for agent_i in self.agents}
+
+    def step(self, actions):
+        """
+        :param actions: action of each car on the road keyed by agent id, the actions of the other cars are ignored
+        :type actions: dict
+
+        :return: observations, rewards and dones of the live cars keyed by agent id, and the info of the step with
+            'episode_done' set when every car is done
+        :rtype: tuple
+        """
+        env = self.env
+        moving_ids = env.active_agents()
+        assert all(agent_i in actions for agent_i in moving_ids.tolist()), \
+            "an action is expected for each car on the road, {}".format(moving_ids.tolist())
+
+        agents_action = self._buffers.actions
+        for agent_i, action in actions.items():
+            assert action in ACTION_MEANING, "Invalid action {}. Valid actions are {}".format(action,
+                                                                                         ACTION_MEANING.keys())
+            agents_action[agent_i] = action
+
+        # a step spawns at most one car, the first one waiting, and the waiting cars only leave by entering the road
+        next_waiting = env.next_waiting_agent()
+
+        observations, rewards, dones, info = env.step(agents_action, out=self._buffers)
+
+        live_ids = env.active_agents()
+        finished_ids = moving_ids[dones[moving_ids]]
+        if len(finished_ids):
+            live_ids = np.union1d(live_ids, finished_ids)
+        if next_waiting is not None and env.next_waiting_agent() != next_waiting and dones[next_waiting]:
+            live_ids = np.union1d(live_ids, [next_waiting])
+        self.agents = live_ids.tolist()
+
+        info = {key: int(value) for key, value in info.items()}
+        info['episode_done'] = bool(dones.all())
+        return ({agent_i: observations[agent_i] for agent_i in self.agents},
+                {agent_i: float(rewards[agent_i]) for agent_i in self.agents},
+                {agent_i: bool(dones[agent_i]) for agent_i in self.agents},
+                info)
+
+    def render(self, mode='human'):
+        return self.env.render(mode)
+
+    def close(self):
+        self.env.close()
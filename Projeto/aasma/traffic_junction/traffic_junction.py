@@ -2,24 +2,35 @@
 
 import copy
 import logging
-import random
+import math
 import time
+from collections import deque
 
 import gym
 import numpy as np
 from gym import spaces
-from gym.utils import seeding
 
 from ..utils_traffic_junction.action_space import MultiAgentActionSpace
-from ..utils_traffic_junction.draw import draw_grid, fill_cell, write_cell_text
-from ..utils_traffic_junction.observation_space import MultiAgentObservationSpace
+from ..utils_traffic_junction.agent_state import AgentPositions, AgentState, TrafficJunctionState, read_only
+from ..utils_traffic_junction.arrival_schedule import ArrivalSchedule
+from ..utils_traffic_junction.collisions import resolve_collisions
+from ..utils_traffic_junction.draw import fill_cell, write_cell_text
+from ..utils_traffic_junction.lazy_observations import LazyObservations
+from ..utils_traffic_junction.neighbor_observations import gather_neighbors
+from ..utils_traffic_junction.observation_encoding import N_ROUTES, ObservationEncoding
+from ..utils_traffic_junction.observation_space import FeatureBox, MultiAgentObservationSpace
+from ..utils_traffic_junction.route_paths import path_id
+from ..utils_traffic_junction.static_layers import static_layers
+from ..utils_traffic_junction.step_buffers import StepBuffers
+from ..utils_traffic_junction.step_kernel import JIT_AVAILABLE, move_cars
 
 logger = logging.getLogger(__name__)
 
 
 class TrafficJunction(gym.Env):
     """
-    This consists of a 4-way junction on a 14 × 14 grid. At each time step, "new" cars enter the grid with
+    This consists of a 4-way junction on a 14 × 14 grid (the default `grid_shape`, the layout is derived from it by
+    `JunctionGeometry`, so other sizes, even non-square, work too). At each time step, "new" cars enter the grid with
     probability `p_arrive` from each of the four directions. However, the total number of cars at any given
     time is limited to `Nmax`.
 
@@ -56,13 +67,18 @@ class TrafficJunction(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array']}
 
     def __init__(self, grid_shape=(14, 14), step_cost=-0.01, n_max=4, collision_reward=-10, arrive_prob=0.5,
-                 full_observable: bool = False, max_steps: int = 100):
+                 full_observable: bool = False, max_steps: int = 100, view_radius: int = 2, jit: bool = False,
+                 fast_forward: bool = False, incremental_obs: bool = False, neighbor_obs: bool = False,
+                 obs_dtype=np.uint8, id_encoding: str = 'onehot', seed=None, profiler=None):
         assert 1 <= n_max <= 255, "n_max should be range in [1,10]"
         assert 0 <= arrive_prob <= 1, "arrive probability should be in range [0,1]"
         assert len(grid_shape) == 2, 'only 2-d grids are acceptable'
         assert 1 <= max_steps, "max_steps should be more than 1"
+        assert 0 <= view_radius, "view_radius should be a non negative number of cells"
+        assert not (neighbor_obs and (incremental_obs or full_observable)), \
+            "neighbor_obs replaces the dense observations, it does not combine with incremental_obs or full_observable"
 
-        self._grid_shape = grid_shape
+        self._grid_shape = tuple(grid_shape)
         self.n_agents = n_max
         self._max_steps = max_steps
         self._step_count = None  # environment step counter
@@ -72,66 +88,127 @@ class TrafficJunction(gym.Env):
         self._n_max = n_max
         self._step_cost = step_cost
         self.curr_cars_count = 0
-        self._n_routes = 3
+        self._n_routes = N_ROUTES
 
-        self._agent_view_mask = (5, 5)
+        # cars see `view_radius` cells on each side, (5 x 5) by default
+        self._view_radius = view_radius
+        self._agent_view_mask = (2 * view_radius + 1, 2 * view_radius + 1)
+
+        # everything that only depends on the grid shape (layout, track grid, paths, window tables and base image) is
+        # built once per process and shared by every environment, see `StaticLayers`
+        self._layers = static_layers(self._grid_shape, self._n_routes)
+
+        # layout of the junction derived from the grid shape, shared with the agents, see `JunctionGeometry`
+        self._geometry = self._layers.geometry
 
         # entry gates where the cars spawn
         # Note: [(7, 0), (13, 7), (6, 13), (0, 6)] for (14 x 14) grid
-        self._entry_gates = [(self._grid_shape[0] // 2, 0),
-                             (self._grid_shape[0] - 1, self._grid_shape[1] // 2),
-                             (self._grid_shape[0] // 2 - 1, self._grid_shape[1] - 1),
-                             (0, self._grid_shape[1] // 2 - 1)]
-
-        # destination places for the cars to reach
-        # Note: [(7, 13), (0, 7), (6, 0), (13, 6)] for (14 x 14) grid
-        self._destination = [(self._grid_shape[0] // 2, self._grid_shape[1] - 1),
-                             (0, self._grid_shape[1] // 2),
-                             (self._grid_shape[0] // 2 - 1, 0),
-                             (self._grid_shape[0] - 1, self._grid_shape[1] // 2 - 1)]
-
-        # dict{direction_vectors: (turn_right, turn_left)}
-        # Note: [((7, 6), (7,7))), ((7, 7),(6,7)), ((6,6),(7, 6)), ((6, 7),(6,6))] for (14 x14) grid
-        self._turning_places = {(0, 1): ((self._grid_shape[0] // 2, self._grid_shape[0] // 2 - 1),
-                                         (self._grid_shape[0] // 2, self._grid_shape[0] // 2)),
-                                (-1, 0): ((self._grid_shape[0] // 2, self._grid_shape[0] // 2),
-                                          (self._grid_shape[0] // 2 - 1, self._grid_shape[0] // 2)),
-                                (1, 0): ((self._grid_shape[0] // 2 - 1, self._grid_shape[0] // 2 - 1),
-                                         (self._grid_shape[0] // 2, self._grid_shape[0] // 2 - 1)),
-                                (0, -1): ((self._grid_shape[0] // 2 - 1, self._grid_shape[0] // 2),
-                                          (self._grid_shape[0] // 2 - 1, self._grid_shape[0] // 2 - 1))}
-
-        # dict{starting_place: direction_vector}
-        self._route_vectors = {(self._grid_shape[0] // 2, 0): (0, 1),
-                               (self._grid_shape[0] - 1, self._grid_shape[0] // 2): (-1, 0),
-                               (0, self._grid_shape[0] // 2 - 1): (1, 0),
-                               (self._grid_shape[0] // 2 - 1, self._grid_shape[0] - 1): (0, -1)}
-
-        self._agent_turned = [False for _ in range(self.n_agents)]  # flag if car changed direction
-        self._agents_routes = [-1 for _ in range(self.n_agents)]  # route each car is following atm
-        self._agents_direction = [(0, 0) for _ in range(self.n_agents)]  # cars are not on the road initially
-        self._agent_step_count = [0 for _ in range(self.n_agents)]  # holds a step counter for each car
+        self._entry_gates = self._geometry.entry_gates
+
+        # step rules compiled with numba, the pure-Python step is used when it is not installed
+        if jit and not JIT_AVAILABLE:
+            logger.warning("numba is not installed, the pure-Python step is used instead of the JIT kernel")
+        self._jit = jit and JIT_AVAILABLE
+
+        # while the road is empty and cars wait to enter, a step only draws the arrival, so the steps until the next
+        # arrival can be skipped at once, see `__fast_forward`
+        self._fast_forward = fast_forward
+
+        # the path of a car only depends on its gate and route, so all of them are walked once: cars hold the row
+        # of their path (`path_id`) and how many cells of it they covered, and the next cell of every car is a gather
+        self._path_positions = self._layers.path_positions
+        self._path_lengths = self._layers.path_lengths
+        self._path_cells = self._layers.path_cells
+        # index of the entry gate in each flat cell, -1 elsewhere
+        self._cell_gate = self._layers.cell_gate
+
+        # state of every car as contiguous arrays updated in place, the attributes `agent_pos`, `_agents_routes`,
+        # `_on_the_road`, `_agent_dones` and `_agent_step_count` are read-only views of it
+        self._agents = AgentState(self.n_agents)
+        self.agent_pos = AgentPositions(self._agents.pos)
+        self._agents_routes = read_only(self._agents.route)  # route each car is following atm
+        self._on_the_road = read_only(self._agents.on_road)  # flag if car is on the road
+        self._agent_dones = read_only(self._agents.dones)
+        self._agent_step_count = read_only(self._agents.step_count)  # holds a step counter for each car
+
+        # only the cars on the road and not done are stepped, in ascending id order, and the cars waiting to enter
+        # are queued in the order they will spawn; each bit of `_gates_taken` flags a car standing on that gate.
+        # `_active_ids` is the view of the first cars of a buffer allocated once, compacted in place at each step
+        self._active_buffer = np.zeros(self.n_agents, dtype=np.int64)
+        self._active_ids = self._active_buffer[:0]
+        self._waiting_cars = deque()
+        self._gates_taken = 0
 
         self.action_space = MultiAgentActionSpace([spaces.Discrete(2) for _ in range(self.n_agents)])
-        self.agent_pos = {_: None for _ in range(self.n_agents)}
-        self._on_the_road = [False for _ in range(self.n_agents)]  # flag if car is on the road
 
-        self._full_obs = self.__create_grid()
-        self._base_img = self.__draw_base_img()
-        self._agent_dones = [None for _ in range(self.n_agents)]
+        # the grid without cars is shared, only the occupancy grid copied from it at reset belongs to the environment
+        self._track_grid = self._layers.track_grid
+        self._full_obs = self._track_grid.copy()
 
         self.viewer = None
         self.full_observable = full_observable
 
-        # agent id (n_agents, onehot), obs_mask (9), pos (2), route (3)
-        mask_size = np.prod(self._agent_view_mask)
-        self._obs_high = np.ones((mask_size * (self.n_agents + self._n_routes + 2)))  # 2 is for location
-        self._obs_low = np.zeros((mask_size * (self.n_agents + self._n_routes + 2)))  # 2 is for location
-        if self.full_observable:
-            self._obs_high = np.tile(self._obs_high, self.n_agents)
-            self._obs_low = np.tile(self._obs_low, self.n_agents)
-        self.observation_space = MultiAgentObservationSpace([spaces.Box(self._obs_low, self._obs_high)
-                                                             for _ in range(self.n_agents)])
+        # features of a cell: agent id (n_agents one-hot, or a single 'index' channel), pos (2), route (3), stored
+        # with `obs_dtype`, see `ObservationEncoding`
+        self._encoding = ObservationEncoding(self.n_agents, self._n_routes, self._grid_shape, id_encoding, obs_dtype)
+        self._obs_shape = (*self._agent_view_mask, self._encoding.n_features)
+
+        # the spaces describe the active encoding: each agent gets its (2r + 1, 2r + 1, F) window, or the flattened
+        # windows of all the agents when `full_observable`. A single space only holding the bounds of the F features
+        # is shared by every agent, see `FeatureBox`
+        obs_space_shape = (self.n_agents * int(np.prod(self._obs_shape)),) if self.full_observable else self._obs_shape
+        self.observation_space = MultiAgentObservationSpace.shared(
+            FeatureBox(self._encoding.high, obs_space_shape, self._encoding.dtype), self.n_agents)
+
+        # the observations are gathered through arrays allocated once: the feature table of the cars, the grid padded
+        # by the view radius, the cells of the window around each grid cell and the windows of the agents, see
+        # `get_agent_obs`. Indices are kept as np.intp so that `np.take` gathers without casting
+        self._obs_features = self._encoding.feature_table()
+        self._padded_grid = np.zeros((self._grid_shape[0] + 2 * view_radius, self._grid_shape[1] + 2 * view_radius),
+                                     dtype=np.intp)
+        self._padded_interior = self._padded_grid[view_radius:view_radius + self._grid_shape[0],
+                                                  view_radius:view_radius + self._grid_shape[1]]
+        self._cell_windows = self._layers.window_cells(view_radius)
+        self._agent_cells = np.zeros(self.n_agents, dtype=np.intp)
+        self._window_cells = np.zeros((self.n_agents, *self._agent_view_mask), dtype=np.intp)
+        self._window_codes = np.zeros((self.n_agents, *self._agent_view_mask), dtype=np.intp)
+
+        # work arrays of the step, one entry per car, sliced to the active cars at each step, see `__move_cars`
+        self._flat_path_cells = self._path_cells.reshape(-1)
+        self._step_gas = np.zeros(self.n_agents, dtype=np.bool_)  # flag of every car, gathered for the active ones
+        self._step_path = np.zeros_like(self._agents.path)
+        self._step_progress = np.zeros_like(self._agents.progress)
+        self._step_path_index = np.zeros(self.n_agents, dtype=np.int64)  # flat index of each car in `_path_cells`
+        self._step_curr_cells = np.zeros(self.n_agents, dtype=np.int64)
+        self._step_next_cells = np.zeros(self.n_agents, dtype=np.int64)
+        self._step_flags = np.zeros(self.n_agents, dtype=np.bool_)
+        self._step_pos = np.zeros((2, self.n_agents), dtype=np.int64)
+
+        # with `incremental_obs`, the observations are kept in a persistent array (or the `out` array given at every
+        # step) and only the windows overlapping a cell that changed since the last build are rewritten, see
+        # `__update_obs`. The grid codes, positions and routes of the last build tell which cells changed
+        self._incremental_obs = incremental_obs and not full_observable
+        self._obs_target = None  # array holding the observations of the last build, None to rebuild all of them
+        if self._incremental_obs:
+            self._persistent_obs = np.zeros((self.n_agents, *self._obs_shape), dtype=self._obs_features.dtype)
+            self._last_codes = np.zeros(self._grid_shape, dtype=np.intp)
+            self._last_pos = np.zeros_like(self._agents.pos)
+            self._last_routes = np.zeros_like(self._agents.route)
+            self._touched_windows = np.zeros(self._padded_grid.size, dtype=np.bool_)
+            self._moved_codes = np.zeros(self.n_agents + 1, dtype=np.bool_)  # flag of each grid code, 0 is no car
+
+        # with `neighbor_obs`, each agent gets the list of the cars in its view instead of the dense window, see
+        # `NeighborObservation`
+        self._neighbor_obs = neighbor_obs
+
+        # the spawns and routes are drawn from a generator of the environment, so that environments seeded with
+        # independent streams (see `stream_seed`) reproduce their episodes whatever runs next to them
+        self.np_random = np.random.default_rng(seed)
+        # arrivals replayed instead of drawn in the current episode, see `reset`
+        self._schedule = None
+
+        # opt-in timings and counters of the phases of the step, see `StepProfiler`
+        self.profiler = profiler
 
     def action_space_sample(self):
         return [agent_action_space.sample() for agent_action_space in self.action_space]
@@ -141,33 +218,63 @@ class TrafficJunction(gym.Env):
         Initiates environment: inserts up to |entry_gates| cars. once the entry gates are filled, the remaining agents
         stay initialized outside the road waiting to enter
         """
-        self._full_obs = self.__create_grid()
+        np.copyto(self._full_obs, self._track_grid)
+        self.__refresh_route_features()
 
-        shuffled_gates = list(self._route_vectors.keys())
-        random.shuffle(shuffled_gates)
+        if self._schedule is not None:
+            shuffled_gates = self._schedule.gates.tolist()
+        else:
+            shuffled_gates = self.np_random.permutation(len(self._entry_gates)).tolist()
         for agent_i in range(self.n_agents):
-            if self.curr_cars_count >= len(self._entry_gates):
-                self.agent_pos[agent_i] = (0, 0)  # not yet on the road
-            else:
-                pos = shuffled_gates[agent_i]
-                # gets direction vector for agent_i that spawned in position pos
-                self._agents_direction[agent_i] = self._route_vectors[pos]
-                self.agent_pos[agent_i] = pos
+            # once the gates are filled, the remaining cars wait outside the road at (0, 0)
+            if self.curr_cars_count < len(self._entry_gates):
+                gate = shuffled_gates[agent_i]
+                self.__place_car(agent_i, gate, self.__draw_route(agent_i))
                 self.curr_cars_count += 1
-                self._on_the_road[agent_i] = True
-                self._agents_routes[agent_i] = random.randint(1, self._n_routes)  # [1,3] (inclusive)
+            else:
+                self._waiting_cars.append(agent_i)
             self.__update_agent_view(agent_i)
 
-        self.__draw_base_img()
+    def __draw_route(self, agent_i):
+        # route of car `agent_i` as it enters, in [1,3]
+        if self._schedule is not None:
+            return int(self._schedule.routes[agent_i])
+        return int(self.np_random.integers(1, self._n_routes + 1))
 
     def _is_cell_vacant(self, pos):
-        return self.is_valid(pos) and (self._full_obs[pos[0]][pos[1]] == PRE_IDS['empty'])
+        return self.is_valid(pos) and (self._full_obs[pos[0], pos[1]] == GRID_IDS['empty'])
 
     def is_valid(self, pos):
         return (0 <= pos[0] < self._grid_shape[0]) and (0 <= pos[1] < self._grid_shape[1])
 
     def __update_agent_view(self, agent_i):
-        self._full_obs[self.agent_pos[agent_i][0]][self.agent_pos[agent_i][1]] = PRE_IDS['agent'] + str(agent_i + 1)
+        # agents are stored in the grid as their 1-based id
+        self._full_obs[self._agents.pos[agent_i, 0], self._agents.pos[agent_i, 1]] = agent_i + 1
+
+    def __place_car(self, agent_i, gate, route):
+        """
+        Puts car `agent_i` on the road at the entry gate of index `gate`, at the start of the path of its route.
+        """
+        self._agents.pos[agent_i] = self._entry_gates[gate]
+        self._agents.path[agent_i] = path_id(gate, route, self._n_routes)
+        self._agents.progress[agent_i] = 0
+        self._agents.route[agent_i] = route
+        self._agents.on_road[agent_i] = True
+        self._gates_taken |= 1 << gate
+        self.__set_route_feature(agent_i)
+        # cars spawned on the last step of the episode are already done
+        if not self._agents.dones[agent_i]:
+            n_active = len(self._active_ids)
+            self._active_buffer[n_active] = agent_i
+            self._active_ids = self._active_buffer[:n_active + 1]
+
+    def __set_route_feature(self, agent_i):
+        # one-hot route of car `agent_i` in the feature table of the observations
+        self._encoding.set_routes(self._obs_features[agent_i + 1:agent_i + 2], self._agents.route[agent_i:agent_i + 1])
+
+    def __refresh_route_features(self):
+        # rebuilds the one-hot routes of all the cars, cars that did not enter yet have route -1
+        self._encoding.set_routes(self._obs_features[1:], self._agents.route)
 
     def __check_collision(self, pos):
         """
@@ -178,424 +285,544 @@ class TrafficJunction(gym.Env):
         :return: boolean stating true or false
         :rtype: bool
         """
-        return self.is_valid(pos) and (self._full_obs[pos[0]][pos[1]].find(PRE_IDS['agent']) > -1)
+        return self.is_valid(pos) and (self._full_obs[pos[0], pos[1]] > GRID_IDS['empty'])
 
     def __is_gate_free(self):
         """
         Verifies if any spawning gate is free for a car to be placed
 
-        :return: list of currently free gates
+        :return: list with the index of the currently free gates
         :rtype: list
         """
-        free_gates = []
-        for pos in self._entry_gates:
-            if pos not in self.agent_pos.values():
-                free_gates.append(pos)
-        return free_gates
+        return [gate for gate in range(len(self._entry_gates)) if not self._gates_taken >> gate & 1]
 
-    def __reached_dest(self, agent_i):
+    def __reached_dest(self, agent_ids):
         """
-        Verifies if the agent_i reached a destination place.
-        :param agent_i: id of the agent
-        :type agent_i: int
+        Verifies which agents reached a destination place, i.e. the last cell of their path, and clears it.
+        :param agent_ids: ids of the agents to verify
+        :type agent_ids: np.ndarray
 
-        :return: boolean stating true or false
-        :rtype: bool  
+        :return: flag for every agent of `agent_ids` stating true or false
+        :rtype: np.ndarray
+        """
+        reached = self._agents.progress[agent_ids] == self._path_lengths[self._agents.path[agent_ids]] - 1
+        arrived = agent_ids[reached]
+        self._full_obs[self._agents.pos[arrived, 0], self._agents.pos[arrived, 1]] = GRID_IDS['empty']
+        return reached
+
+    def make_buffers(self):
+        """
+        Allocates the arrays to pass as `out` to `reset` and `step`, so that an episode reuses them instead of
+        building new observations, rewards and dones at every step.
+
+        :return: output arrays for this environment, see `StepBuffers`
+        :rtype: StepBuffers
         """
-        pos = self.agent_pos[agent_i]
-        
-        if pos in self._destination:
-            self._full_obs[pos[0]][pos[1]] = PRE_IDS['empty']
-            return True
-        return False
+        assert not self.full_observable, "the buffers hold the observation of each agent, not the full observation"
+        # the neighbor lists are built at every step, so there is no observations array to reuse
+        return StepBuffers(self.n_agents, None if self._neighbor_obs else self._obs_shape, self._encoding.dtype)
 
-    def get_agent_obs(self):
+    def get_agent_obs(self, out=None):
         """
         Computes the observations for the agents. Each agent receives information about cars in it's vision
-        range (a surrounding 3 × 3 neighborhood),where each car is represented by one-hot binary vector set {n, l, r},
-        that encodes its unique ID, current location and assigned route number respectively.
+        range (a surrounding (2r + 1) × (2r + 1) neighborhood, r = `view_radius`), where each car is represented by
+        one-hot binary vector set {n, l, r}, that encodes its unique ID, current location and assigned route number
+        respectively.
 
         The state vector s_j for each agent is thus a concatenation of all these vectors, having dimension
-        (3^2) × (|n| + |l| + |r|).
-
-        :return: list with observations of all agents. the full list has shape (n_agents, (3^2) × (|n| + |l| + |r|))
-        :rtype: list
+        (2r + 1)^2 × (|n| + |l| + |r|).
+
+        The features are stored with `obs_dtype` (uint8 by default) and with `id_encoding='index'` the one-hot id is
+        replaced by a single channel holding the 1-based id, so |n| = 1 whatever the number of agents, see
+        `ObservationEncoding`, which also packs the binary features 8 per byte for storage.
+
+        Without `out`, the observations are returned as a `LazyObservations` snapshot of the step: the window of an
+        agent is only built when it is read, so agents that ignore their observation or cars off the road cost
+        nothing. With `out`, the windows of all the agents are gathered in a single batched operation through arrays
+        allocated once, so the cost does not grow as Python loop iterations with the number of agents or the view
+        radius.
+
+        With `incremental_obs`, only the windows that changed since the last build are rewritten, in `out` if the same
+        array is given at every step and in an array owned by the environment otherwise, see `__update_obs`. That
+        array is returned instead of a snapshot, so it is overwritten by the next step.
+
+        With `neighbor_obs`, each agent gets the cars in its view as a fixed-capacity neighbor list (id, row, col,
+        route and offset from the center) instead of the dense window, see `NeighborObservation`; `to_dense` converts
+        it back on demand.
+
+        :param out: observations array of `make_buffers` to write into
+        :type out: np.ndarray
+
+        :return: sequence with the observation of each agent, shape (2r + 1, 2r + 1, |n| + |l| + |r|), that behaves as
+            a list of arrays, `out` when it is given, the persistent array of `incremental_obs`, the neighbor lists of
+            `neighbor_obs`, or a read-only (n_agents, n_agents * (2r + 1)^2 * F) array whose rows are views of the
+            same flattened joint observation when `full_observable`
+        :rtype: LazyObservations
         """
-        agent_no_mask_obs = []
+        positions = self._agents.pos
 
-        for agent_i in range(self.n_agents):
-            pos = self.agent_pos[agent_i]
+        # walls hold no car, so they share the empty cell features
+        np.maximum(self._full_obs, GRID_IDS['empty'], out=self._padded_interior)
 
-            # agent id
-            _agent_i_obs = [0 for _ in range(self.n_agents)]
-            _agent_i_obs[agent_i] = 1
+        if self._incremental_obs:
+            return self.__update_obs(self._persistent_obs if out is None else out)
 
-            # location
-            _agent_i_obs += [pos[0] , pos[1] ]  # coordinates
+        if self._neighbor_obs:
+            return gather_neighbors(self._padded_grid, self._cell_windows,
+                                    positions[:, 0] * self._grid_shape[1] + positions[:, 1], positions,
+                                    self._agents.route, self._view_radius, self._encoding)
 
-            # route 
-            route_agent_i = np.zeros(self._n_routes)
-            route_agent_i[self._agents_routes[agent_i] - 1] = 1
+        if out is None and not self.full_observable:
+            # the snapshot owns copies of the arrays that change at the next step
+            return LazyObservations(self._padded_grid.copy(), self._cell_windows, positions.copy(),
+                                    self._agents.route.copy(), self._encoding)
 
-            _agent_i_obs += route_agent_i.tolist()
+        # feature of each grid code: row 0 is a cell without a car and row i + 1 describes agent i. The ids are set
+        # once and the routes when the cars enter, only the coordinates change at every step
+        features = self._obs_features
+        features[1:, self._encoding.coordinates] = positions
 
-            agent_no_mask_obs.append(_agent_i_obs)
+        np.multiply(positions[:, 0], self._grid_shape[1], out=self._agent_cells)
+        np.add(self._agent_cells, positions[:, 1], out=self._agent_cells)
+        np.take(self._cell_windows, self._agent_cells, axis=0, out=self._window_cells, mode='clip')
+        np.take(self._padded_grid, self._window_cells, out=self._window_codes, mode='clip')
+        if out is not None:
+            return np.take(features, self._window_codes, axis=0, out=out, mode='clip')
 
-        agent_obs = []
-        for agent_i in range(self.n_agents):
-            pos = self.agent_pos[agent_i]
-            mask_view = np.zeros((*self._agent_view_mask, len(agent_no_mask_obs[0])), dtype=np.int)
-            for row in range(max(0, pos[0] - 2), min(pos[0] + 1 + 2, self._grid_shape[0])):
-                for col in range(max(0, pos[1] - 2), min(pos[1] + 1 + 2, self._grid_shape[1])):
-                    if PRE_IDS['agent'] in self._full_obs[row][col]:
-                        _id = int(self._full_obs[row][col].split(PRE_IDS['agent'])[1]) - 1
-                        mask_view[row - (pos[0] - 2), col - (pos[1] - 2), :] = agent_no_mask_obs[_id]
-                        
-            agent_obs.append(mask_view)
-
-        if self.full_observable:
-            _obs = np.array(agent_obs).flatten().tolist()
-            agent_obs = [_obs for _ in range(self.n_agents)]
-        return agent_obs
-
-    def __draw_base_img(self):
-        # create grid and make everything black
-        img = draw_grid(self._grid_shape[0], self._grid_shape[1], cell_size=CELL_SIZE, fill=WALL_COLOR)
-
-        # draw tracks
-        for i, row in enumerate(self._full_obs):
-            for j, col in enumerate(row):
-                if col == PRE_IDS['empty']:
-                    fill_cell(img, (i, j), cell_size=CELL_SIZE, fill=(143, 141, 136), margin=0.05)
-                elif col == PRE_IDS['wall']:
-                    fill_cell(img, (i, j), cell_size=CELL_SIZE, fill=(242, 227, 167), margin=0.02)
-
-        return img
-
-    def __create_grid(self):
-        # create a grid with every cell as wall
-        _grid = [[PRE_IDS['wall'] for _ in range(self._grid_shape[1])] for _ in range(self._grid_shape[0])]
-
-        # draw track by making cells empty :
-        # horizontal tracks
-        _grid[self._grid_shape[0] // 2 - 1] = [PRE_IDS['empty'] for _ in range(self._grid_shape[1])]
-        _grid[self._grid_shape[0] // 2] = [PRE_IDS['empty'] for _ in range(self._grid_shape[1])]
-
-        # vertical tracks
-        for row in range(self._grid_shape[0]):
-            _grid[row][self._grid_shape[1] // 2 - 1] = PRE_IDS['empty']
-            _grid[row][self._grid_shape[1] // 2] = PRE_IDS['empty']
-
-        return _grid
-
-    def step(self, agents_action):
+        # the joint observation is gathered once and every agent gets a read-only view of it, without copies
+        joint_obs = np.take(features, self._window_codes, axis=0).reshape(-1)
+        return np.broadcast_to(joint_obs, (self.n_agents, joint_obs.size))
+
+    def __update_obs(self, target):
+        """
+        Brings the observations in `target` up to date with the grid. A window changes only when one of its cells
+        changes: its code (a car moved, entered or left) or the position or route of the car in it. The windows
+        overlapping those cells, and the windows of the cars that moved, are gathered again, so the cost grows with
+        the number of cars that moved and not with the number of agents squared. Every window is gathered when
+        `target` is not the array of the last build (first build, reset, restored state or another `out`).
+
+        :param target: (n_agents, 2r + 1, 2r + 1, F) array holding the observations
+        :type target: np.ndarray
+
+        :return: `target`, or a read-only view of it when it is the persistent array of the environment
+        :rtype: np.ndarray
+        """
+        positions, routes = self._agents.pos, self._agents.route
+        codes = self._padded_interior
+        features = self._obs_features
+        features[1:, self._encoding.coordinates] = positions
+
+        np.multiply(positions[:, 0], self._grid_shape[1], out=self._agent_cells)
+        np.add(self._agent_cells, positions[:, 1], out=self._agent_cells)
+        if target is not self._obs_target:
+            np.take(self._cell_windows, self._agent_cells, axis=0, out=self._window_cells, mode='clip')
+            np.take(self._padded_grid, self._window_cells, out=self._window_codes, mode='clip')
+            np.take(features, self._window_codes, axis=0, out=target, mode='clip')
+        else:
+            # cells whose code changed and cells holding a car whose position or route changed
+            moved = (positions != self._last_pos).any(axis=1) | (routes != self._last_routes)
+            self._moved_codes[1:] = moved
+            changed_cells = np.flatnonzero((codes != self._last_codes) | self._moved_codes[codes])
+
+            # the windows centered within the view radius of a changed cell are the window of that cell, and each
+            # window is found by the padded index of its center
+            self._touched_windows[:] = False
+            self._touched_windows[self._cell_windows[changed_cells]] = True
+            dirty = self._touched_windows[self._cell_windows[self._agent_cells, self._view_radius, self._view_radius]]
+            dirty_ids = np.flatnonzero(dirty | moved)
+            if len(dirty_ids):
+                window_codes = self._padded_grid.take(self._cell_windows[self._agent_cells[dirty_ids]])
+                target[dirty_ids] = features.take(window_codes, axis=0)
+
+        self._obs_target = target
+        np.copyto(self._last_codes, codes)
+        np.copyto(self._last_pos, positions)
+        np.copyto(self._last_routes, routes)
+        return read_only(target) if target is self._persistent_obs else target
+
+    def get_full_obs_str(self):
+        """
+        Debug export of the occupancy grid in the string format ('W', '0', 'A7'). Only meant for inspection, the
+        environment itself never reads it.
+
+        :return: grid with one string per cell
+        :rtype: list
+        """
+        return [[PRE_IDS['wall'] if cell == GRID_IDS['wall'] else
+                 PRE_IDS['empty'] if cell == GRID_IDS['empty'] else
+                 PRE_IDS['agent'] + str(cell)
+                 for cell in row.tolist()] for row in self._full_obs]
+
+    def step(self, agents_action, out=None):
         """
         Performs an action in the environment and steps forward. At each step a new agent enters the road by
         one of the 4 gates according to a probability "_arrive_prob". A "ncoll" reward is given to an agent if it
         collides and all of them receive "-0.01*step_n" to avoid traffic jams.
 
-        :param agents_action: list of actions of all the agents to perform in the environment
+        With `out`, the step writes the observations, rewards, dones and collision counts into the buffers and
+        returns them instead of building new ones; the actions are then best given as the int8 `out.actions` array.
+        The per-car work of the step goes through arrays allocated once, only small temporaries sized by the number
+        of cars on the road remain (mostly in `resolve_collisions`), so the memory of a step does not grow.
+
+        With `fast_forward`, a step taken while no car is on the road and cars wait to enter first skips the steps
+        without arrival, see `__fast_forward`, and the number of skipped steps is reported in `info`.
+
+        With a `profiler`, the time of each phase of the step and its counters are recorded, see `StepProfiler`.
+
+        :param agents_action: list or array of actions of all the agents to perform in the environment
         :type agents_action: list
 
-        :return: agents observations, rewards, if agents are done and additional info
+        :param out: buffers created by `make_buffers`
+        :type out: StepBuffers
+
+        :return: agents observations, rewards, if agents are done and additional info (number of collisions in the step,
+            number of cascade rounds needed to resolve them and number of steps skipped before the step)
         :rtype: tuple
         """
         assert len(agents_action) == self.n_agents, \
             "Invalid action! It was expected to be list of {}" \
             " dimension but was found to be of {}".format(self.n_agents, len(agents_action))
 
-        assert all([action_i in ACTION_MEANING.keys() for action_i in agents_action]), \
-            "Invalid action found in the list of sampled actions {}" \
-            ". Valid actions are {}".format(agents_action, ACTION_MEANING.keys())
+        if isinstance(agents_action, np.ndarray):
+            assert 0 <= agents_action.min() and agents_action.max() < len(ACTION_MEANING), \
+                "Invalid action found in the array of sampled actions {}" \
+                ". Valid actions are {}".format(agents_action, ACTION_MEANING.keys())
+        else:
+            assert all([action_i in ACTION_MEANING.keys() for action_i in agents_action]), \
+                "Invalid action found in the list of sampled actions {}" \
+                ". Valid actions are {}".format(agents_action, ACTION_MEANING.keys())
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_step(self._step_count)
+            progress = int(self._agents.progress.sum())
+
+        skipped_steps, arrival = 0, None
+        if self._fast_forward and not len(self._active_ids) and self._waiting_cars:
+            skipped_steps, arrival = self.__fast_forward()
+            if profiler is not None:
+                profiler.lap('fast_forward')
 
         self._step_count += 1  # global environment step
-        rewards = [0 for _ in range(self.n_agents)]  # initialize rewards array
-        step_collisions = 0  # counts collisions in this step
 
-        # checks if there is a collision; this is done in the __update_agent_pos method
-        # we still need to check both agent_dones and on_the_road because an agent may not be done
-        # and have not entered the road yet 
-        
-        agent_curr_positions = []
-        agent_next_positions = []
-        
-        for agent_i, action in enumerate(agents_action):
-            if self._agent_dones[agent_i] and self._on_the_road[agent_i]:
-                agent_curr_positions += [[]]
-                agent_next_positions += [[]]
-                
-            if not self._agent_dones[agent_i] and self._on_the_road[agent_i]:
-                agent_curr_positions += [list(self.agent_pos[agent_i]),]
-                next_pos = self.__get_next_position(agent_i, action)
-                
-                if next_pos is None:
-                    agent_next_positions += [list(self.agent_pos[agent_i]),]
-                else:
-                    agent_next_positions += [list(next_pos),]
-        
-        step_collisions += self.__update_agent_pos(agent_curr_positions, agent_next_positions)
-        
-        for agent_i, action in enumerate(agents_action):
-            if not self._agent_dones[agent_i] and self._on_the_road[agent_i]:
-                self._agent_step_count[agent_i] += 1  # agent step count
-
-                # gives additional step punishment to avoid jams
-                # at every time step, where `τ` is the number time steps passed since the car arrived.
-                # We need to keep track of step_count of each car and that has to be multiplied.
-                #rewards[agent_i] += self._step_cost * self._agent_step_count[agent_i]
-            #self._total_episode_reward[agent_i] += rewards[agent_i]
-
-            # checks if destination was reached
-            # once a car reaches it's destination , it will never enter again in any of the tracks
-            # Also, if all cars have reached their destination, then we terminate the episode.
-            
-            if self.__reached_dest(agent_i):
-                self._agent_dones[agent_i] = True
-                self.curr_cars_count -= 1
-
-            # if max_steps was reached, terminate the episode
-            if self._step_count >= self._max_steps:
-                self._agent_dones[agent_i] = True
-
-        # adds new car according to the probability _arrive_prob
-        if random.uniform(0, 1) < self._arrive_prob:
+        agents = self._agents
+        if self._jit:
+            step_collisions, cascade_rounds, n_arrived, n_active, self._gates_taken = move_cars(
+                np.asarray(agents_action), self._active_ids, agents.pos, agents.path, agents.progress, agents.dones,
+                agents.step_count, self._full_obs, self._path_cells, self._path_lengths, self._cell_gate,
+                self._gates_taken, self._step_count, self._max_steps, self._step_curr_cells, self._step_next_cells)
+            self._active_ids = self._active_buffer[:n_active]
+            self.curr_cars_count -= n_arrived
+            if profiler is not None:
+                profiler.lap('move_cars_jit')
+        else:
+            step_collisions, cascade_rounds = self.__move_cars(agents_action)
+        n_waiting = len(self._waiting_cars)
+
+        # adds new car according to the probability _arrive_prob, unless the fast-forward already drew it
+        if arrival is None:
+            if self._schedule is not None:
+                arrival = bool(self._schedule.arrivals[self._step_count - 1])
+            else:
+                arrival = self.np_random.random() < self._arrive_prob
+        if arrival:
             free_gates = self.__is_gate_free()
             # if there are agents outside the road and if any gate is free
-            if not all(self._on_the_road) and free_gates:
+            if self._waiting_cars and free_gates:
                 # then gets first agent on the list which is not on the road
-                agent_to_enter = self._on_the_road.index(False)
-                pos = random.choice(free_gates)
-                self._agents_direction[agent_to_enter] = self._route_vectors[pos]
-                self.agent_pos[agent_to_enter] = pos
+                agent_to_enter = self._waiting_cars.popleft()
+                if self._schedule is not None:
+                    gate = self._schedule.gate(self._step_count, free_gates)
+                else:
+                    gate = free_gates[self.np_random.integers(len(free_gates))]
+                self.__place_car(agent_to_enter, gate, self.__draw_route(agent_to_enter))
                 self.curr_cars_count += 1
-                self._on_the_road[agent_to_enter] = True
-                self._agent_turned[agent_to_enter] = False
-                self._agents_routes[agent_to_enter] = random.randint(1, self._n_routes)  # (1, 3)
                 self.__update_agent_view(agent_to_enter)
+        if profiler is not None:
+            profiler.lap('spawn')
         time.sleep(0)
-        return self.get_agent_obs(), rewards, self._agent_dones, {'step_collisions': step_collisions}
 
-    def __get_next_direction(self, route, agent_i):
+        if out is not None:
+            out.rewards.fill(0)
+            np.copyto(out.dones, self._agents.dones)
+            out.step_collisions[()] = step_collisions
+            out.cascade_rounds[()] = cascade_rounds
+            out.skipped_steps[()] = skipped_steps
+            if profiler is not None:
+                profiler.lap('other')
+            observations = self.get_agent_obs(out.observations)
+            if profiler is not None:
+                self.__end_profiled_step(progress, step_collisions, cascade_rounds, n_waiting)
+            return observations, out.rewards, out.dones, out.info
+
+        if profiler is not None:
+            profiler.lap('other')
+        observations = self.get_agent_obs()
+        if profiler is not None:
+            self.__end_profiled_step(progress, step_collisions, cascade_rounds, n_waiting)
+        rewards = [0 for _ in range(self.n_agents)]  # initialize rewards array
+        return observations, rewards, self._agent_dones, {'step_collisions': int(step_collisions),
+                                                          'cascade_rounds': int(cascade_rounds),
+                                                          'skipped_steps': skipped_steps}
+
+    def __end_profiled_step(self, progress, step_collisions, cascade_rounds, n_waiting):
+        # the cars that moved are read from the progress along the paths, which only grows when a car advances
+        self.profiler.lap('observations')
+        self.profiler.end_step(cars_moved=int(self._agents.progress.sum()) - progress,
+                               conflicts=int(step_collisions), restarts=int(cascade_rounds),
+                               spawns=n_waiting - len(self._waiting_cars))
+
+    def __fast_forward(self):
         """
-        Computes the new direction vector after the cars turn on the junction for route 2 (turn right) and 3 (turn left)
-        :param route: route that was assigned to the car (1 - fwd, 2 - turn right, 3 - turn left)
-        :type route: int
+        Skips the steps of an empty road that end without an arrival. Such a step only draws the arrival with
+        probability `_arrive_prob`, so the number of steps until the next arrival follows a geometric distribution:
+        it is sampled once and the step counter jumps to the step right before it. That step is then taken normally
+        with the arrival already decided. If the episode ends first, it jumps to the last step, which has no arrival.
+        The episodes have the same distribution as when stepping one step at a time. With a schedule, the step counter
+        jumps to its next arrival instead, so the episode is the same as when stepping one step at a time.
+
+        :return: number of steps skipped and if a car arrives at the step taken after them
+        :rtype: tuple
+        """
+        steps_left = self._max_steps - self._step_count  # including the step being taken
+        if steps_left <= 1:
+            return 0, None
+
+        if self._schedule is not None:
+            steps_to_arrival = self._schedule.next_arrival(self._step_count + 1)
+        elif self._arrive_prob >= 1:
+            steps_to_arrival = 1
+        elif self._arrive_prob <= 0:
+            steps_to_arrival = math.inf
+        else:
+            # inverse transform of the geometric distribution, 1 - random() lies in (0, 1]
+            steps_to_arrival = 1 + int(math.log(1.0 - self.np_random.random()) / math.log1p(-self._arrive_prob))
 
-        :param agent_i: id of the agent
-        :type agent_i: int
+        skipped_steps = min(steps_to_arrival, steps_left) - 1
+        self._step_count += skipped_steps
+        return skipped_steps, steps_to_arrival <= steps_left
 
-        :return: new direction vector following the assigned route
-        :rtype: tuple
+    def __move_cars(self, agents_action):
         """
-        # gets current direction vector
-        dir_vector = self._agents_direction[agent_i]
+        Moves the cars of the pure-Python step: every active car that gas advances one cell along its path, conflicts
+        are resolved by `__update_agent_pos`, cars at their destination are removed and all of them are done once
+        `max_steps` is reached. Only the active cars are touched. The JIT kernel `move_cars` applies the same rules.
 
-        sig = (1 if dir_vector[1] != 0 else -1) if route == 2 else (-1 if dir_vector[1] != 0 else 1)
-        new_dir_vector = (dir_vector[1] * sig, 0) if dir_vector[0] == 0 else (0, dir_vector[0] * sig)
+        :param agents_action: list of actions of all the agents to perform in the environment
+        :type agents_action: list
 
-        return new_dir_vector
+        :return: number of collisions and number of cascade rounds needed to resolve them
+        :rtype: tuple
+        """
+        agents = self._agents
 
-    def __update_agent_pos(self, agent_curr_positions, agent_next_positions):
+        # checks if there is a collision; this is done in the __update_agent_pos method
+        # only the active cars (on the road and not done) move. Positions are flat grid indices, gathered into the
+        # work arrays of the step
+        active_ids = self._active_ids
+        n_active = len(active_ids)
+        gas = np.take(np.equal(agents_action, GAS, out=self._step_gas), active_ids, out=self._step_flags[:n_active])
+        path_index = np.multiply(np.take(agents.path, active_ids, out=self._step_path[:n_active]),
+                                 self._path_cells.shape[1], out=self._step_path_index[:n_active])
+        path_index += np.take(agents.progress, active_ids, out=self._step_progress[:n_active])
+        agent_curr_cells = np.take(self._flat_path_cells, path_index, out=self._step_curr_cells[:n_active])
+        path_index += gas
+        agent_next_cells = np.take(self._flat_path_cells, path_index, out=self._step_next_cells[:n_active])
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.lap('next_positions')
+
+        step_collisions, cascade_rounds = self.__update_agent_pos(active_ids, agent_curr_cells, agent_next_cells)
+        if profiler is not None:
+            profiler.lap('update_agent_pos')
+
+        # agent step count
+        # gives additional step punishment to avoid jams
+        # at every time step, where `τ` is the number time steps passed since the car arrived.
+        # We need to keep track of step_count of each car and that has to be multiplied.
+        agents.step_count[active_ids] += 1
+
+        # checks if destination was reached
+        # once a car reaches it's destination , it will never enter again in any of the tracks
+        # Also, if all cars have reached their destination, then we terminate the episode.
+        reached_dest = self.__reached_dest(active_ids)
+        agents.dones[active_ids[reached_dest]] = True
+        n_arrived = int(np.count_nonzero(reached_dest))
+        self.curr_cars_count -= n_arrived
+        # the cars left are compacted at the start of the buffer
+        self._active_buffer[:n_active - n_arrived] = active_ids[~reached_dest]
+        self._active_ids = self._active_buffer[:n_active - n_arrived]
+
+        # if max_steps was reached, terminate the episode
+        if self._step_count >= self._max_steps:
+            agents.dones[:] = True
+            self._active_ids = self._active_buffer[:0]
+        if profiler is not None:
+            profiler.lap('destinations')
+
+        return step_collisions, cascade_rounds
+
+    def __update_agent_pos(self, agent_ids, agent_curr_cells, agent_next_cells):
         """
-        Updates the agent position in the environment. Moves can be 0 (GAS) or 1 (BRAKE). If the move is 1 does nothing,
-        car remains stopped. If the move is 0 then evaluate the route assigned. If the route is 1 (forward) then
-        maintain the same direction vector. Otherwise, compute new direction vector and apply the change of direction
-        when the junction turning place was reached. After the move is made, verifies if it resulted into a collision
-        and returns the reward collision if that happens. The position is only updated if no collision occurred.
+        Updates the agent positions in the environment after each car picked its next cell (the current one if it
+        braked). Conflicts are resolved by `resolve_collisions`: a car that stopped in a cell has priority over the cars
+        wanting it, otherwise the lowest id wins, and a car that collides stays in its current cell, possibly making
+        the cars behind it collide too. The position is only updated if no collision occurred.
 
-        :param agent_i: id of the agent
-        :type agent_i: int
+        :param agent_ids: ascending ids of the cars on the road
+        :type agent_ids: np.ndarray
 
-        :param move: move picked by the agent_i
-        :type move: int
+        :param agent_curr_cells: flat grid index of the current cell of each car of `agent_ids`
+        :type agent_curr_cells: np.ndarray
 
-        :return: bool flag associated to the existence or absence of a collision
-        :rtype: bool
-        """
-        collided_agents_i = []
-        new_agents_positions = []
-
-        agent_i = 0
-        while agent_i < len(agent_next_positions):
-            next_pos = agent_next_positions[agent_i]
-
-            # agent has finished his run in this episode
-            if next_pos == []:
-                agent_i += 1
-                new_agents_positions.append(next_pos)
-                continue
-            
-            n_next_pos = agent_next_positions.count(next_pos)
-            
-            # only one agent going to that position
-            if n_next_pos == 1:
-                # if its the same position doesn't update
-                if next_pos == agent_curr_positions[agent_i]:
-                    agent_i += 1
-                    new_agents_positions.append(next_pos)
-                    continue
-                
-                else:
-                    new_collision = False
-                    # if the agent is in the collided
-                    if agent_i in collided_agents_i:
-                        # if the agent is in the collided his new position will be his current
-                        # but first verify if by using the current no agent will collide, if not add them to collide
-                        for pos in agent_next_positions:
-                            if agent_curr_positions[agent_i] == pos and (agent_next_positions.index(pos) not in collided_agents_i):
-                                new_collision = True
-                                collided_agents_i.append(agent_next_positions.index(pos))
-                                agent_i = -1
-                                new_agents_positions.clear()
-                                break
-                        # if there is not a new collision caused by him stopping, update his new position to his curr
-                        if not new_collision:
-                            new_collision = False
-                            new_agents_positions.append(agent_curr_positions[agent_i])
-                    else:
-                        new_agents_positions.append(next_pos)               
-                        
-            # more than one car wants the same next_pos    
-            elif n_next_pos > 1:
-                # if its the same position doesn't update, and doesn't collide
-                if next_pos == agent_curr_positions[agent_i]:
-                    agent_i += 1
-                    new_agents_positions.append(next_pos)
-                    continue
-                
-                new_collision = False          
-                    
-                # if the agent is in the collided
-                if agent_i in collided_agents_i:
-                    # if the agent is in the collided his new position will be his current
-                    # but first verify if by using the current no agent will collide, if not add them to collide
-                    for pos in agent_next_positions:
-                        if agent_curr_positions[agent_i] == pos and (agent_next_positions.index(pos) not in collided_agents_i):
-                            new_collision = True
-                            collided_agents_i.append(agent_next_positions.index(pos))
-                            agent_i = -1
-                            new_agents_positions.clear()
-                            break
-                    
-                    # if there is not a new collision caused by him stopping, update his new position to his curr
-                    if not new_collision:
-                        new_collision = False
-                        new_agents_positions.append(agent_curr_positions[agent_i])
-
-                else:                    
-                    # if both want the same next position, get the agents_ids
-                    agents_ids = self.__find_indices(agent_next_positions, next_pos)
-                    flag_agent_stopped = False
-                    
-                    for i in agents_ids:
-                        # verifies if the agent stopped, if he has that agent will have priority
-                        if agent_next_positions[i] == agent_curr_positions[i]:
-                            flag_agent_stopped = True
-                            break
-                               
-                    # if one of the cars that want that position has stopped there, it has priority over everyone
-                    if flag_agent_stopped:
-                        # if its not the current agent that has stopped, it does not have priority
-                        if i != agent_i:
-                            if agent_i not in collided_agents_i:
-                                collided_agents_i.append(agent_i)
-                                agent_i = -1
-                                new_agents_positions.clear()
-                        flag_agent_stopped = False    
-                        
-                    else:
-                        new_collision = False
-                        # the lowest id will have priority, update his movement if the next agent didn't want to stop
-                        for ids in agents_ids:
-                            if (ids != agents_ids[0]) and (ids not in collided_agents_i):
-                                new_collision = True
-                                collided_agents_i.append(ids)
-                        
-                        if agent_i == agents_ids[0] and not new_collision:
-                            new_agents_positions.append(next_pos)    
-                        
-                        if new_collision:
-                            agent_i = -1
-                            new_agents_positions.clear()  
-                            new_collision = False        
-                                                              
-            agent_i += 1
-           
-        agent_i = 0
-        while agent_i < len(agent_next_positions):
-            if new_agents_positions[agent_i] == []:
-                agent_i += 1
-                continue
-            elif new_agents_positions[agent_i] == agent_curr_positions[agent_i]:
-                self.agent_pos[agent_i] = tuple(new_agents_positions[agent_i])
-                self.__update_agent_view(agent_i)
-                agent_i += 1
-                continue
-            else:
-                self.agent_pos[agent_i] = tuple(new_agents_positions[agent_i])
-                self._full_obs[agent_curr_positions[agent_i][0]][agent_curr_positions[agent_i][1]] = PRE_IDS['empty']
-                self.__update_agent_view(agent_i)
-                agent_i += 1
-           
-           
-
-        return len(collided_agents_i)
-    
-    def __find_indices(self, list_to_check, item_to_find):
-        indices = []
-        for idx, value in enumerate(list_to_check):
-            if value == item_to_find:
-                indices.append(idx)
-        return indices                                                  
-    
-    def __get_next_position(self, agent_i, action):
-        
-        curr_pos = copy.copy(self.agent_pos[agent_i])
-        next_pos = None
-        route = self._agents_routes[agent_i]
-        if action == 0:  # GAS
-            if route == 1:
-                next_pos = tuple([curr_pos[i] + self._agents_direction[agent_i][i] for i in range(len(curr_pos))])
-            else:
-                turn_pos = self._turning_places[self._agents_direction[agent_i]]
-                # if the car reached the turning position in the junction for his route and starting gate
-                if curr_pos == turn_pos[route - 2] and not self._agent_turned[agent_i]:
-                    new_dir_vector = self.__get_next_direction(route, agent_i)
-                    self._agents_direction[agent_i] = new_dir_vector
-                    self._agent_turned[agent_i] = True
-                    next_pos = tuple([curr_pos[i] + new_dir_vector[i] for i in range(len(curr_pos))])
-                else:
-                    next_pos = tuple([curr_pos[i] + self._agents_direction[agent_i][i] for i in range(len(curr_pos))])
-        elif action == 1:  # BRAKE
-            pass
-        else:
-            raise Exception('Action Not found!')
-        
-        return next_pos
-            
+        :param agent_next_cells: flat grid index of the cell each car of `agent_ids` wants to move to
+        :type agent_next_cells: np.ndarray
 
-    def reset(self):
+        :return: number of collisions and number of cascade rounds needed to resolve them
+        :rtype: tuple
+        """
+        new_cells, n_collisions, cascade_rounds = resolve_collisions(agent_curr_cells, agent_next_cells,
+                                                                     self._full_obs.size)
+        moved = np.not_equal(new_cells, agent_curr_cells, out=self._step_flags[:len(agent_ids)])
+        self._agents.progress[agent_ids] += moved
+
+        # vacated cells are cleared before any car is written, otherwise a car that follows into the cell just
+        # left by a car with a higher id would be erased from the grid
+        grid = self._full_obs.reshape(-1)
+        grid[agent_curr_cells[moved]] = GRID_IDS['empty']
+
+        rows, cols = self._step_pos[:, :len(agent_ids)]
+        np.divmod(new_cells, self._grid_shape[1], out=(rows, cols))
+        self._agents.pos[agent_ids, 0] = rows
+        self._agents.pos[agent_ids, 1] = cols
+        grid[new_cells] = np.add(agent_ids, 1, out=rows)
+
+        # cars only enter a gate cell when they spawn, so only the gates left have to be updated
+        for gate in self._cell_gate[agent_curr_cells[moved]].tolist():
+            if gate >= 0:
+                self._gates_taken &= ~(1 << gate)
+
+        return n_collisions, cascade_rounds
+
+    def reset(self, out=None, seed=None, schedule=None):
         """
         Resets the environment when a terminal state is reached. 
 
-        :return: list with the observations of the agents
+        :param out: buffers created by `make_buffers`, the observations are written into them
+        :type out: StepBuffers
+
+        :param seed: if given, the generator is reseeded first, see `seed`, so the episode only depends on it
+        :type seed: int
+
+        :param schedule: if given, the gates, arrivals and routes of the episode are replayed from it instead of
+            drawn, see `sample_schedule`
+        :type schedule: ArrivalSchedule
+
+        :return: list with the observations of the agents, or the observations array of `out` when it is given
         :rtype: list
         """
+        if seed is not None:
+            self.seed(seed)
+        if self.profiler is not None:
+            self.profiler.end_episode()
+        if schedule is not None:
+            assert len(schedule.gates) == len(self._entry_gates) and len(schedule.routes) == self.n_agents \
+                and len(schedule.arrivals) == len(schedule.gate_draws) == self._max_steps, \
+                "the schedule was sampled for an environment with different gates, agents or max_steps"
+        self._schedule = schedule
         self._total_episode_reward = [0 for _ in range(self.n_agents)]
         self._step_count = 0
-        self._agent_step_count = [0 for _ in range(self.n_agents)]
-        self._agent_dones = [False for _ in range(self.n_agents)]
-        self._on_the_road = [False for _ in range(self.n_agents)]
-        self._agent_turned = [False for _ in range(self.n_agents)]
+        self._agents.reset()
+        self._active_ids = self._active_buffer[:0]
+        self._waiting_cars.clear()
+        self._gates_taken = 0
         self.curr_cars_count = 0
+        self._obs_target = None
 
-        self.agent_pos = {}
         self.__init_full_obs()
 
+        if out is not None:
+            out.rewards.fill(0)
+            out.dones.fill(False)
+            out.step_collisions[()] = 0
+            out.cascade_rounds[()] = 0
+            out.skipped_steps[()] = 0
+            return self.get_agent_obs(out.observations)
         return self.get_agent_obs()
 
+    def active_agents(self):
+        """
+        :return: ids of the cars on the road and not done, in ascending order, as a read-only copy that the next step
+            leaves unchanged
+        :rtype: np.ndarray
+        """
+        return read_only(self._active_ids.copy())
+
+    def next_waiting_agent(self):
+        """
+        :return: id of the car that enters the road at the next arrival, None if no car is waiting
+        :rtype: int
+        """
+        return self._waiting_cars[0] if self._waiting_cars else None
+
+    def sample_schedule(self, rng=None):
+        """
+        Samples the arrivals of an episode of this environment, to replay with `reset(schedule=...)`.
+
+        :param rng: generator to draw from, the generator of the environment by default
+        :type rng: np.random.Generator
+
+        :return: the schedule
+        :rtype: ArrivalSchedule
+        """
+        return ArrivalSchedule.sample(self.np_random if rng is None else rng, self.n_agents, len(self._entry_gates),
+                                      self._n_routes, self._max_steps, self._arrive_prob)
+
+    def get_state(self):
+        """
+        Captures the dynamic state of the environment: the cars, the step counters, the grid occupancy and the state
+        of the generator used for the arrivals. The layout, the base image and the viewer are left out, so
+        taking and restoring a snapshot is much cheaper than copying the environment.
+
+        :return: immutable snapshot, see `set_state`
+        :rtype: TrafficJunctionState
+        """
+        return TrafficJunctionState(step_count=self._step_count,
+                                    curr_cars_count=self.curr_cars_count,
+                                    grid=read_only(self._full_obs.copy()),
+                                    agents=self._agents.snapshot(),
+                                    active_ids=read_only(self._active_ids.copy()),
+                                    waiting_cars=tuple(self._waiting_cars),
+                                    gates_taken=self._gates_taken,
+                                    rng_state=self.np_random.bit_generator.state,
+                                    schedule=self._schedule)
+
+    def set_state(self, state):
+        """
+        Restores a snapshot taken by `get_state` on an environment with the same configuration. The generator of the
+        environment is restored too, so the environment continues exactly as it did after the snapshot was taken.
+
+        :param state: snapshot to restore
+        :type state: TrafficJunctionState
+        """
+        assert state.grid.shape == self._full_obs.shape and len(state.agents[0]) == self.n_agents, \
+            "the state was taken on an environment with a different grid or number of agents"
+
+        self._step_count = state.step_count
+        self.curr_cars_count = state.curr_cars_count
+        np.copyto(self._full_obs, state.grid)
+        self._agents.restore(state.agents)
+        self._active_buffer[:len(state.active_ids)] = state.active_ids
+        self._active_ids = self._active_buffer[:len(state.active_ids)]
+        self._waiting_cars = deque(state.waiting_cars)
+        self._gates_taken = state.gates_taken
+        self.__refresh_route_features()
+        self._obs_target = None
+        self.np_random.bit_generator.state = state.rng_state
+        self._schedule = state.schedule
+
     def render(self, mode: str = 'human'):
-        img = copy.copy(self._base_img)
+        img = copy.copy(self._layers.base_image(CELL_SIZE, WALL_COLOR))
 
         for agent_i in range(self.n_agents):
             if not self._agent_dones[agent_i] and self._on_the_road[agent_i]:
@@ -613,10 +840,19 @@ class TrafficJunction(gym.Env):
             self.viewer.imshow(img)
             return self.viewer.isopen
 
-    def seed(self, n: int):
-        self.np_random, seed1 = seeding.np_random(n)
-        seed2 = seeding.hash_seed(seed1 + 1) % 2 ** 31
-        return [seed1, seed2]
+    def seed(self, n=None):
+        """
+        Replaces the generator the spawns and routes are drawn from.
+
+        :param n: seed of `np.random.default_rng`: an int, a sequence of ints, a SeedSequence (see `stream_seed`) or
+            a Generator used as is
+        :type n: int
+
+        :return: the seed
+        :rtype: list
+        """
+        self.np_random = np.random.default_rng(n)
+        return [n]
 
     def close(self):
         if self.viewer is not None:
@@ -647,8 +883,17 @@ ACTION_MEANING = {
     1: "BRAKE",
 }
 
+GAS = 0
+
+# string representation of the grid, only used by the debug export `get_full_obs_str`
 PRE_IDS = {
     'wall': 'W',
     'empty': '0',
     'agent': 'A'
 }
+
+# integer representation of the grid; cells holding a car store its 1-based agent id
+GRID_IDS = {
+    'wall': -1,
+    'empty': 0
+}
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+
+import gym
+import numpy as np
+from gym import spaces
+
+from .traffic_junction import ACTION_MEANING, AGENTS_COLORS, CELL_SIZE, GAS, GRID_IDS, WALL_COLOR
+from ..utils_traffic_junction.action_space import MultiAgentActionSpace
+from ..utils_traffic_junction.agent_state import AgentPositions, AgentState, read_only
+from ..utils_traffic_junction.collisions import resolve_collisions_sparse
+from ..utils_traffic_junction.draw import draw_grid, fill_cell, write_cell_text
+from ..utils_traffic_junction.geometry import junction_geometry
+from ..utils_traffic_junction.lazy_observations import LazyObservations
+from ..utils_traffic_junction.observation_encoding import N_ROUTES, ObservationEncoding
+from ..utils_traffic_junction.observation_builder import window_cells
+from ..utils_traffic_junction.observation_space import FeatureBox, MultiAgentObservationSpace
+from ..utils_traffic_junction.route_paths import build_network_paths
+from ..utils_traffic_junction.step_buffers import StepBuffers
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficNetwork(gym.Env):
+    """
+    Road network of `blocks` (N x M) 4-way junctions tiled on one grid, each junction in a block of `block_shape`
+    cells laid out as the junction of TrafficJunction (see `JunctionGeometry`). Lanes run across the whole grid, so
+    cars enter at the 2 * (N + M) gates on the border and cross several junctions: a car on route 2 or 3 turns right or
+    left at one of the junctions on its way, drawn when it enters, and leaves the grid at the border.
+
+    The rules are the ones of TrafficJunction: a car gasses to the next cell of its path or brakes, conflicts are
+    resolved with the same priorities, cars are removed at their destination and every car is done after `max_steps`
+    steps. At each step a new car arrives at every free gate with probability `arrive_prob`, as long as cars are waiting
+    to enter; cars enter in id order and at most `n_max` cars exist in an episode.
+
+    To handle thousands of cars, a step only touches the cars on the road, with arrays the size of the cars: conflicts
+    are resolved by sorting the cells the cars want (`resolve_collisions_sparse`) and the cars are indexed by junction
+    after each step, so `cars_in_junction` and `neighbors` only look at the cars of the blocks around a position.
+
+    The observations have the format of `TrafficJunction.get_agent_obs`, so the agents of the junction act on the
+    network unchanged (given the geometry of the network), but they are only built when an agent reads them, see
+    `LazyObservations`.
+    """
+    metadata = {'render.modes': ['human', 'rgb_array']}
+
+    def __init__(self, blocks=(2, 2), block_shape=(14, 14), step_cost=-0.01, n_max=64, collision_reward=-10,
+                 arrive_prob=0.5, max_steps: int = 100, view_radius: int = 2, seed=None):
+        assert 1 <= n_max <= np.iinfo(np.int32).max - 1, "n_max should be a positive number of cars"
+        assert 0 <= arrive_prob <= 1, "arrive probability should be in range [0,1]"
+        assert len(blocks) == 2 and min(blocks) >= 1, 'the network should have at least one row and column of blocks'
+        assert 1 <= max_steps, "max_steps should be more than 1"
+        assert 0 <= view_radius, "view_radius should be a non negative number of cells"
+
+        self._blocks = tuple(blocks)
+        self._grid_shape = (blocks[0] * block_shape[0], blocks[1] * block_shape[1])
+        self.n_agents = n_max
+        self._max_steps = max_steps
+        self._step_count = None
+        self._collision_reward = collision_reward
+        self._arrive_prob = arrive_prob
+        self._step_cost = step_cost
+        self.curr_cars_count = 0
+        self._n_routes = N_ROUTES
+        self._view_radius = view_radius
+        self._agent_view_mask = (2 * view_radius + 1, 2 * view_radius + 1)
+
+        # layout of every junction derived from the grid shape, shared with the agents, see `JunctionGeometry`
+        self._geometry = junction_geometry(self._grid_shape, self._blocks)
+        self._entry_gates = np.array(self._geometry.entry_gates)
+
+        # cars follow the path of their gate, route and junction where they turn, see `build_network_paths`
+        self._path_positions, self._path_lengths, self._path_index, self._gate_turns = build_network_paths(
+            self._geometry, self._n_routes)
+        self._path_cells = self._path_positions[..., 0] * self._grid_shape[1] + self._path_positions[..., 1]
+        # index of the entry gate in each flat cell, -1 elsewhere
+        self._cell_gate = np.full(self._grid_shape[0] * self._grid_shape[1], -1, dtype=np.int64)
+        self._cell_gate[self._entry_gates[:, 0] * self._grid_shape[1] + self._entry_gates[:, 1]] = \
+            np.arange(len(self._entry_gates))
+        self._cell_junction = self._geometry.junction_index.reshape(-1)
+
+        # the arrivals, routes and turns are drawn from a generator of the environment, see `TrafficJunction.seed`
+        self.np_random = np.random.default_rng(seed)
+
+        # state of every car as contiguous arrays updated in place, see `AgentState`
+        self._agents = AgentState(self.n_agents)
+        self.agent_pos = AgentPositions(self._agents.pos)
+        self._agents_routes = read_only(self._agents.route)
+        self._on_the_road = read_only(self._agents.on_road)
+        self._agent_dones = read_only(self._agents.dones)
+        self._agent_step_count = read_only(self._agents.step_count)
+
+        # only the cars on the road and not done are stepped, in ascending id order; the cars waiting to enter are
+        # the ids from `_next_car` on, since they enter in id order
+        self._active_ids = np.empty(0, dtype=np.int64)
+        self._next_car = 0
+        self._gates_taken = np.zeros(len(self._entry_gates), dtype=np.bool_)
+
+        # cars of the road grouped by junction, as in a CSR matrix: the cars of junction j are
+        # `_junction_cars[_junction_ptr[j]:_junction_ptr[j + 1]]`, by ascending id
+        self._junction_cars = np.empty(0, dtype=np.int64)
+        self._junction_ptr = np.zeros(self._geometry.n_junctions + 1, dtype=np.int64)
+
+        self._track_grid = np.full(self._grid_shape, GRID_IDS['wall'], dtype=np.int32)
+        self._track_grid[self._geometry.road] = GRID_IDS['empty']
+        self._full_obs = self._track_grid.copy()
+        self._cell_windows = window_cells(self._grid_shape, view_radius)
+        self._base_img = None
+        self.viewer = None
+
+        # a single space is shared by every agent, the spaces of thousands of agents would not fit in memory
+        self.action_space = MultiAgentActionSpace([spaces.Discrete(2)] * self.n_agents)
+        # the coordinates of a large network do not fit in uint8, see `ObservationEncoding`
+        self._encoding = ObservationEncoding(self.n_agents, self._n_routes, self._grid_shape, dtype=np.int16)
+        self.observation_space = MultiAgentObservationSpace.shared(
+            FeatureBox(self._encoding.high, (*self._agent_view_mask, self._encoding.n_features), self._encoding.dtype),
+            self.n_agents)
+
+    @property
+    def geometry(self):
+        """
+        :return: layout of the network, to give to the agents
+        :rtype: JunctionGeometry
+        """
+        return self._geometry
+
+    def action_space_sample(self):
+        return [agent_action_space.sample() for agent_action_space in self.action_space]
+
+    def make_buffers(self):
+        """
+        Allocates the arrays to pass as `out` to `reset` and `step`. The observations are built on demand, so the
+        buffers hold no observations array.
+
+        :return: output arrays for this environment, see `StepBuffers`
+        :rtype: StepBuffers
+        """
+        return StepBuffers(self.n_agents, None)
+
+    def get_agent_obs(self):
+        """
+        Snapshot of the observations of the agents at this step, see `LazyObservations`. Each agent observes the
+        cars of the (2r + 1) × (2r + 1) neighborhood around it (r = `view_radius`), each car represented by its one-hot
+        id, its coordinates and its one-hot route, as in `TrafficJunction.get_agent_obs`.
+
+        :return: sequence with the observation of each agent, built when it is read
+        :rtype: LazyObservations
+        """
+        r = self._view_radius
+        padded_grid = np.zeros((self._grid_shape[0] + 2 * r, self._grid_shape[1] + 2 * r), dtype=self._full_obs.dtype)
+        # walls hold no car, so they share the empty cell features
+        np.maximum(self._full_obs, GRID_IDS['empty'], out=padded_grid[r:r + self._grid_shape[0],
+                                                                      r:r + self._grid_shape[1]])
+        return LazyObservations(padded_grid, self._cell_windows, self._agents.pos.copy(), self._agents.route.copy(),
+                                self._encoding)
+
+    def cars_in_junction(self, junction):
+        """
+        :param junction: row-major index of the block of the junction, see `JunctionGeometry.junction_index`
+        :type junction: int
+
+        :return: ascending ids of the cars on the road in the block of `junction`
+        :rtype: np.ndarray
+        """
+        return self._junction_cars[self._junction_ptr[junction]:self._junction_ptr[junction + 1]]
+
+    def neighbors(self, agent_i, radius=None):
+        """
+        Cars on the road at most `radius` cells away from car `agent_i` on each axis (its view by default), looking
+        only at the cars of the blocks that the square around it overlaps.
+
+        :param agent_i: id of the car
+        :type agent_i: int
+
+        :param radius: number of cells on each side, `view_radius` if not given
+        :type radius: int
+
+        :return: ascending ids of the neighbors, without `agent_i`
+        :rtype: np.ndarray
+        """
+        radius = self._view_radius if radius is None else radius
+        row, col = self._agents.pos[agent_i].tolist()
+        block_rows, block_cols = self._geometry.block_shape
+        first_row, last_row = max(row - radius, 0) // block_rows, min(row + radius, self._grid_shape[0] - 1) // block_rows
+        first_col, last_col = max(col - radius, 0) // block_cols, min(col + radius, self._grid_shape[1] - 1) // block_cols
+        candidates = np.concatenate([self.cars_in_junction(block_row * self._blocks[1] + block_col)
+                                     for block_row in range(first_row, last_row + 1)
+                                     for block_col in range(first_col, last_col + 1)])
+        offsets = np.abs(self._agents.pos[candidates].astype(np.int64) - (row, col)).max(axis=1)
+        return np.sort(candidates[(offsets <= radius) & (candidates != agent_i)])
+
+    def reset(self, out=None, seed=None):
+        """
+        Starts a new episode: one car is placed at each entry gate, at shuffled gates, and the other cars wait outside
+        the road at (0, 0).
+
+        :param out: buffers created by `make_buffers`
+        :type out: StepBuffers
+
+        :param seed: if given, the generator is reseeded first, see `TrafficJunction.seed`
+        :type seed: int
+
+        :return: observations of the agents
+        :rtype: LazyObservations
+        """
+        if seed is not None:
+            self.seed(seed)
+        self._step_count = 0
+        self._agents.reset()
+        np.copyto(self._full_obs, self._track_grid)
+        self._active_ids = np.empty(0, dtype=np.int64)
+        self._next_car = 0
+        self._gates_taken[:] = False
+        self.curr_cars_count = 0
+
+        n_placed = min(self.n_agents, len(self._entry_gates))
+        self.__place_cars(self.np_random.permutation(len(self._entry_gates))[:n_placed])
+        self.__index_junctions()
+
+        if out is not None:
+            out.rewards.fill(0)
+            out.dones.fill(False)
+            out.step_collisions[()] = 0
+            out.cascade_rounds[()] = 0
+        return self.get_agent_obs()
+
+    def step(self, agents_action, out=None):
+        """
+        Moves every car on the road that gasses one cell along its path, resolves the conflicts, removes the cars at
+        their destination and lets new cars in, see TrafficJunction.step.
+
+        :param agents_action: list or array of actions of all the agents
+        :type agents_action: list
+
+        :param out: buffers created by `make_buffers`
+        :type out: StepBuffers
+
+        :return: agents observations, rewards, if agents are done and additional info (number of collisions in the step
+            and number of cascade rounds needed to resolve them)
+        :rtype: tuple
+        """
+        assert len(agents_action) == self.n_agents, \
+            "Invalid action! It was expected to be list of {}" \
+            " dimension but was found to be of {}".format(self.n_agents, len(agents_action))
+        actions = np.asarray(agents_action)
+        assert 0 <= actions.min() and actions.max() < len(ACTION_MEANING), \
+            "Invalid action found in the sampled actions. Valid actions are {}".format(ACTION_MEANING.keys())
+
+        self._step_count += 1
+        agents = self._agents
+
+        active_ids = self._active_ids
+        gas = actions[active_ids] == GAS
+        paths, progress = agents.path[active_ids], agents.progress[active_ids]
+        curr_cells = self._path_cells[paths, progress]
+        next_cells = self._path_cells[paths, progress + gas]
+        new_cells, step_collisions, cascade_rounds = resolve_collisions_sparse(curr_cells, next_cells)
+
+        # vacated cells are cleared before the cars are written in their new cells
+        moved = new_cells != curr_cells
+        agents.progress[active_ids] += moved
+        grid = self._full_obs.reshape(-1)
+        grid[curr_cells[moved]] = GRID_IDS['empty']
+        grid[new_cells] = active_ids + 1
+        agents.pos[active_ids] = np.stack(np.divmod(new_cells, self._grid_shape[1]), axis=-1)
+        agents.step_count[active_ids] += 1
+
+        # cars only enter a gate cell when they spawn, so only the gates left have to be updated
+        left_gates = self._cell_gate[curr_cells[moved]]
+        self._gates_taken[left_gates[left_gates >= 0]] = False
+
+        # cars at the end of their path are removed from the road
+        reached_dest = agents.progress[active_ids] == self._path_lengths[paths] - 1
+        grid[new_cells[reached_dest]] = GRID_IDS['empty']
+        agents.dones[active_ids[reached_dest]] = True
+        self.curr_cars_count -= int(np.count_nonzero(reached_dest))
+        self._active_ids = active_ids[~reached_dest]
+
+        if self._step_count >= self._max_steps:
+            agents.dones[:] = True
+            self._active_ids = self._active_ids[:0]
+
+        # a new car arrives at each free gate with probability `arrive_prob`, while cars are waiting
+        arrives = self.np_random.random(len(self._entry_gates)) < self._arrive_prob
+        arrivals = np.flatnonzero(~self._gates_taken & arrives)
+        self.__place_cars(arrivals[:self.n_agents - self._next_car])
+        self.__index_junctions()
+
+        if out is not None:
+            out.rewards.fill(0)
+            np.copyto(out.dones, agents.dones)
+            out.step_collisions[()] = step_collisions
+            out.cascade_rounds[()] = cascade_rounds
+            return self.get_agent_obs(), out.rewards, out.dones, out.info
+
+        rewards = [0 for _ in range(self.n_agents)]
+        return self.get_agent_obs(), rewards, self._agent_dones, {'step_collisions': step_collisions,
+                                                                  'cascade_rounds': cascade_rounds}
+
+    def __place_cars(self, gates):
+        """
+        Puts the next waiting cars on the road, one at each of `gates`, with a random route and junction to turn at.
+
+        :param gates: indices of free entry gates
+        :type gates: np.ndarray
+        """
+        if not len(gates):
+            return
+        car_ids = np.arange(self._next_car, self._next_car + len(gates))
+        routes = self.np_random.integers(1, self._n_routes + 1, len(gates))
+        # forward routes never turn, the others turn at one of the junctions crossed from their gate
+        turns = np.where(routes == 1, 0, (self.np_random.random(len(gates)) * self._gate_turns[gates]).astype(np.int64))
+
+        agents = self._agents
+        agents.pos[car_ids] = self._entry_gates[gates]
+        agents.path[car_ids] = self._path_index[gates, routes - 1, turns]
+        agents.progress[car_ids] = 0
+        agents.route[car_ids] = routes
+        agents.on_road[car_ids] = True
+        self._gates_taken[gates] = True
+        self._full_obs[self._entry_gates[gates, 0], self._entry_gates[gates, 1]] = car_ids + 1
+        self._next_car += len(gates)
+        self.curr_cars_count += len(gates)
+
+        # cars spawned on the last step of the episode are already done; new ids are above every active one
+        self._active_ids = np.concatenate([self._active_ids, car_ids[~agents.dones[car_ids]]])
+
+    def __index_junctions(self):
+        # groups the cars on the road by the junction of their cell, ascending ids within each junction
+        cells = self._path_cells[self._agents.path[self._active_ids], self._agents.progress[self._active_ids]]
+        junctions = self._cell_junction[cells]
+        self._junction_cars = self._active_ids[np.argsort(junctions, kind='stable')]
+        np.cumsum(np.bincount(junctions, minlength=self._geometry.n_junctions), out=self._junction_ptr[1:])
+
+    def __draw_base_img(self):
+        img = draw_grid(self._grid_shape[0], self._grid_shape[1], cell_size=CELL_SIZE, fill=WALL_COLOR)
+        for cell in zip(*np.nonzero(self._geometry.road)):
+            fill_cell(img, cell, cell_size=CELL_SIZE, fill=(143, 141, 136), margin=0.05)
+        for cell in zip(*np.nonzero(~self._geometry.road)):
+            fill_cell(img, cell, cell_size=CELL_SIZE, fill=(242, 227, 167), margin=0.02)
+        return img
+
+    def render(self, mode: str = 'human'):
+        if self._base_img is None:
+            self._base_img = self.__draw_base_img()
+        img = copy.copy(self._base_img)
+
+        for agent_i in self._active_ids.tolist():
+            fill_cell(img, self.agent_pos[agent_i], cell_size=CELL_SIZE, fill=AGENTS_COLORS[agent_i % 10])
+            write_cell_text(img, text=str(agent_i + 1), pos=self.agent_pos[agent_i], cell_size=CELL_SIZE,
+                            fill='white', margin=0.3)
+
+        img = np.asarray(img)
+        if mode == 'rgb_array':
+            return img
+        elif mode == 'human':
+            from gym.envs.classic_control import rendering
+            if self.viewer is None:
+                self.viewer = rendering.SimpleImageViewer()
+            self.viewer.imshow(img)
+            return self.viewer.isopen
+
+    def seed(self, n=None):
+        """
+        Replaces the generator the arrivals, routes and turns are drawn from.
+
+        :param n: seed of `np.random.default_rng`, see `TrafficJunction.seed`
+        :type n: int
+
+        :return: the seed
+        :rtype: list
+        """
+        self.np_random = np.random.default_rng(n)
+        return [n]
+
+    def close(self):
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
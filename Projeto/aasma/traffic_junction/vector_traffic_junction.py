@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import numpy as np
+
+from .traffic_junction import ACTION_MEANING, GAS, GRID_IDS, TrafficJunction
+from ..utils_traffic_junction.arrival_schedule import ArrivalSchedule
+from ..utils_traffic_junction.collisions import resolve_collisions_batched
+from ..utils_traffic_junction.observation_builder import extract_windows_batched, pad_grid
+from ..utils_traffic_junction.rng import stream_seed
+from ..utils_traffic_junction.route_paths import path_id
+
+logger = logging.getLogger(__name__)
+
+
+class VectorTrafficJunction:
+    """
+    Batch of `n_envs` independent TrafficJunction environments stepped together. The state of every junction is kept
+    in stacked NumPy arrays (positions, paths and progress along them, routes, on the road flags, done flags and step
+    counters) and each step applies the rules of TrafficJunction to all the junctions with array operations:
+    cars advance along the precomputed path of their gate and route, conflicts are resolved with the same priorities,
+    cars are removed at their destinations and new cars arrive with probability `arrive_prob`.
+
+    Junctions whose episode ended (every car done) are reset automatically at the end of the step. The observations
+    returned are those of the new episode and `info` reports the length and the collisions of the finished one.
+
+    Each episode draws its gates, arrivals and routes from its own stream, keyed on the junction and on the number of
+    episodes it started, so any episode can be replayed alone, see `episode_schedule`.
+
+    Observations of all the junctions are returned as one array with shape (n_envs, n_agents, 5, 5, F) (for the
+    default view radius), with the same content as `TrafficJunction.get_agent_obs`.
+    """
+
+    def __init__(self, n_envs, grid_shape=(14, 14), step_cost=-0.01, n_max=4, collision_reward=-10, arrive_prob=0.5,
+                 max_steps: int = 100, view_radius: int = 2, seed=None, obs_dtype=np.uint8,
+                 id_encoding: str = 'onehot'):
+        assert 1 <= n_envs, "n_envs should be at least 1"
+
+        # the single junction validates the arguments and provides the layout, only its static attributes are used
+        junction = TrafficJunction(grid_shape=grid_shape, step_cost=step_cost, n_max=n_max,
+                                   collision_reward=collision_reward, arrive_prob=arrive_prob, max_steps=max_steps,
+                                   view_radius=view_radius, obs_dtype=obs_dtype, id_encoding=id_encoding)
+        self.n_envs = n_envs
+        self.n_agents = junction.n_agents
+        self.action_space = junction.action_space
+        self.observation_space = junction.observation_space
+
+        self._grid_shape = junction._grid_shape
+        self._max_steps = junction._max_steps
+        self._arrive_prob = junction._arrive_prob
+        self._n_routes = junction._n_routes
+        self._view_radius = junction._view_radius
+        self._encoding = junction._encoding
+        self._static_grid = junction._full_obs.copy()
+
+        # cars follow the path of their gate and route, see `path_id`
+        self._entry_gates = np.array(junction._entry_gates)
+        self._path_positions = junction._path_positions
+        self._path_cells = junction._path_cells
+        self._path_lengths = junction._path_lengths
+
+        batch_shape = (self.n_envs, self.n_agents)
+        # arrivals of the current episode of each junction, see `episode_schedule`
+        self._arrivals = np.zeros((self.n_envs, self._max_steps), dtype=np.bool_)
+        self._gate_draws = np.zeros((self.n_envs, self._max_steps), dtype=np.uint16)
+        self._episode_routes = np.zeros(batch_shape, dtype=np.int64)
+        self.seed(seed)
+
+        self._grid = np.empty((self.n_envs, *self._grid_shape), dtype=self._static_grid.dtype)
+        self._agent_pos = np.zeros((*batch_shape, 2), dtype=np.int64)
+        self._agent_path = np.full(batch_shape, -1, dtype=np.int64)  # -1 while not on the road
+        self._agent_progress = np.zeros(batch_shape, dtype=np.int64)
+        self._agents_routes = np.full(batch_shape, -1, dtype=np.int64)
+        self._on_the_road = np.zeros(batch_shape, dtype=np.bool_)
+        self._agent_dones = np.zeros(batch_shape, dtype=np.bool_)
+        self._agent_step_count = np.zeros(batch_shape, dtype=np.int64)
+        self._step_count = np.zeros(self.n_envs, dtype=np.int64)
+        self._episode_collisions = np.zeros(self.n_envs, dtype=np.int64)
+
+    def seed(self, n=None):
+        """
+        Replaces the seed the episodes draw their streams from. There is no generator running across episodes, so the
+        episode counters restart: the next reset of junction `i` starts its episode 0.
+
+        :param n: seed of the batch: an int, a sequence of ints or a SeedSequence, see `stream_seed`
+        :type n: int
+
+        :return: the seed
+        :rtype: list
+        """
+        # fresh entropy is drawn once, so the episode streams of an unseeded batch stay children of the same root
+        self._seed = stream_seed(n)
+        self._episodes = np.zeros(self.n_envs, dtype=np.int64)
+        return [n]
+
+    def episode_seed(self, env_i, episode):
+        """
+        :return: seed of the stream of episode `episode` (counted from the last `seed`) of junction `env_i`
+        :rtype: np.random.SeedSequence
+        """
+        return stream_seed(self._seed, env_i, episode)
+
+    def episode_schedule(self, env_i, episode):
+        """
+        Gates, arrivals and routes of an episode, drawn from `episode_seed(env_i, episode)`. A TrafficJunction with the
+        same arguments reset with `reset(schedule=vector.episode_schedule(i, k))` and given the same actions follows
+        the trajectory of episode `k` of junction `i`.
+
+        :return: the schedule of the episode
+        :rtype: ArrivalSchedule
+        """
+        return ArrivalSchedule.sample(np.random.default_rng(self.episode_seed(env_i, episode)), self.n_agents,
+                                      len(self._entry_gates), self._n_routes, self._max_steps, self._arrive_prob)
+
+    def reset(self):
+        """
+        Resets every junction of the batch.
+
+        :return: observations of all the agents, shape (n_envs, n_agents, 5, 5, F)
+        :rtype: np.ndarray
+        """
+        self.__reset_envs(np.arange(self.n_envs))
+        return self.get_agent_obs()
+
+    def __reset_envs(self, env_ids):
+        """
+        Starts the next episode of the given junctions: up to |entry_gates| cars are placed at the shuffled gates of
+        its schedule and the remaining ones wait outside the road at (0, 0).
+
+        :param env_ids: indices of the junctions to reset
+        :type env_ids: np.ndarray
+        """
+        self._grid[env_ids] = self._static_grid
+        self._agent_pos[env_ids] = 0
+        self._agent_path[env_ids] = -1
+        self._agent_progress[env_ids] = 0
+        self._agents_routes[env_ids] = -1
+        self._on_the_road[env_ids] = False
+        self._agent_dones[env_ids] = False
+        self._agent_step_count[env_ids] = 0
+        self._step_count[env_ids] = 0
+        self._episode_collisions[env_ids] = 0
+
+        n_placed = min(self.n_agents, len(self._entry_gates))
+        shuffled_gates = np.empty((len(env_ids), n_placed), dtype=np.int64)
+        for row, env_i in enumerate(env_ids):
+            schedule = self.episode_schedule(env_i, self._episodes[env_i])
+            self._episodes[env_i] += 1
+            shuffled_gates[row] = schedule.gates[:n_placed]
+            self._arrivals[env_i] = schedule.arrivals
+            self._gate_draws[env_i] = schedule.gate_draws
+            self._episode_routes[env_i] = schedule.routes
+
+        self._agent_pos[env_ids, :n_placed] = self._entry_gates[shuffled_gates]
+        routes = self._episode_routes[env_ids, :n_placed]
+        self._agents_routes[env_ids, :n_placed] = routes
+        self._agent_path[env_ids, :n_placed] = path_id(shuffled_gates, routes, self._n_routes)
+        self._on_the_road[env_ids, :n_placed] = True
+
+        gates = self._entry_gates[shuffled_gates]
+        self._grid[env_ids[:, None], gates[..., 0], gates[..., 1]] = np.arange(1, n_placed + 1)
+
+    def get_agent_obs(self):
+        """
+        Computes the observations of every agent of every junction, see `TrafficJunction.get_agent_obs`. Each cell of
+        the view of an agent holds the one-hot id, the coordinates and the one-hot route of the car in it.
+
+        :return: observations with shape (n_envs, n_agents, 2r + 1, 2r + 1, F), see `ObservationEncoding`
+        :rtype: np.ndarray
+        """
+        env_ids = np.arange(self.n_envs)[:, None]
+        agent_ids = np.arange(self.n_agents)
+
+        # feature of each grid code, per junction: row 0 is a cell without a car and row i + 1 describes agent i
+        encoding = self._encoding
+        features = np.repeat(encoding.feature_table()[None], self.n_envs, axis=0)
+        features[:, 1:, encoding.coordinates] = self._agent_pos
+        routes = (self._agents_routes - 1) % self._n_routes
+        features[env_ids, agent_ids + 1, encoding.routes.start + routes] = 1
+
+        padded_grids = pad_grid(np.maximum(self._grid, GRID_IDS['empty']), self._view_radius)
+        windows = extract_windows_batched(padded_grids, self._agent_pos, self._view_radius)
+        return features[env_ids[:, :, None, None], windows]
+
+    def step(self, agents_action):
+        """
+        Steps every junction of the batch with the rules of `TrafficJunction.step`. Junctions whose episode ended are
+        reset before computing the returned observations.
+
+        :param agents_action: actions of all the agents of all the junctions, shape (n_envs, n_agents)
+        :type agents_action: np.ndarray
+
+        :return: observations (n_envs, n_agents, 5, 5, F), rewards (n_envs, n_agents), dones (n_envs, n_agents) and
+            info with per junction arrays: 'step_collisions', 'cascade_rounds', 'episode_done' and, meaningful for the
+            junctions whose episode ended, 'episode_steps' and 'episode_collisions'
+        :rtype: tuple
+        """
+        actions = np.asarray(agents_action)
+        assert actions.shape == (self.n_envs, self.n_agents), \
+            "Invalid action! It was expected to be an array of shape {}" \
+            " but was found to be of {}".format((self.n_envs, self.n_agents), actions.shape)
+
+        assert np.isin(actions, list(ACTION_MEANING.keys())).all(), \
+            "Invalid action found in the sampled actions. Valid actions are {}".format(ACTION_MEANING.keys())
+
+        self._step_count += 1
+        rewards = np.zeros((self.n_envs, self.n_agents))
+
+        active = self._on_the_road & ~self._agent_dones
+        gas = active & (actions == GAS)
+
+        # cars gas to the next cell of their path, as flat cells offset by junction so that cars of different
+        # junctions never share a cell
+        paths = np.maximum(self._agent_path, 0)
+        offsets = np.arange(self.n_envs)[:, None] * np.prod(self._grid_shape)
+        curr_cells = np.where(active, offsets + self._path_cells[paths, self._agent_progress], -1)
+        next_cells = np.where(active, offsets + self._path_cells[paths, self._agent_progress + gas], -1)
+        new_cells, step_collisions, cascade_rounds = resolve_collisions_batched(curr_cells, next_cells,
+                                                                                self._grid.size)
+
+        # vacated cells are cleared before the cars are written in their new cells
+        moved = active & (new_cells != curr_cells)
+        grid = self._grid.reshape(-1)
+        grid[curr_cells[moved]] = GRID_IDS['empty']
+        grid[new_cells[active]] = np.broadcast_to(np.arange(1, self.n_agents + 1), active.shape)[active]
+        self._agent_progress += moved
+        self._agent_pos[active] = self._path_positions[paths, self._agent_progress][active]
+        self._agent_step_count += active
+
+        # cars at the end of their path are removed from the road
+        reached_dest = (self._agent_path >= 0) & (self._agent_progress == self._path_lengths[paths] - 1)
+        env_ids = np.broadcast_to(np.arange(self.n_envs)[:, None], reached_dest.shape)
+        self._grid[env_ids[reached_dest], self._agent_pos[reached_dest][:, 0],
+                   self._agent_pos[reached_dest][:, 1]] = GRID_IDS['empty']
+        self._agent_dones |= reached_dest
+
+        # if max_steps was reached, terminate the episode
+        self._agent_dones[self._step_count >= self._max_steps] = True
+
+        self.__spawn_cars()
+
+        self._episode_collisions += step_collisions
+        dones = self._agent_dones.copy()
+        episode_done = dones.all(axis=1)
+        info = {'step_collisions': step_collisions,
+                'cascade_rounds': cascade_rounds,
+                'episode_done': episode_done,
+                'episode_steps': self._step_count.copy(),
+                'episode_collisions': self._episode_collisions.copy()}
+
+        finished = np.flatnonzero(episode_done)
+        if finished.size:
+            self.__reset_envs(finished)
+
+        return self.get_agent_obs(), rewards, dones, info
+
+    def close(self):
+        # nothing to release, kept so the batch can be used where a TrafficJunctionPool is expected
+        pass
+
+    def __spawn_cars(self):
+        """
+        Adds a new car to each junction where the schedule of the episode has an arrival at this step, if a car is
+        still waiting to enter and a gate is free. The car entering is the first one waiting and it is placed at the
+        free gate picked by the draw of the step, see `ArrivalSchedule.gate`.
+        """
+        arrivals = self._arrivals[np.arange(self.n_envs), self._step_count - 1]
+
+        # a gate is taken while any car, even a finished one, stands on it
+        gate_taken = (self._agent_pos[:, :, None, :] == self._entry_gates).all(axis=-1).any(axis=1)
+        waiting = ~self._on_the_road
+        env_ids = np.flatnonzero(arrivals & ~gate_taken.all(axis=1) & waiting.any(axis=1))
+        if not env_ids.size:
+            return
+
+        agent_to_enter = np.argmax(waiting[env_ids], axis=1)
+        free_gates = ~gate_taken[env_ids]
+        picks = self._gate_draws[env_ids, self._step_count[env_ids] - 1].astype(np.int64) * free_gates.sum(axis=1) >> 16
+        gates = np.argmax(np.cumsum(free_gates, axis=1) > picks[:, None], axis=1)
+        pos = self._entry_gates[gates]
+
+        self._agent_pos[env_ids, agent_to_enter] = pos
+        routes = self._episode_routes[env_ids, agent_to_enter]
+        self._agents_routes[env_ids, agent_to_enter] = routes
+        self._agent_path[env_ids, agent_to_enter] = path_id(gates, routes, self._n_routes)
+        self._agent_progress[env_ids, agent_to_enter] = 0
+        self._on_the_road[env_ids, agent_to_enter] = True
+        self._grid[env_ids, pos[:, 0], pos[:, 1]] = agent_to_enter + 1
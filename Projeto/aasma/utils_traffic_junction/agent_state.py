@@ -0,0 +1,103 @@
+from collections.abc import Mapping
+from typing import NamedTuple
+
+import numpy as np
+
+
+def read_only(array):
+    """
+    :return: view of `array` that follows its updates but cannot be written through
+    :rtype: np.ndarray
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class AgentState:
+    """
+    State of every car of a TrafficJunction as a struct of arrays with fixed dtypes, allocated once and updated in
+    place, so that stepping touches a few contiguous arrays instead of lists and dicts of Python objects:
+
+    - pos: (n, 2) position of each car, (0, 0) while it waits outside the road
+    - path, progress: path followed by each car (-1 before it enters) and index of its cell in that path
+    - route: route of each car (1 - fwd, 2 - turn right, 3 - turn left), -1 before it enters
+    - on_road, dones: flags if the car entered the road and if it is done
+    - step_count: number of steps each car spent on the road
+    """
+
+    FIELDS = ('pos', 'path', 'progress', 'route', 'on_road', 'dones', 'step_count')
+
+    def __init__(self, n_agents):
+        self.pos = np.zeros((n_agents, 2), dtype=np.int16)
+        self.path = np.full(n_agents, -1, dtype=np.int16)
+        self.progress = np.zeros(n_agents, dtype=np.int16)
+        self.route = np.full(n_agents, -1, dtype=np.int8)
+        self.on_road = np.zeros(n_agents, dtype=np.bool_)
+        self.dones = np.zeros(n_agents, dtype=np.bool_)
+        self.step_count = np.zeros(n_agents, dtype=np.int32)
+
+    def snapshot(self):
+        """
+        :return: read-only copies of the arrays, in the order of `FIELDS`
+        :rtype: tuple
+        """
+        return tuple(read_only(getattr(self, field).copy()) for field in self.FIELDS)
+
+    def restore(self, arrays):
+        """
+        Copies back arrays returned by `snapshot`, in place.
+        """
+        for field, array in zip(self.FIELDS, arrays):
+            np.copyto(getattr(self, field), array)
+
+    def reset(self):
+        self.pos[:] = 0
+        self.path[:] = -1
+        self.progress[:] = 0
+        self.route[:] = -1
+        self.on_road[:] = False
+        self.dones[:] = False
+        self.step_count[:] = 0
+
+
+class AgentPositions(Mapping):
+    """
+    Read-only {agent_i: (row, col)} view of the positions of an AgentState, kept for the code written against the
+    `agent_pos` dict.
+    """
+
+    def __init__(self, pos):
+        self._pos = pos
+
+    def __getitem__(self, agent_i):
+        if not 0 <= agent_i < len(self._pos):
+            raise KeyError(agent_i)
+        row, col = self._pos[agent_i].tolist()
+        return row, col
+
+    def __iter__(self):
+        return iter(range(len(self._pos)))
+
+    def __len__(self):
+        return len(self._pos)
+
+
+class TrafficJunctionState(NamedTuple):
+    """
+    Immutable snapshot of the dynamic state of a TrafficJunction, returned by `get_state` and restored by `set_state`.
+    Arrays are read-only copies, so a snapshot can be shared by any number of branches and pickled as is.
+    """
+    step_count: int
+    curr_cars_count: int
+    grid: np.ndarray
+    agents: tuple  # AgentState.snapshot()
+    active_ids: np.ndarray
+    waiting_cars: tuple
+    gates_taken: int
+    rng_state: dict  # state of the bit generator of the environment
+    schedule: object = None  # ArrivalSchedule replayed in the episode, None when the arrivals are drawn
+
+    def __deepcopy__(self, memo):
+        # nothing in a snapshot can change, so copies can share it
+        return self
@@ -0,0 +1,79 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class ArrivalSchedule(NamedTuple):
+    """
+    Pre-sampled traffic of one episode of a TrafficJunction, replayed by `reset(schedule=...)` instead of drawing the
+    arrivals from the generator of the environment. Giving the same schedule to every team compares them on the same
+    traffic (common random numbers), so the differences between teams have a much lower variance.
+
+    - gates: (n_gates,) order in which the cars present at the start take the entry gates
+    - arrivals: (max_steps,) flag if a car arrives at each step
+    - gate_draws: (max_steps,) uniform draw in [0, 2^16) picking the gate of the arrival among the free ones, so the
+      same draw is used whatever gates the team left free
+    - routes: (n_agents,) route of each car, whenever it enters
+    """
+    gates: np.ndarray
+    arrivals: np.ndarray
+    gate_draws: np.ndarray
+    routes: np.ndarray
+
+    @classmethod
+    def sample(cls, rng, n_agents, n_gates, n_routes, max_steps, arrive_prob):
+        """
+        :param rng: generator to draw from
+        :type rng: np.random.Generator
+
+        :return: schedule drawn with the distribution of the arrivals of a TrafficJunction
+        :rtype: ArrivalSchedule
+        """
+        return cls(gates=rng.permutation(n_gates).astype(np.uint8),
+                   arrivals=rng.random(max_steps) < arrive_prob,
+                   gate_draws=rng.integers(0, 2 ** 16, max_steps, dtype=np.uint16),
+                   routes=rng.integers(1, n_routes + 1, n_agents, dtype=np.int8))
+
+    def gate(self, step, free_gates):
+        """
+        :return: gate taken by the car arriving at `step` (1-based) among `free_gates`
+        :rtype: int
+        """
+        return free_gates[int(self.gate_draws[step - 1]) * len(free_gates) >> 16]
+
+    def next_arrival(self, step):
+        """
+        :return: number of steps from `step` (1-based, included) to the next arrival, inf if no car arrives anymore
+        :rtype: float
+        """
+        arrivals = np.flatnonzero(self.arrivals[step - 1:])
+        return int(arrivals[0]) + 1 if len(arrivals) else np.inf
+
+
+def save_schedules(path, schedules):
+    """
+    Saves the schedules of a run, all sampled for the same environment, as one compressed .npz file.
+
+    :param path: file to write
+    :type path: str
+
+    :param schedules: schedule of each episode
+    :type schedules: list
+    """
+    # written through a file object, so numpy does not append .npz to the path
+    with open(path, 'wb') as file:
+        np.savez_compressed(file, **{field: np.stack([getattr(schedule, field) for schedule in schedules])
+                                     for field in ArrivalSchedule._fields})
+
+
+def load_schedules(path):
+    """
+    :param path: file written by `save_schedules`
+    :type path: str
+
+    :return: schedule of each episode
+    :rtype: list
+    """
+    with np.load(path) as data:
+        fields = [data[field] for field in ArrivalSchedule._fields]
+    return [ArrivalSchedule(*episode_fields) for episode_fields in zip(*fields)]
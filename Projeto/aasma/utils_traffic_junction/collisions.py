@@ -0,0 +1,174 @@
+import numpy as np
+
+
+def resolve_collisions(curr_cells, next_cells, n_cells):
+    """
+    Resolves the conflicts between the moves the cars want to make in one step. Cells are flat grid indices
+    (row * n_cols + col) and finished cars are marked with -1 in both arrays.
+
+    A car collides when it wants to move to a cell that another car also wants: a car that stopped in that cell has
+    priority over everyone, otherwise the car with the lowest id gets it. A car that collides stays in place, so every
+    car that wanted its current cell collides as well, and so on. Cars are grouped by target cell in an array index
+    and those "stay in place" chains are followed as a dependency graph, visiting every car at most once.
+
+    :param curr_cells: current cell of each car
+    :type curr_cells: np.ndarray
+
+    :param next_cells: cell each car wants to move to (equal to the current cell if the car braked)
+    :type next_cells: np.ndarray
+
+    :param n_cells: number of cells of the grid
+    :type n_cells: int
+
+    :return: the cell of each car after the step, the number of collided cars and the number of cascade rounds
+        (0 if no car collided, 1 if only direct conflicts happened, k if a chain of k - 1 cars had to stop because
+        of them)
+    :rtype: tuple
+    """
+    n_cars = len(next_cells)
+
+    # the cars wanting each cell are chained starting from the lowest id
+    first_claimant = np.full(n_cells, -1, dtype=np.int64)
+    next_claimant = np.full(n_cars, -1, dtype=np.int64)
+    stopped_in_cell = np.zeros(n_cells, dtype=np.bool_)
+    for car in range(n_cars - 1, -1, -1):
+        cell = next_cells[car]
+        if cell < 0:
+            continue
+        next_claimant[car] = first_claimant[cell]
+        first_claimant[cell] = car
+        if cell == curr_cells[car]:
+            stopped_in_cell[cell] = True
+
+    # direct conflicts: every moving car that loses its target cell
+    collided = np.zeros(n_cars, dtype=np.bool_)
+    stopped_cars = np.empty(n_cars, dtype=np.int64)
+    n_collisions = 0
+    for car in range(n_cars):
+        cell = next_cells[car]
+        if cell < 0 or cell == curr_cells[car]:
+            continue
+        if stopped_in_cell[cell] or first_claimant[cell] != car:
+            collided[car] = True
+            stopped_cars[n_collisions] = car
+            n_collisions += 1
+
+    # cascades: the cars wanting the cell of a car that had to stay also have to stay
+    cascade_rounds = 0
+    round_start = 0
+    while round_start < n_collisions:
+        cascade_rounds += 1
+        round_end = n_collisions
+        for k in range(round_start, round_end):
+            claimant = first_claimant[curr_cells[stopped_cars[k]]]
+            while claimant != -1:
+                if not collided[claimant]:
+                    collided[claimant] = True
+                    stopped_cars[n_collisions] = claimant
+                    n_collisions += 1
+                claimant = next_claimant[claimant]
+        round_start = round_end
+
+    new_cells = np.where(collided, curr_cells, next_cells)
+    return new_cells, n_collisions, cascade_rounds
+
+
+def resolve_collisions_batched(curr_cells, next_cells, n_cells):
+    """
+    Same rules as `resolve_collisions` for a batch of independent junctions, using array operations only. Cars are
+    given as (n_envs, n_cars) arrays of flat cell indices that must already be offset by env (env * cells_per_env +
+    cell) so that cars of different junctions never share a cell. Finished cars are marked with -1.
+
+    Cascades are propagated one round at a time for all the junctions at once, so the cost is linear in the number of
+    cars times the longest chain of cars that had to stop.
+
+    :param curr_cells: current cell of each car, shape (n_envs, n_cars)
+    :type curr_cells: np.ndarray
+
+    :param next_cells: cell each car wants to move to, shape (n_envs, n_cars)
+    :type next_cells: np.ndarray
+
+    :param n_cells: total number of cells of all the junctions
+    :type n_cells: int
+
+    :return: the cell of each car after the step, the number of collided cars per junction and the number of cascade
+        rounds per junction
+    :rtype: tuple
+    """
+    batch_shape = next_cells.shape
+    curr_cells = curr_cells.reshape(-1)
+    next_cells = next_cells.reshape(-1)
+    car_ids = np.arange(next_cells.size)
+
+    on_road = next_cells >= 0
+    target_cells = np.where(on_road, next_cells, 0)
+    moving = on_road & (next_cells != curr_cells)
+
+    # lowest car wanting each cell (car ids grow with the id inside each junction) and cells where a car stopped
+    first_claimant = np.full(n_cells, next_cells.size, dtype=np.int64)
+    np.minimum.at(first_claimant, next_cells[on_road], car_ids[on_road])
+    stopped_in_cell = np.zeros(n_cells, dtype=np.bool_)
+    stopped_in_cell[next_cells[on_road & ~moving]] = True
+
+    collided = moving & (stopped_in_cell[target_cells] | (first_claimant[target_cells] != car_ids))
+    cascade_rounds = np.zeros(batch_shape[0], dtype=np.int64)
+    new_collisions = collided
+    while new_collisions.any():
+        cascade_rounds += new_collisions.reshape(batch_shape).any(axis=1)
+        blocked_cells = np.zeros(n_cells, dtype=np.bool_)
+        blocked_cells[curr_cells[new_collisions]] = True
+        new_collisions = moving & ~collided & blocked_cells[target_cells]
+        collided |= new_collisions
+
+    new_cells = np.where(collided, curr_cells, next_cells)
+    return new_cells.reshape(batch_shape), collided.reshape(batch_shape).sum(axis=1), cascade_rounds
+
+
+def resolve_collisions_sparse(curr_cells, next_cells):
+    """
+    Same rules as `resolve_collisions` using only arrays the size of the cars, never of the grid, so the cost of a step
+    does not grow with the size of a road network. The cars are sorted by the cell they want, which groups each
+    conflict, and every cascade round only looks up the cells kept by the cars stopped in the previous round.
+
+    :param curr_cells: current cell of each car, by ascending id, -1 for finished cars
+    :type curr_cells: np.ndarray
+
+    :param next_cells: cell each car wants to move to (equal to the current cell if the car braked), -1 for finished
+        cars
+    :type next_cells: np.ndarray
+
+    :return: the cell of each car after the step, the number of collided cars and the number of cascade rounds
+    :rtype: tuple
+    """
+    on_road = next_cells >= 0
+    moving = on_road & (next_cells != curr_cells)
+
+    # cars grouped by target cell, ascending ids inside each group
+    cars = np.flatnonzero(on_road)
+    cars = cars[np.argsort(next_cells[cars], kind='stable')]
+    targets = next_cells[cars]
+    group_starts = np.ones(len(cars), dtype=np.bool_)
+    np.not_equal(targets[1:], targets[:-1], out=group_starts[1:])
+    groups = np.cumsum(group_starts) - 1
+
+    # a car that stopped in a cell has priority over everyone, otherwise the lowest id gets it
+    stopped_in_group = np.bincount(groups, weights=~moving[cars]) > 0
+    first_claimant = cars[group_starts][groups]
+    collided = np.zeros(len(next_cells), dtype=np.bool_)
+    collided[cars] = moving[cars] & (stopped_in_group[groups] | (first_claimant != cars))
+
+    # cascades: the cars wanting the cell of a car that had to stay also have to stay, found in the sorted targets
+    cascade_rounds = 0
+    new_collisions = np.flatnonzero(collided)
+    while len(new_collisions):
+        cascade_rounds += 1
+        kept_cells = curr_cells[new_collisions]
+        group_lo = np.searchsorted(targets, kept_cells, side='left')
+        group_sizes = np.searchsorted(targets, kept_cells, side='right') - group_lo
+        claimants = cars[np.repeat(group_lo - np.cumsum(group_sizes) + group_sizes, group_sizes) +
+                         np.arange(group_sizes.sum())]
+        new_collisions = claimants[moving[claimants] & ~collided[claimants]]
+        collided[new_collisions] = True
+
+    new_cells = np.where(collided, curr_cells, next_cells)
+    return new_cells, int(np.count_nonzero(collided)), cascade_rounds
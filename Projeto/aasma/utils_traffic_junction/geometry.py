@@ -0,0 +1,187 @@
+from functools import lru_cache
+
+import numpy as np
+
+# direction vector of each heading, ordered so that the cars coming from approach `i` (see APPROACHES) head to
+# HEADINGS[i]: turning right is `(heading + 3) % 4` and turning left `(heading + 1) % 4`
+HEADINGS = ((1, 0), (0, 1), (-1, 0), (0, -1))  # downwards, rightwards, upwards, leftwards
+
+# side of the junction each incoming lane comes from
+APPROACHES = ('top', 'left', 'bottom', 'right')
+
+# axis of the road an approach belongs to
+VERTICAL, HORIZONTAL = range(2)
+
+
+class JunctionGeometry:
+    """
+    Layout of the 4-way junctions of a (rows x cols) grid, derived only from `grid_shape` so that any grid size works.
+    The grid is tiled with `blocks` (N x M) blocks of (rows // N, cols // M) cells and each block holds one junction:
+    two horizontal lanes (block_rows // 2 - 1 leftwards, block_rows // 2 rightwards) cross two vertical lanes
+    (block_cols // 2 - 1 downwards, block_cols // 2 upwards) and the 2 x 2 cells where they meet are the junction.
+    Lanes run across the whole grid, so a car can cross several junctions.
+
+    Besides the gates, destinations and turning places used by the environments, it precomputes lookup layers with the
+    shape of the grid, so that the questions the agents ask about a cell are a single array read:
+
+    - road: flag if the cell is part of a lane
+    - is_junction: flag if the cell is one of the 4 cells of a junction
+    - junction_index: index of the block (and junction) of the cell, row-major
+    - pre_junction: index in APPROACHES of the cell right before a junction, -1 elsewhere
+    - approach_axis: VERTICAL or HORIZONTAL for the cells of the lanes heading to a junction, -1 elsewhere
+    - lane_heading: index in HEADINGS of the direction of the lane outside the junctions, -1 in junctions and walls
+    - junction_distance: cells left to reach the next junction along the lane (0 in a junction), -1 past the last one
+
+    The layers are read-only, so one geometry is shared by the environment and every agent, see `junction_geometry`.
+    """
+
+    def __init__(self, grid_shape, blocks=(1, 1)):
+        assert len(grid_shape) == 2, 'only 2-d grids are acceptable'
+        rows, cols = grid_shape
+        n_block_rows, n_block_cols = blocks
+        assert rows % n_block_rows == 0 and cols % n_block_cols == 0, "the grid should split evenly in blocks"
+        block_rows, block_cols = rows // n_block_rows, cols // n_block_cols
+        assert block_rows >= 4 and block_cols >= 4, "each junction should have at least 4 rows and 4 columns"
+
+        self.grid_shape = (rows, cols)
+        self.blocks = (n_block_rows, n_block_cols)
+        self.block_shape = (block_rows, block_cols)
+        self.n_junctions = n_block_rows * n_block_cols
+
+        # lanes: rows of the leftwards and rightwards lanes, columns of the downwards and upwards lanes, for each block
+        left_rows = [i * block_rows + block_rows // 2 - 1 for i in range(n_block_rows)]
+        right_rows = [row + 1 for row in left_rows]
+        down_cols = [j * block_cols + block_cols // 2 - 1 for j in range(n_block_cols)]
+        up_cols = [col + 1 for col in down_cols]
+
+        # entry gates where the cars spawn and destinations where they leave the grid
+        # Note: [(7, 0), (13, 7), (6, 13), (0, 6)] and [(7, 13), (0, 7), (6, 0), (13, 6)] for (14 x 14) grid
+        self.entry_gates = tuple([(row, 0) for row in right_rows] + [(rows - 1, col) for col in up_cols] +
+                                 [(row, cols - 1) for row in left_rows] + [(0, col) for col in down_cols])
+        self.destinations = tuple([(row, cols - 1) for row in right_rows] + [(0, col) for col in up_cols] +
+                                  [(row, 0) for row in left_rows] + [(rows - 1, col) for col in down_cols])
+
+        # dict{starting_place: direction_vector}
+        self.route_vectors = dict([((row, 0), (0, 1)) for row in right_rows] +
+                                  [((rows - 1, col), (-1, 0)) for col in up_cols] +
+                                  [((0, col), (1, 0)) for col in down_cols] +
+                                  [((row, cols - 1), (0, -1)) for row in left_rows])
+
+        # dict{direction_vector: (turn_right, turn_left)}, inside a block
+        # Note: {(0, 1): ((7, 6), (7, 7)), (-1, 0): ((7, 7), (6, 7)), (1, 0): ((6, 6), (7, 6)),
+        #        (0, -1): ((6, 7), (6, 6))} for (14 x 14) grid
+        left_row, right_row, down_col, up_col = left_rows[0], right_rows[0], down_cols[0], up_cols[0]
+        self.turning_places = {(0, 1): ((right_row, down_col), (right_row, up_col)),
+                               (-1, 0): ((right_row, up_col), (left_row, up_col)),
+                               (1, 0): ((left_row, down_col), (right_row, down_col)),
+                               (0, -1): ((left_row, up_col), (left_row, down_col))}
+
+        self.road = np.zeros(self.grid_shape, dtype=np.bool_)
+        self.road[left_rows + right_rows, :] = True
+        self.road[:, down_cols + up_cols] = True
+
+        self.is_junction = np.zeros(self.grid_shape, dtype=np.bool_)
+        self.is_junction[np.ix_(left_rows + right_rows, down_cols + up_cols)] = True
+
+        row_ids, col_ids = np.indices(self.grid_shape)
+        self.junction_index = (row_ids // block_rows * n_block_cols + col_ids // block_cols).astype(np.int32)
+
+        # lanes outside the junctions, the vertical lanes take precedence where they cross the horizontal ones
+        self.lane_heading = np.full(self.grid_shape, -1, dtype=np.int8)
+        self.lane_heading[left_rows, :] = HEADINGS.index((0, -1))
+        self.lane_heading[right_rows, :] = HEADINGS.index((0, 1))
+        self.lane_heading[:, down_cols] = HEADINGS.index((1, 0))
+        self.lane_heading[:, up_cols] = HEADINGS.index((-1, 0))
+        self.lane_heading[self.is_junction] = -1
+
+        # each lane is walked backwards from its end, counting the cells to the next junction
+        self.junction_distance = np.full(self.grid_shape, -1, dtype=np.int32)
+        self.approach_axis = np.full(self.grid_shape, -1, dtype=np.int8)
+
+        def lanes(row_or_col, axis):
+            # same views of the distance, axis and junction layers along a lane, from its end to its gate
+            return (self.junction_distance[row_or_col], self.approach_axis[row_or_col], self.is_junction[row_or_col],
+                    axis)
+
+        for lane_distance, lane_axis, lane_junction, axis in (
+                [lanes(np.s_[row, ::-1], HORIZONTAL) for row in right_rows] +
+                [lanes(np.s_[row, :], HORIZONTAL) for row in left_rows] +
+                [lanes(np.s_[::-1, col], VERTICAL) for col in down_cols] +
+                [lanes(np.s_[:, col], VERTICAL) for col in up_cols]):
+            distance = -1
+            for cell in range(len(lane_distance)):
+                if lane_junction[cell]:
+                    distance = 0
+                elif distance >= 0:
+                    distance += 1
+                    lane_distance[cell] = distance
+                    lane_axis[cell] = axis
+        self.junction_distance[self.is_junction] = 0
+
+        # the cell right before a junction is the approach the car is heading from
+        self.pre_junction = np.where(self.junction_distance == 1, self.lane_heading, -1).astype(np.int8)
+
+        for layer in (self.road, self.is_junction, self.junction_index, self.lane_heading, self.pre_junction,
+                      self.approach_axis, self.junction_distance):
+            layer.flags.writeable = False
+
+    def __cell(self, pos):
+        # (row, col) of `pos` if it is a cell of the grid, None otherwise (empty or off the grid)
+        if len(pos) != 2:
+            return None
+        row, col = int(pos[0]), int(pos[1])
+        if 0 <= row < self.grid_shape[0] and 0 <= col < self.grid_shape[1]:
+            return row, col
+        return None
+
+    def __lookup(self, layer, pos, default):
+        cell = self.__cell(pos)
+        return default if cell is None else layer[cell].item()
+
+    def in_junction(self, pos):
+        """
+        :return: if `pos` is a cell of the junction
+        :rtype: bool
+        """
+        return self.__lookup(self.is_junction, pos, False)
+
+    def pre_junction_at(self, pos):
+        """
+        :return: index in APPROACHES if `pos` is the cell right before the junction, -1 otherwise
+        :rtype: int
+        """
+        return self.__lookup(self.pre_junction, pos, -1)
+
+    def approach_axis_at(self, pos):
+        """
+        :return: VERTICAL or HORIZONTAL if `pos` is on a lane entering the junction, -1 otherwise
+        :rtype: int
+        """
+        return self.__lookup(self.approach_axis, pos, -1)
+
+    def heading_at(self, pos):
+        """
+        :return: index in HEADINGS of the lane of `pos`, -1 in the junction and outside the road
+        :rtype: int
+        """
+        return self.__lookup(self.lane_heading, pos, -1)
+
+    def junction_distance_at(self, pos):
+        """
+        :return: cells left to reach the junction from `pos`, -1 if `pos` is not on a lane entering it
+        :rtype: int
+        """
+        return self.__lookup(self.junction_distance, pos, -1)
+
+
+def junction_geometry(grid_shape, blocks=(1, 1)):
+    """
+    :return: geometry of `grid_shape` tiled with `blocks` junctions, built once and shared by every caller
+    :rtype: JunctionGeometry
+    """
+    return _cached_geometry(tuple(int(size) for size in grid_shape), tuple(int(count) for count in blocks))
+
+
+@lru_cache(maxsize=None)
+def _cached_geometry(grid_shape, blocks):
+    return JunctionGeometry(grid_shape, blocks)
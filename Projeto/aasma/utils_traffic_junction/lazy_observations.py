@@ -0,0 +1,73 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class LazyObservations(Sequence):
+    """
+    Observations of the agents at one step, built on demand. The container only keeps a snapshot of the step (the
+    grid padded by the view radius, the positions and the routes of the cars) and builds the (2r + 1, 2r + 1, F)
+    observation of an agent the first time it is read; later reads of the same agent return the same array. Agents
+    that never look at their observation cost nothing, and the snapshot stays valid after the environment steps again.
+
+    The observation of an agent has the content of `TrafficJunction.get_agent_obs`: each cell of the view holds the
+    id, the coordinates and the one-hot route of the car in it, laid out by an `ObservationEncoding`. The container
+    behaves as the list of those arrays: it can be indexed, sliced, iterated, zipped and stacked.
+    """
+
+    def __init__(self, padded_grid, cell_windows, positions, routes, encoding):
+        """
+        :param padded_grid: grid padded by the view radius, 0 for the cells without a car and the 1-based id otherwise.
+            It is kept as is, so it must not be modified afterwards
+        :type padded_grid: np.ndarray
+
+        :param cell_windows: flat indices in `padded_grid` of the window of each grid cell, see `window_cells`
+        :type cell_windows: np.ndarray
+
+        :param positions: (n, 2) position of each car, kept as is
+        :type positions: np.ndarray
+
+        :param routes: route of each car, -1 before it enters
+        :type routes: np.ndarray
+
+        :param encoding: layout and dtype of the features of a cell
+        :type encoding: ObservationEncoding
+        """
+        self._padded_grid = padded_grid
+        self._cell_windows = cell_windows
+        self._positions = positions
+        self._routes = routes
+        self._n_agents = len(positions)
+        self._encoding = encoding
+        self._grid_cols = padded_grid.shape[1] - cell_windows.shape[2] + 1
+        self._cache = [None] * self._n_agents
+
+    def __len__(self):
+        return self._n_agents
+
+    def __getitem__(self, agent_i):
+        if isinstance(agent_i, slice):
+            return [self[i] for i in range(*agent_i.indices(self._n_agents))]
+        if not -self._n_agents <= agent_i < self._n_agents:
+            raise IndexError(agent_i)
+
+        observation = self._cache[agent_i]
+        if observation is None:
+            observation = self._cache[agent_i] = self.__build(agent_i)
+        return observation
+
+    def __build(self, agent_i):
+        row, col = self._positions[agent_i].tolist()
+        codes = self._padded_grid.take(self._cell_windows[row * self._grid_cols + col])
+        encoding = self._encoding
+        observation = np.zeros((*codes.shape, encoding.n_features), dtype=encoding.dtype)
+
+        # only the cells holding a car have features
+        occupied = codes > 0
+        car_ids = codes[occupied] - 1
+        cell_features = observation[occupied]
+        encoding.set_ids(cell_features, car_ids)
+        cell_features[:, encoding.coordinates] = self._positions[car_ids]
+        encoding.set_routes(cell_features, self._routes[car_ids])
+        observation[occupied] = cell_features
+        return observation
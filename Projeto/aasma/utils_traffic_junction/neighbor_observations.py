@@ -0,0 +1,164 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+# columns of a neighbor list: 0-based id of the car, its coordinates, its route (-1 before it enters) and the offset
+# of its cell from the center of the view
+NEIGHBOR_FIELDS = ('id', 'row', 'col', 'route', 'd_row', 'd_col')
+ID, ROW, COL, ROUTE, D_ROW, D_COL = range(len(NEIGHBOR_FIELDS))
+
+
+class NeighborObservation:
+    """
+    Sparse observation of one agent: the cars in its (2r + 1) × (2r + 1) view as a fixed-capacity (capacity, 6) array
+    with the columns of NEIGHBOR_FIELDS, in row-major order of their cell, of which the first `count` rows are used.
+    The car of the agent is one of them, at offset (0, 0), like in the dense observation.
+
+    It holds what the rule agents read from the dense observation, which `to_dense` rebuilds on demand.
+    """
+
+    __slots__ = ('neighbors', 'count', 'view_radius', 'encoding')
+
+    def __init__(self, neighbors, count, view_radius, encoding):
+        self.neighbors = neighbors
+        self.count = count
+        self.view_radius = view_radius
+        self.encoding = encoding
+
+    def __len__(self):
+        # number of rows of the view, as for the dense observation
+        return 2 * self.view_radius + 1
+
+    def cars(self):
+        """
+        :return: the used rows of the neighbor list
+        :rtype: np.ndarray
+        """
+        return self.neighbors[:self.count]
+
+    def center_cell(self):
+        """
+        :return: dense features (id, coordinates, one-hot route) of the cell at the center of the view, all zeros if
+            no car is in it
+        :rtype: np.ndarray
+        """
+        cars = self.cars()
+        center = cars[(cars[:, D_ROW] == 0) & (cars[:, D_COL] == 0)]
+        features = np.zeros(self.encoding.n_features, dtype=self.encoding.dtype)
+        if len(center):
+            features[:] = self.__features(center)[0]
+        return features
+
+    def near_agents(self, agent_position):
+        """
+        Cars in the view other than the one at `agent_position`, in the format of `__get_near_agents` of the rule
+        agents.
+
+        :return: list of [coordinates, one-hot route] of each car
+        :rtype: list
+        """
+        cars = self.cars()
+        cars = cars[(cars[:, ROW] != agent_position[0]) | (cars[:, COL] != agent_position[1])]
+        n_routes = self.encoding.n_routes
+        routes = np.zeros((len(cars), n_routes), dtype=self.encoding.dtype)
+        routes[np.arange(len(cars)), (cars[:, ROUTE].astype(np.intp) - 1) % n_routes] = 1
+        positions = cars[:, ROW:COL + 1].astype(self.encoding.dtype)
+        return [[position, route] for position, route in zip(positions, routes)]
+
+    def to_dense(self):
+        """
+        :return: the dense observation, see `TrafficJunction.get_agent_obs`
+        :rtype: np.ndarray
+        """
+        view_size = 2 * self.view_radius + 1
+        dense = np.zeros((view_size, view_size, self.encoding.n_features), dtype=self.encoding.dtype)
+        cars = self.cars()
+        dense[cars[:, D_ROW] + self.view_radius, cars[:, D_COL] + self.view_radius] = self.__features(cars)
+        return dense
+
+    def __features(self, cars):
+        encoding = self.encoding
+        features = np.zeros((len(cars), encoding.n_features), dtype=encoding.dtype)
+        encoding.set_ids(features, cars[:, ID])
+        features[:, encoding.coordinates] = cars[:, ROW:COL + 1]
+        encoding.set_routes(features, cars[:, ROUTE])
+        return features
+
+
+class NeighborObservations(Sequence):
+    """
+    Sparse observations of all the agents at one step: `neighbors` (n_agents, capacity, 6) and `counts` (n_agents,),
+    see `NeighborObservation`. The capacity is the number of cells of the view, so a list never overflows. It behaves
+    as the list of the observation of each agent.
+    """
+
+    def __init__(self, neighbors, counts, view_radius, encoding):
+        self.neighbors = neighbors
+        self.counts = counts
+        self._view_radius = view_radius
+        self._encoding = encoding
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, agent_i):
+        if isinstance(agent_i, slice):
+            return [self[i] for i in range(*agent_i.indices(len(self)))]
+        return NeighborObservation(self.neighbors[agent_i], int(self.counts[agent_i]), self._view_radius,
+                                   self._encoding)
+
+    def to_dense(self):
+        """
+        :return: the dense observations of all the agents, shape (n_agents, 2r + 1, 2r + 1, F)
+        :rtype: np.ndarray
+        """
+        return np.stack([observation.to_dense() for observation in self])
+
+
+def gather_neighbors(padded_grid, cell_windows, agent_cells, positions, routes, view_radius, encoding):
+    """
+    Builds the neighbor lists of all the agents at once from the windows of the grid around them.
+
+    :param padded_grid: grid padded by the view radius, 0 for the cells without a car and the 1-based id otherwise
+    :type padded_grid: np.ndarray
+
+    :param cell_windows: flat indices in `padded_grid` of the window of each grid cell, see `window_cells`
+    :type cell_windows: np.ndarray
+
+    :param agent_cells: flat grid cell of each agent
+    :type agent_cells: np.ndarray
+
+    :param positions: (n, 2) position of each car
+    :type positions: np.ndarray
+
+    :param routes: route of each car, -1 before it enters
+    :type routes: np.ndarray
+
+    :param view_radius: number of cells seen on each side
+    :type view_radius: int
+
+    :param encoding: layout of the dense features, for `to_dense`
+    :type encoding: ObservationEncoding
+
+    :return: observations of all the agents
+    :rtype: NeighborObservations
+    """
+    view_size = 2 * view_radius + 1
+    codes = padded_grid.take(cell_windows[agent_cells]).reshape(len(agent_cells), view_size * view_size)
+    occupied = codes > 0
+    counts = np.count_nonzero(occupied, axis=1)
+
+    # each car goes to the next free row of the list of its agent, in row-major order of the cells
+    agent_ids, slots = np.nonzero(occupied)
+    ranks = (np.cumsum(occupied, axis=1) - 1)[agent_ids, slots]
+    car_ids = codes[agent_ids, slots] - 1
+
+    neighbors = np.zeros((len(agent_cells), view_size * view_size, len(NEIGHBOR_FIELDS)), dtype=np.int16)
+    rows = neighbors[agent_ids, ranks]
+    rows[:, ID] = car_ids
+    rows[:, ROW:COL + 1] = positions[car_ids]
+    rows[:, ROUTE] = routes[car_ids]
+    rows[:, D_ROW], rows[:, D_COL] = np.divmod(slots, view_size)
+    rows[:, D_ROW:D_COL + 1] -= view_radius
+    neighbors[agent_ids, ranks] = rows
+    return NeighborObservations(neighbors, counts, view_radius, encoding)
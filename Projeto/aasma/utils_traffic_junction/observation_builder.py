@@ -0,0 +1,69 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def pad_grid(grid, view_radius, fill=0):
+    """
+    Pads the grid once so that every window of radius `view_radius` centered on a cell of the grid is in bounds.
+    Only the last two axes are padded, so a stack of grids can be padded at once.
+
+    :param grid: array of cell codes (0 stands for a cell without a car) with shape (..., rows, cols)
+    :type grid: np.ndarray
+
+    :param view_radius: number of cells seen on each side of the agent
+    :type view_radius: int
+
+    :param fill: code used for the cells outside the grid
+    :type fill: int
+
+    :return: padded grid with shape (..., rows + 2 * view_radius, cols + 2 * view_radius)
+    :rtype: np.ndarray
+    """
+    pad_width = [(0, 0)] * (grid.ndim - 2) + [(view_radius, view_radius)] * 2
+    return np.pad(grid, pad_width, mode='constant', constant_values=fill)
+
+
+def extract_windows_batched(padded_grids, positions, view_radius):
+    """
+    Extracts the (2r + 1) x (2r + 1) window around every position of a stack of independent grids, gathering the
+    windows of all agents of all grids at once over a strided sliding-window view of the padded grids.
+
+    :param padded_grids: grids returned by `pad_grid` with shape (n_envs, rows + 2r, cols + 2r)
+    :type padded_grids: np.ndarray
+
+    :param positions: (n_envs, n, 2) array of (row, col) positions in the unpadded grids
+    :type positions: np.ndarray
+
+    :param view_radius: number of cells seen on each side of the agent
+    :type view_radius: int
+
+    :return: array with shape (n_envs, n, 2r + 1, 2r + 1) holding the cell codes around each position
+    :rtype: np.ndarray
+    """
+    view_size = 2 * view_radius + 1
+    windows = sliding_window_view(padded_grids, (view_size, view_size), axis=(1, 2))
+    env_ids = np.arange(padded_grids.shape[0])[:, None]
+    return windows[env_ids, positions[..., 0], positions[..., 1]]
+
+
+def window_cells(grid_shape, view_radius):
+    """
+    Table of the flat indices, in the grid padded by `pad_grid`, of the (2r + 1) x (2r + 1) window centered at each
+    cell of the grid. The windows of the agents are then a gather of this table by their flat cell followed by a
+    gather of the padded grid, both of which can write into preallocated arrays with `np.take`.
+
+    :param grid_shape: (rows, cols) of the unpadded grid
+    :type grid_shape: tuple
+
+    :param view_radius: number of cells seen on each side of the agent
+    :type view_radius: int
+
+    :return: array with shape (rows * cols, 2r + 1, 2r + 1) of flat indices in the padded grid
+    :rtype: np.ndarray
+    """
+    padded_cols = grid_shape[1] + 2 * view_radius
+    view = np.arange(2 * view_radius + 1, dtype=np.intp)
+    offsets = view[:, None] * padded_cols + view[None, :]
+    # the window centered at (row, col) of the grid starts at (row, col) of the padded grid
+    rows, cols = np.divmod(np.arange(grid_shape[0] * grid_shape[1], dtype=np.intp), grid_shape[1])
+    return (rows * padded_cols + cols)[:, None, None] + offsets
@@ -0,0 +1,101 @@
+from typing import NamedTuple
+
+import numpy as np
+
+# encodings of the id of the car in a cell: an n_agents wide one-hot vector, or a single channel with the 1-based id
+# (0 without a car)
+ID_ENCODINGS = ('onehot', 'index')
+# routes a car can take through a junction, one-hot encoded in the features
+N_ROUTES = 3
+
+
+class PackedObservations(NamedTuple):
+    """
+    Bit-packed observations for storage, see `ObservationEncoding.pack`: the binary features of each cell packed 8 per
+    byte along the last axis and the integer features (coordinates and the id channel of 'index') as they are.
+    """
+    bits: np.ndarray
+    values: np.ndarray
+
+
+class ObservationEncoding:
+    """
+    Layout and dtype of the features of a cell of the observations: the id of the car (see ID_ENCODINGS), its 2
+    coordinates and its one-hot route, all zeros for a cell without a car.
+
+    With the default 'onehot' ids and uint8 features, a cell takes n_agents + 5 bytes instead of 8 times as many with
+    the int features, and the 'index' ids take 6 bytes whatever the number of agents.
+    """
+
+    def __init__(self, n_agents, n_routes, grid_shape, id_encoding='onehot', dtype=np.uint8):
+        assert id_encoding in ID_ENCODINGS, "id_encoding should be one of {}".format(ID_ENCODINGS)
+        self.n_agents = n_agents
+        self.n_routes = n_routes
+        self.id_encoding = id_encoding
+        self.dtype = np.dtype(dtype)
+
+        id_size = n_agents if id_encoding == 'onehot' else 1
+        self.ids = slice(0, id_size)
+        self.coordinates = slice(id_size, id_size + 2)
+        self.routes = slice(id_size + 2, id_size + 2 + n_routes)
+        self.n_features = id_size + 2 + n_routes
+
+        # largest value of each feature, the one-hot features are the binary ones
+        self.high = np.ones(self.n_features, dtype=np.int64)
+        self.high[self.coordinates] = np.array(grid_shape) - 1
+        if id_encoding == 'index':
+            self.high[self.ids] = n_agents
+        self.binary = self.high == 1
+        self.binary[self.coordinates] = False
+        if id_encoding == 'index':
+            self.binary[self.ids] = False
+        assert np.can_cast(np.min_scalar_type(self.high.max()), self.dtype), \
+            "dtype {} cannot hold the features, up to {}".format(self.dtype, self.high.max())
+
+    def feature_table(self):
+        """
+        :return: (n_agents + 1, F) features of each grid code with the ids set: row 0 is a cell without a car and row
+            i + 1 describes agent i
+        :rtype: np.ndarray
+        """
+        table = np.zeros((self.n_agents + 1, self.n_features), dtype=self.dtype)
+        self.set_ids(table[1:], np.arange(self.n_agents))
+        return table
+
+    def set_ids(self, features, car_ids):
+        """
+        Writes the id of the cars `car_ids` in the rows of `features`.
+        """
+        if self.id_encoding == 'onehot':
+            features[np.arange(len(car_ids)), self.ids.start + car_ids] = 1
+        else:
+            features[:, self.ids.start] = car_ids + 1
+
+    def set_routes(self, features, routes):
+        """
+        Writes the one-hot `routes` (-1 before the car enters) in the rows of `features`.
+        """
+        features[:, self.routes] = 0
+        features[np.arange(len(routes)), self.routes.start + (routes.astype(np.intp) - 1) % self.n_routes] = 1
+
+    def pack(self, observations):
+        """
+        :param observations: observations with the cell features on the last axis
+        :type observations: np.ndarray
+
+        :return: the observations with their binary features packed 8 per byte
+        :rtype: PackedObservations
+        """
+        observations = np.asarray(observations)
+        return PackedObservations(np.packbits(observations[..., self.binary] != 0, axis=-1),
+                                  observations[..., ~self.binary].astype(self.dtype))
+
+    def unpack(self, packed):
+        """
+        :return: the observations of `pack`
+        :rtype: np.ndarray
+        """
+        observations = np.zeros((*packed.values.shape[:-1], self.n_features), dtype=self.dtype)
+        observations[..., self.binary] = np.unpackbits(packed.bits, axis=-1, count=int(self.binary.sum()))
+        observations[..., ~self.binary] = packed.values
+        return observations
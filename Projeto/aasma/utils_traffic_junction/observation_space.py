@@ -1,4 +1,108 @@
 import gym
+import numpy as np
+from gym import spaces
+
+
+class FeatureBox(spaces.Box):
+    """
+    Box of observations made of cells of F non-negative features, where feature f of every cell is bounded by
+    `feature_high[f]`, see `ObservationEncoding.high`. Only the (F,) bounds are kept: `contains` and `sample` work on
+    them directly, and the full `low` and `high` arrays of the Box are only built the first time they are read. One
+    instance is shared by every agent, see `MultiAgentObservationSpace`.
+    """
+
+    def __init__(self, feature_high, shape, dtype, seed=None):
+        """
+        :param feature_high: (F,) upper bound of each feature of a cell
+        :type feature_high: np.ndarray
+
+        :param shape: shape of an observation, its size a multiple of F with the features of a cell contiguous
+        :type shape: tuple
+
+        :param dtype: dtype of the observations
+        :type dtype: type
+        """
+        self._feature_high = np.array(feature_high, dtype=dtype)
+        assert int(np.prod(shape)) % len(self._feature_high) == 0, "the observation should be made of whole cells"
+        self._low = None
+        self._high = None
+        spaces.Space.__init__(self, tuple(int(size) for size in shape), dtype, seed)
+
+    @property
+    def low(self):
+        if self._low is None:
+            self._low = np.zeros(self.shape, dtype=self.dtype)
+        return self._low
+
+    @property
+    def high(self):
+        if self._high is None:
+            n_cells = int(np.prod(self.shape)) // len(self._feature_high)
+            self._high = np.tile(self._feature_high, n_cells).reshape(self.shape)
+        return self._high
+
+    @property
+    def bounded_below(self):
+        return np.ones(self.shape, dtype=np.bool_)
+
+    @property
+    def bounded_above(self):
+        return np.ones(self.shape, dtype=np.bool_)
+
+    @property
+    def low_repr(self):
+        return '0'
+
+    @property
+    def high_repr(self):
+        return str(self._feature_high.tolist())
+
+    def is_bounded(self, manner='both'):
+        return True
+
+    def contains(self, x):
+        """
+        :return: if `x` is an observation of the space
+        :rtype: bool
+        """
+        return self.contains_batch(np.asarray(x)[None])
+
+    def contains_batch(self, x):
+        """
+        :param x: observations stacked on the first axis
+        :type x: np.ndarray
+
+        :return: if all the observations of `x` are in the space
+        :rtype: bool
+        """
+        x = np.asarray(x)
+        if not np.can_cast(x.dtype, self.dtype) or x.shape[1:] != self.shape:
+            return False
+        cells = x.reshape(-1, len(self._feature_high))
+        return bool((cells >= 0).all() and (cells <= self._feature_high).all())
+
+    def sample(self, mask=None):
+        """
+        :return: observation drawn uniformly from the space
+        :rtype: np.ndarray
+        """
+        return self.sample_batch(1)[0]
+
+    def sample_batch(self, n):
+        """
+        :return: `n` observations drawn uniformly from the space, stacked on the first axis
+        :rtype: np.ndarray
+        """
+        n_cells = int(np.prod(self.shape)) // len(self._feature_high)
+        cells = self.np_random.integers(0, self._feature_high.astype(np.int64) + 1,
+                                        size=(n * n_cells, len(self._feature_high)))
+        return cells.astype(self.dtype).reshape(n, *self.shape)
+
+    def __eq__(self, other):
+        if isinstance(other, FeatureBox):
+            return (self.shape == other.shape and self.dtype == other.dtype and
+                    np.array_equal(self._feature_high, other._feature_high))
+        return super().__eq__(other)
 
 
 class MultiAgentObservationSpace(list):
@@ -9,12 +113,35 @@ class MultiAgentObservationSpace(list):
         super().__init__(agents_observation_space)
         self._agents_observation_space = agents_observation_space
 
+    @classmethod
+    def shared(cls, observation_space, n_agents):
+        """
+        :return: space where every agent has the same `observation_space` instance, so its size does not grow with the
+            number of agents
+        :rtype: MultiAgentObservationSpace
+        """
+        return cls([observation_space] * n_agents)
+
+    def __shared_space(self):
+        # the space of every agent when they all share one instance, None otherwise
+        first = self._agents_observation_space[0] if len(self._agents_observation_space) else None
+        if all(space is first for space in self._agents_observation_space):
+            return first
+        return None
+
     def sample(self):
         """ samples observations for each agent from uniform distribution"""
+        space = self.__shared_space()
+        if isinstance(space, FeatureBox):
+            # a single draw stacked for all the agents
+            return space.sample_batch(len(self._agents_observation_space))
         return [agent_observation_space.sample() for agent_observation_space in self._agents_observation_space]
 
     def contains(self, obs):
-        """ contains observation """
+        """ contains observation, `obs` being the list of the observation of each agent or their stacked array """
+        space = self.__shared_space()
+        if isinstance(space, FeatureBox) and isinstance(obs, np.ndarray):
+            return len(obs) == len(self._agents_observation_space) and space.contains_batch(obs)
         for space, ob in zip(self._agents_observation_space, obs):
             if not space.contains(ob):
                 return False
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def stream_seed(seed, *keys):
+    """
+    Seed of the independent random stream `keys` of a run seeded with `seed`, e.g. `stream_seed(seed, cell, episode)`
+    for an episode of a sweep. It is the child reached by spawning `SeedSequence(seed)` along `keys`, so any stream
+    can be rebuilt alone, in any process, without drawing the streams before it.
+
+    :param seed: seed of the run, None for fresh entropy
+    :type seed: int
+
+    :param keys: non-negative index of the stream at each level of the tree
+    :type keys: int
+
+    :return: seed to give to `np.random.default_rng`, or to spawn the child streams from
+    :rtype: np.random.SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + tuple(keys),
+                                      pool_size=seed.pool_size)
+    return np.random.SeedSequence(seed, spawn_key=tuple(keys))
+
+
+def spawn_rngs(seed, n):
+    """
+    :param seed: seed of the parent stream, see `stream_seed`
+    :type seed: np.random.SeedSequence
+
+    :return: generators of the `n` independent child streams of `seed`
+    :rtype: list
+    """
+    return [np.random.default_rng(child) for child in stream_seed(seed).spawn(n)]
@@ -0,0 +1,127 @@
+import numpy as np
+
+
+def path_id(gate_i, route, n_routes):
+    """
+    :return: row of the path tables followed by a car entering at gate `gate_i` with `route` (1 - fwd, 2 - turn right,
+        3 - turn left)
+    :rtype: int
+    """
+    return gate_i * n_routes + route - 1
+
+
+def turn_direction(dir_vector, route):
+    """
+    Direction vector after turning right (route 2) or left (route 3) when moving along `dir_vector`.
+
+    :rtype: tuple
+    """
+    sig = (1 if dir_vector[1] != 0 else -1) if route == 2 else (-1 if dir_vector[1] != 0 else 1)
+    return (dir_vector[1] * sig, 0) if dir_vector[0] == 0 else (0, dir_vector[0] * sig)
+
+
+def build_path_tables(grid_shape, entry_gates, route_vectors, turning_places, destinations, n_routes):
+    """
+    Walks once every route from every entry gate: the car moves along the direction of its gate and, on routes 2
+    and 3, turns once at the turning place of its direction, until it reaches a destination. Since a path only
+    depends on the gate and the route, cars can then follow their path by index.
+
+    :param grid_shape: (rows, cols) of the grid
+    :type grid_shape: tuple
+
+    :param entry_gates: positions where the cars spawn
+    :type entry_gates: list
+
+    :param route_vectors: direction vector of the cars entering at each gate
+    :type route_vectors: dict
+
+    :param turning_places: (turn right, turn left) positions for each direction vector
+    :type turning_places: dict
+
+    :param destinations: positions where the cars leave the grid
+    :type destinations: list
+
+    :param n_routes: number of routes
+    :type n_routes: int
+
+    :return: (n_gates * n_routes, max_length, 2) positions of each path, padded with its destination, and the number
+        of cells of each path. Paths are indexed by `path_id`
+    :rtype: tuple
+    """
+    destinations = set(destinations)
+    paths = []
+    for gate in entry_gates:
+        for route in range(1, n_routes + 1):
+            pos, dir_vector, turned = gate, route_vectors[gate], False
+            path = [pos]
+            while pos not in destinations:
+                if route != 1 and not turned and pos == turning_places[dir_vector][route - 2]:
+                    dir_vector, turned = turn_direction(dir_vector, route), True
+                pos = (pos[0] + dir_vector[0], pos[1] + dir_vector[1])
+                assert 0 <= pos[0] < grid_shape[0] and 0 <= pos[1] < grid_shape[1], \
+                    "route {} from gate {} leaves the grid before reaching a destination".format(route, gate)
+                path.append(pos)
+            paths.append(path)
+
+    path_lengths = np.array([len(path) for path in paths], dtype=np.int64)
+    path_positions = np.empty((len(paths), path_lengths.max(), 2), dtype=np.int64)
+    for path_i, path in enumerate(paths):
+        path_positions[path_i, :len(path)] = path
+        path_positions[path_i, len(path):] = path[-1]
+    return path_positions, path_lengths
+
+
+def build_network_paths(geometry, n_routes):
+    """
+    Walks once every path of a grid tiled with several junctions (see `JunctionGeometry`). A car moves along the
+    direction of its gate and, on routes 2 and 3, turns once at the turning place of the `turn`-th junction it
+    crosses, until it reaches a destination. Routes 1 go straight, so they only have the path of `turn` 0.
+
+    :param geometry: layout of the grid
+    :type geometry: JunctionGeometry
+
+    :param n_routes: number of routes
+    :type n_routes: int
+
+    :return: (n_paths, max_length, 2) positions of each path, padded with its destination, the number of cells of each
+        path, the (n_gates, n_routes, max_turns) row of the path of each gate, route and turn (-1 for the turns past
+        the junctions crossed by the gate) and the number of junctions crossed from each gate
+    :rtype: tuple
+    """
+    destinations = set(geometry.destinations)
+    block_rows, block_cols = geometry.block_shape
+    # junctions crossed by the lanes of each gate: rightward and leftward gates cross a row of blocks
+    gate_turns = np.array([geometry.blocks[1] if vector[0] == 0 else geometry.blocks[0]
+                           for vector in (geometry.route_vectors[gate] for gate in geometry.entry_gates)],
+                          dtype=np.int64)
+    max_turns = int(gate_turns.max())
+
+    paths = []
+    path_index = np.full((len(geometry.entry_gates), n_routes, max_turns), -1, dtype=np.int64)
+    for gate_i, gate in enumerate(geometry.entry_gates):
+        for route in range(1, n_routes + 1):
+            for turn in range(gate_turns[gate_i] if route != 1 else 1):
+                pos, dir_vector, turned, junctions_crossed = gate, geometry.route_vectors[gate], False, 0
+                path = [pos]
+                while pos not in destinations:
+                    # the turning places are the same in every block
+                    local_pos = (pos[0] % block_rows, pos[1] % block_cols)
+                    if route != 1 and not turned and junctions_crossed == turn and \
+                            local_pos == geometry.turning_places[dir_vector][route - 2]:
+                        dir_vector, turned = turn_direction(dir_vector, route), True
+                    next_pos = (pos[0] + dir_vector[0], pos[1] + dir_vector[1])
+                    assert 0 <= next_pos[0] < geometry.grid_shape[0] and 0 <= next_pos[1] < geometry.grid_shape[1], \
+                        "route {} from gate {} leaves the grid before reaching a destination".format(route, gate)
+                    if geometry.is_junction[pos] and not geometry.is_junction[next_pos]:
+                        junctions_crossed += 1
+                    pos = next_pos
+                    path.append(pos)
+                path_index[gate_i, route - 1, turn] = len(paths)
+                paths.append(path)
+
+    path_lengths = np.array([len(path) for path in paths], dtype=np.int64)
+    path_positions = np.empty((len(paths), path_lengths.max(), 2), dtype=np.int64)
+    for path_i, path in enumerate(paths):
+        path_positions[path_i, :len(path)] = path
+        path_positions[path_i, len(path):] = path[-1]
+    return path_positions, path_lengths, path_index, gate_turns
@@ -0,0 +1,89 @@
+from functools import lru_cache
+
+import numpy as np
+
+from .agent_state import read_only
+from .draw import draw_grid, fill_cell
+from .geometry import junction_geometry
+from .observation_builder import window_cells
+from .route_paths import build_path_tables
+
+
+class StaticLayers:
+    """
+    Everything of a TrafficJunction that only depends on its grid shape and number of routes, built once per process
+    and shared by every environment, see `static_layers`:
+
+    - geometry: layout of the junction, see `JunctionGeometry`
+    - track_grid: grid without cars, walls -1 and road 0 as in `GRID_IDS`
+    - path_positions, path_lengths, path_cells: the path of every gate and route, see `build_path_tables`, and the
+      flat grid index of each of its cells
+    - cell_gate: index of the entry gate in each flat cell, -1 elsewhere
+
+    The window tables of the observations (`window_cells`) and the base image of the rendering (`base_image`) are
+    built the first time they are asked for. Arrays are read-only and the image is copied before being drawn on, so
+    environments can share them; resetting an environment only copies its dynamic state.
+    """
+
+    def __init__(self, grid_shape, n_routes):
+        self.grid_shape = grid_shape
+        self.geometry = junction_geometry(grid_shape)
+
+        track_grid = np.full(grid_shape, -1, dtype=np.int16)
+        track_grid[self.geometry.road] = 0
+        self.track_grid = read_only(track_grid)
+
+        path_positions, path_lengths = build_path_tables(grid_shape, self.geometry.entry_gates,
+                                                         self.geometry.route_vectors, self.geometry.turning_places,
+                                                         self.geometry.destinations, n_routes)
+        self.path_positions = read_only(path_positions)
+        self.path_lengths = read_only(path_lengths)
+        self.path_cells = read_only(path_positions[..., 0] * grid_shape[1] + path_positions[..., 1])
+
+        cell_gate = np.full(grid_shape[0] * grid_shape[1], -1, dtype=np.int64)
+        for gate, pos in enumerate(self.geometry.entry_gates):
+            cell_gate[pos[0] * grid_shape[1] + pos[1]] = gate
+        self.cell_gate = read_only(cell_gate)
+
+        self._window_cells = {}
+        self._base_images = {}
+
+    def window_cells(self, view_radius):
+        """
+        :return: flat indices of the window of each grid cell in the padded grid, see `window_cells`
+        :rtype: np.ndarray
+        """
+        if view_radius not in self._window_cells:
+            self._window_cells[view_radius] = read_only(window_cells(self.grid_shape, view_radius))
+        return self._window_cells[view_radius]
+
+    def base_image(self, cell_size, wall_color):
+        """
+        :return: image of the grid without cars, to be copied before drawing the cars on it
+        :rtype: PIL.Image.Image
+        """
+        key = (cell_size, wall_color)
+        if key not in self._base_images:
+            # create grid and make everything black, then draw the tracks and the walls
+            img = draw_grid(self.grid_shape[0], self.grid_shape[1], cell_size=cell_size, fill=wall_color)
+            for i, row in enumerate(self.geometry.road.tolist()):
+                for j, is_road in enumerate(row):
+                    if is_road:
+                        fill_cell(img, (i, j), cell_size=cell_size, fill=(143, 141, 136), margin=0.05)
+                    else:
+                        fill_cell(img, (i, j), cell_size=cell_size, fill=(242, 227, 167), margin=0.02)
+            self._base_images[key] = img
+        return self._base_images[key]
+
+
+def static_layers(grid_shape, n_routes):
+    """
+    :return: static layers of `grid_shape`, built once and shared by every environment of the process
+    :rtype: StaticLayers
+    """
+    return _cached_layers(tuple(int(size) for size in grid_shape), int(n_routes))
+
+
+@lru_cache(maxsize=None)
+def _cached_layers(grid_shape, n_routes):
+    return StaticLayers(grid_shape, n_routes)
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class StepBuffers:
+    """
+    Output arrays of a TrafficJunction allocated once by the caller and passed as `out` to `reset` and `step`, which
+    write into them instead of building new lists and arrays at every step:
+
+    - actions: (n,) int8 array the caller can fill with the actions of the agents
+    - observations: (n, 2r + 1, 2r + 1, F) observations of the agents, see `TrafficJunction.get_agent_obs`, or None
+      for environments that build the observations on demand (`obs_shape` None)
+    - rewards: (n,) reward of each agent
+    - dones: (n,) flag if each agent is done
+    - step_collisions, cascade_rounds: 0-d arrays with the collision counts of the last step
+    - skipped_steps: 0-d array with the number of steps skipped by the fast-forward before the last step
+
+    `info` is a dict created once that holds the 0-d arrays, so it is up to date after every step.
+    The arrays are overwritten by the next call, copy them to keep them.
+    """
+
+    def __init__(self, n_agents, obs_shape, obs_dtype=int):
+        self.actions = np.zeros(n_agents, dtype=np.int8)
+        self.observations = None if obs_shape is None else np.zeros((n_agents, *obs_shape), dtype=obs_dtype)
+        self.rewards = np.zeros(n_agents)
+        self.dones = np.zeros(n_agents, dtype=np.bool_)
+        self.step_collisions = np.zeros((), dtype=np.int64)
+        self.cascade_rounds = np.zeros((), dtype=np.int64)
+        self.skipped_steps = np.zeros((), dtype=np.int64)
+        self.info = {'step_collisions': self.step_collisions, 'cascade_rounds': self.cascade_rounds,
+                     'skipped_steps': self.skipped_steps}
+
+    @classmethod
+    def over(cls, actions, observations, rewards, dones, step_collisions=None, cascade_rounds=None):
+        """
+        Buffers writing into existing arrays instead of their own, e.g. the rows of the shared-memory buffers of a
+        TrafficJunctionPool, so the environment fills them in place.
+
+        :param step_collisions: 0-d int64 array, a new one is allocated if not given
+        :type step_collisions: np.ndarray
+
+        :param cascade_rounds: 0-d int64 array, a new one is allocated if not given
+        :type cascade_rounds: np.ndarray
+
+        :return: buffers over the given arrays
+        :rtype: StepBuffers
+        """
+        buffers = cls(len(actions), None)
+        buffers.actions, buffers.observations, buffers.rewards, buffers.dones = actions, observations, rewards, dones
+        if step_collisions is not None:
+            buffers.step_collisions = buffers.info['step_collisions'] = step_collisions
+        if cascade_rounds is not None:
+            buffers.cascade_rounds = buffers.info['cascade_rounds'] = cascade_rounds
+        return buffers
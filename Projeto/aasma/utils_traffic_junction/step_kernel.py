@@ -0,0 +1,127 @@
+import numpy as np
+
+from .collisions import resolve_collisions
+
+try:
+    import numba
+except ImportError:  # the kernel still runs, uncompiled, without numba
+    numba = None
+
+JIT_AVAILABLE = numba is not None
+
+
+def _jit(function):
+    return numba.njit(cache=True)(function) if JIT_AVAILABLE else function
+
+
+_resolve_collisions = _jit(resolve_collisions)
+
+
+@_jit
+def move_cars(actions, active_ids, agent_pos, agent_path, agent_progress, agent_dones, agent_step_count, grid,
+              path_cells, path_lengths, cell_gate, gates_taken, step_count, max_steps, curr_cells, next_cells):
+    """
+    Applies the movement rules of one step of the TrafficJunction to plain integer arrays, updating them in place:
+    the active cars that gas advance one cell along their path, the conflicts are resolved by `resolve_collisions`,
+    the grid is updated, the cars at the end of their path are removed and every car is done once `max_steps` is
+    reached. Spawning is left to the caller: its draws come from the `np.random.Generator` of the environment or from
+    an `ArrivalSchedule`, and keeping them in Python keeps both steps on the same random stream. It places at most
+    one car per step.
+
+    :param actions: action of each car (0 - gas, 1 - brake)
+    :type actions: np.ndarray
+
+    :param active_ids: ascending ids of the cars on the road and not done, compacted in place to the cars still active
+        after the step
+    :type active_ids: np.ndarray
+
+    :param agent_pos: (n, 2) position of each car
+    :type agent_pos: np.ndarray
+
+    :param agent_path: path followed by each car, -1 before it enters the road
+    :type agent_path: np.ndarray
+
+    :param agent_progress: index of the cell of each car in its path
+    :type agent_progress: np.ndarray
+
+    :param agent_dones: flag if the car is done
+    :type agent_dones: np.ndarray
+
+    :param agent_step_count: number of steps each car spent on the road
+    :type agent_step_count: np.ndarray
+
+    :param grid: occupancy grid, cars are stored as their 1-based id
+    :type grid: np.ndarray
+
+    :param path_cells: flat grid index of the cells of each path, see `build_path_tables`
+    :type path_cells: np.ndarray
+
+    :param path_lengths: number of cells of each path
+    :type path_lengths: np.ndarray
+
+    :param cell_gate: index of the entry gate in each flat cell, -1 elsewhere
+    :type cell_gate: np.ndarray
+
+    :param gates_taken: bitmask of the entry gates with a car on them
+    :type gates_taken: int
+
+    :param step_count: environment step counter, already incremented for this step
+    :type step_count: int
+
+    :param max_steps: maximum number of steps of an episode
+    :type max_steps: int
+
+    :param curr_cells: work array of at least `len(active_ids)` int64, receives the current cell of each active car
+    :type curr_cells: np.ndarray
+
+    :param next_cells: work array of at least `len(active_ids)` int64, receives the cell each active car wants
+    :type next_cells: np.ndarray
+
+    :return: number of collisions, number of cascade rounds, number of cars that reached their destination, number
+        of cars still active and the updated bitmask of taken gates
+    :rtype: tuple
+    """
+    n_active = len(active_ids)
+    n_cols = grid.shape[1]
+    curr_cells = curr_cells[:n_active]
+    next_cells = next_cells[:n_active]
+
+    for k in range(n_active):
+        agent_i = active_ids[k]
+        path, progress = agent_path[agent_i], agent_progress[agent_i]
+        curr_cells[k] = path_cells[path, progress]
+        next_cells[k] = path_cells[path, progress + 1] if actions[agent_i] == 0 else curr_cells[k]
+
+    new_cells, n_collisions, cascade_rounds = _resolve_collisions(curr_cells, next_cells, grid.size)
+
+    # vacated cells are cleared before any car is written, cars only enter a gate cell when they spawn
+    flat_grid = grid.reshape(-1)
+    for k in range(n_active):
+        if new_cells[k] != curr_cells[k]:
+            flat_grid[curr_cells[k]] = 0
+            agent_progress[active_ids[k]] += 1
+            if cell_gate[curr_cells[k]] >= 0:
+                gates_taken &= ~(1 << cell_gate[curr_cells[k]])
+    for k in range(n_active):
+        agent_i = active_ids[k]
+        agent_pos[agent_i, 0] = new_cells[k] // n_cols
+        agent_pos[agent_i, 1] = new_cells[k] % n_cols
+        flat_grid[new_cells[k]] = agent_i + 1
+
+    n_left = 0
+    for k in range(n_active):
+        agent_i = active_ids[k]
+        agent_step_count[agent_i] += 1
+        if agent_progress[agent_i] == path_lengths[agent_path[agent_i]] - 1:
+            flat_grid[new_cells[k]] = 0
+            agent_dones[agent_i] = True
+        else:
+            active_ids[n_left] = agent_i
+            n_left += 1
+    n_arrived = n_active - n_left
+
+    if step_count >= max_steps:
+        agent_dones[:] = True
+        n_left = 0
+
+    return n_collisions, cascade_rounds, n_arrived, n_left, gates_taken
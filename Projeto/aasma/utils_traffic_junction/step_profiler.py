@@ -0,0 +1,163 @@
+import json
+import time
+
+# phases of `TrafficJunction.step`, in the order they run, 'other' is what runs between the spawn and the observations
+# (the `time.sleep(0)` yield and the writes of the results into the buffers)
+PHASES = ('fast_forward', 'next_positions', 'update_agent_pos', 'destinations', 'move_cars_jit', 'spawn', 'other',
+          'observations')
+# counters of a step: cars that advanced a cell, cars that collided, cascade rounds needed to resolve the collisions
+# and cars that entered the road
+COUNTERS = ('cars_moved', 'conflicts', 'restarts', 'spawns')
+
+
+class StepProfiler:
+    """
+    Opt-in instrumentation of `TrafficJunction.step`, given as `TrafficJunction(profiler=...)` or set as the
+    `profiler` attribute. The environment marks the end of each phase with `lap`, which adds the time since the
+    previous mark to the phase, and reports the counters of the step with `end_step`. Without a profiler, the step
+    only tests it against None once per phase.
+
+    Timings and counters are summed per episode (`episodes`, closed at each reset), and the first `max_trace_steps`
+    steps are also kept as events for `trace_events`, so a long sweep can stay profiled with bounded memory.
+    """
+
+    def __init__(self, max_trace_steps=10000, clock=time.perf_counter_ns):
+        """
+        :param max_trace_steps: number of steps kept as trace events, the later ones are only aggregated
+        :type max_trace_steps: int
+
+        :param clock: clock in nanoseconds
+        :type clock: callable
+        """
+        self.max_trace_steps = max_trace_steps
+        self._clock = clock
+        self._origin = clock()
+        self.episodes = []  # totals of each finished episode, see `_new_episode`
+        self._episode = self._new_episode()
+        self._traced_steps = 0
+        self._step_events = []  # (step, start, duration, counters) of the traced steps
+        self._phase_events = []  # (phase, start, duration) of the traced steps
+        self._step_start = self._mark = self._origin
+        self._step = 0
+
+    @staticmethod
+    def _new_episode():
+        return {'steps': 0, 'phases': dict.fromkeys(PHASES, 0), 'counters': dict.fromkeys(COUNTERS, 0)}
+
+    def begin_step(self, step):
+        """
+        :param step: step counter of the environment before the step
+        :type step: int
+        """
+        self._step = step
+        self._step_start = self._mark = self._clock()
+
+    def lap(self, phase):
+        """
+        Adds the time since the previous mark to `phase`.
+
+        :param phase: one of `PHASES`
+        :type phase: str
+        """
+        now = self._clock()
+        self._episode['phases'][phase] += now - self._mark
+        if self._traced_steps < self.max_trace_steps:
+            self._phase_events.append((phase, self._mark, now - self._mark))
+        self._mark = now
+
+    def end_step(self, cars_moved, conflicts, restarts, spawns):
+        counters = self._episode['counters']
+        counters['cars_moved'] += cars_moved
+        counters['conflicts'] += conflicts
+        counters['restarts'] += restarts
+        counters['spawns'] += spawns
+        self._episode['steps'] += 1
+        if self._traced_steps < self.max_trace_steps:
+            self._step_events.append((self._step, self._step_start, self._mark - self._step_start,
+                                      (cars_moved, conflicts, restarts, spawns)))
+            self._traced_steps += 1
+
+    def end_episode(self):
+        """Closes the current episode, called by `TrafficJunction.reset`"""
+        if self._episode['steps']:
+            self.episodes.append(self._episode)
+            self._episode = self._new_episode()
+
+    def totals(self):
+        """
+        :return: number of episodes and steps, and the nanoseconds of each phase and the counters summed over them,
+            including the episode in progress
+        :rtype: dict
+        """
+        episodes = self.episodes + ([self._episode] if self._episode['steps'] else [])
+        return {'episodes': len(episodes),
+                'steps': sum(episode['steps'] for episode in episodes),
+                'phases': {phase: sum(episode['phases'][phase] for episode in episodes) for phase in PHASES},
+                'counters': {counter: sum(episode['counters'][counter] for episode in episodes)
+                             for counter in COUNTERS}}
+
+    def summary(self):
+        """
+        :return: table of the time spent in each phase and of the counters, in total, per step and per episode
+        :rtype: str
+        """
+        totals = self.totals()
+        n_episodes, n_steps = max(totals['episodes'], 1), max(totals['steps'], 1)
+        total_ns = max(sum(totals['phases'].values()), 1)
+
+        lines = [f"{totals['episodes']} episodes, {totals['steps']} steps",
+                 f"  {'phase':<18}{'total ms':>12}{'us/step':>12}{'ms/episode':>12}{'share':>8}"]
+        for phase, nanoseconds in totals['phases'].items():
+            if nanoseconds:
+                lines.append(f"  {phase:<18}{nanoseconds / 1e6:>12.2f}{nanoseconds / n_steps / 1e3:>12.2f}"
+                             f"{nanoseconds / n_episodes / 1e6:>12.3f}{nanoseconds / total_ns:>8.1%}")
+        lines.append(f"  {'counter':<18}{'total':>12}{'per step':>12}{'per episode':>12}")
+        for counter, count in totals['counters'].items():
+            lines.append(f"  {counter:<18}{count:>12}{count / n_steps:>12.2f}{count / n_episodes:>12.1f}")
+        return "\n".join(lines)
+
+    def trace_events(self, pid=0, name=None):
+        """
+        :param pid: process id of the events, to show several profilers side by side
+        :type pid: int
+
+        :param name: name shown for the process
+        :type name: str
+
+        :return: Chrome trace events (loadable in chrome://tracing or Perfetto) of the traced steps: one complete event
+            per step with its counters, one per phase nested in it and a counter track
+        :rtype: list
+        """
+        def microseconds(timestamp):
+            return (timestamp - self._origin) / 1e3
+
+        events = []
+        if name is not None:
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': name}})
+        for step, start, duration, counters in self._step_events:
+            args = dict(zip(COUNTERS, counters), step=step)
+            events.append({'name': 'step', 'cat': 'step', 'ph': 'X', 'ts': microseconds(start),
+                           'dur': duration / 1e3, 'pid': pid, 'tid': 0, 'args': args})
+            events.append({'name': 'counters', 'ph': 'C', 'ts': microseconds(start), 'pid': pid,
+                           'args': dict(zip(COUNTERS, counters))})
+        for phase, start, duration in self._phase_events:
+            events.append({'name': phase, 'cat': 'phase', 'ph': 'X', 'ts': microseconds(start),
+                           'dur': duration / 1e3, 'pid': pid, 'tid': 0})
+        return events
+
+
+def save_trace(path, profilers):
+    """
+    Writes the trace of one or more profilers as a Chrome trace-event JSON file, each profiler as a process.
+
+    :param path: file to write
+    :type path: str
+
+    :param profilers: profilers keyed by the name of their process, e.g. one per team
+    :type profilers: dict
+    """
+    events = []
+    for pid, (name, profiler) in enumerate(profilers.items()):
+        events += profiler.trace_events(pid, name)
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
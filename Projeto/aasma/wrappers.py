@@ -1,4 +1,7 @@
-from gym import Wrapper
+import numpy as np
+from gym import Env, Wrapper
+
+from aasma.utils_traffic_junction.step_buffers import StepBuffers
 
 
 class SingleAgentWrapper(Wrapper):
@@ -22,3 +25,102 @@ class SingleAgentWrapper(Wrapper):
 
     def get_action_meanings(self):
         return self.env.get_action_meanings(self.agent_id)
+
+
+class VectorTeamAdapter:
+
+    """
+    Adapter that lets a team of regular agents act on a VectorTrafficJunction. One copy of the team is kept for
+    each junction of the batch and every agent sees its own slice of the batched observations.
+    """
+
+    def __init__(self, team_factory, n_envs):
+        self.teams = [team_factory() for _ in range(n_envs)]
+        self.n_envs = n_envs
+        self.n_agents = len(self.teams[0])
+
+    def act(self, observations):
+        """
+        Feeds the observations to the agents and collects their actions.
+
+        :param observations: observations returned by the vector environment, shape (n_envs, n_agents, ...)
+        :type observations: np.ndarray
+
+        :return: actions with shape (n_envs, n_agents) and the waiting times reported by the agents (0 if none)
+        :rtype: tuple
+        """
+        actions = np.zeros((self.n_envs, self.n_agents), dtype=np.int64)
+        waiting_times = np.zeros((self.n_envs, self.n_agents), dtype=np.int64)
+        for env_i, agents in enumerate(self.teams):
+            for observation, agent in zip(observations[env_i], agents):
+                agent.see(observation)
+                agent.update_moving_direction()
+
+            for agent_i, agent in enumerate(agents):
+                action, waiting_time = agent.action()
+                actions[env_i, agent_i] = action
+                waiting_times[env_i, agent_i] = waiting_time or 0
+        return actions, waiting_times
+
+    def reset(self, env_ids):
+        """Clears the episode memory of the teams acting on the given junctions"""
+        for env_i in env_ids:
+            for agent in self.teams[env_i]:
+                agent.reset_visited()
+                agent.reset_waiting_time()
+                agent.reset_has_entered_junction()
+
+
+class ParallelListAdapter(Env):
+
+    """
+    Adapter that gives back the list API of TrafficJunction on top of a ParallelTrafficJunction, so that
+    SingleAgentWrapper and run_multi_agent work with it. Only the actions of the live cars are forwarded; the other
+    agents get an empty observation (no car in view) and a 0 reward, and the dones of every car are reported.
+    """
+
+    def __init__(self, parallel_env):
+        self.parallel_env = parallel_env
+        self.n_agents = parallel_env.n_agents
+        self.action_space = parallel_env.env.action_space
+        self.observation_space = parallel_env.env.observation_space
+
+        space = parallel_env.observation_space
+        self._empty_observation = np.zeros(space.shape, dtype=space.dtype)
+        self._empty_observation.flags.writeable = False
+
+    def make_buffers(self):
+        """Allocates the arrays to pass as `out` to `reset` and `step`, see `TrafficJunction.make_buffers`"""
+        return StepBuffers(self.n_agents, None)
+
+    def reset(self, out=None, seed=None, schedule=None):
+        observations = self.parallel_env.reset(seed, schedule)
+        if out is not None:
+            out.rewards.fill(0)
+            out.dones.fill(False)
+        return self.__observation_list(observations)
+
+    def step(self, agents_action, out=None):
+        live_actions = {agent_i: agents_action[agent_i] for agent_i in self.parallel_env.env.active_agents().tolist()}
+        observations, rewards, _, info = self.parallel_env.step(live_actions)
+
+        dones = self.parallel_env.env._agent_dones
+        if out is None:
+            return self.__observation_list(observations), self.__reward_list(rewards), dones.copy(), info
+        out.rewards.fill(0)
+        for agent_i, reward in rewards.items():
+            out.rewards[agent_i] = reward
+        np.copyto(out.dones, dones)
+        return self.__observation_list(observations), out.rewards, out.dones, info
+
+    def __observation_list(self, observations):
+        return [observations.get(agent_i, self._empty_observation) for agent_i in range(self.n_agents)]
+
+    def __reward_list(self, rewards):
+        return [rewards.get(agent_i, 0) for agent_i in range(self.n_agents)]
+
+    def render(self, mode='human'):
+        return self.parallel_env.render(mode)
+
+    def close(self):
+        self.parallel_env.close()
@@ -1,5 +1,8 @@
 import numpy as np
 from aasma import Agent
+from aasma.utils_traffic_junction.neighbor_observations import NeighborObservation
+from aasma.utils_traffic_junction.observation_encoding import N_ROUTES, ObservationEncoding
+from aasma.utils_traffic_junction.geometry import APPROACHES, junction_geometry
 from enum import Enum
 
 from agents import CommunicationHandler
@@ -9,21 +12,11 @@ GAS, BREAK = range(N_ACTIONS)
 
 
 class Pre_Junction(Enum):
-    TOP = [5, 6]
-    LEFT = [7, 5]
-    DOWN = [8, 7]
-    RIGHT = [6, 8]
-    # Ordered counter-clockwise directions
-    DIRECTION = [TOP, LEFT, DOWN, RIGHT]
-
-
-class Junction_Pos(Enum):
-    TOP_LEFT = [6, 6]
-    BOTTOM_LEFT = [7, 6]
-    BOTTOM_RIGHT = [7, 7]
-    TOP_RIGHT = [6, 7]
-    # Ordered counter-clockwise directions
-    DIRECTION = [TOP_LEFT, BOTTOM_LEFT, BOTTOM_RIGHT, TOP_RIGHT]
+    # Index of the approach in the geometry, ordered counter-clockwise
+    TOP = APPROACHES.index('top')
+    LEFT = APPROACHES.index('left')
+    DOWN = APPROACHES.index('bottom')
+    RIGHT = APPROACHES.index('right')
 
 
 class Movement(Enum):
@@ -31,11 +24,9 @@ class Movement(Enum):
     LEFTWARDS = "Leftwards"
     UPWARDS = "Upwards"
     RIGHTWARDS = "Rightwards"
-    # Ordered counter-clockwise directions
+    # Ordered as the lane headings of the geometry: cars coming from Pre_Junction i move in DIRECTION[i]
     DIRECTION = [DOWNWARDS, RIGHTWARDS, UPWARDS, LEFTWARDS]
 
-    #DIRECTION = [DOWNWARDS, LEFTWARDS, UPWARDS, RIGHTWARDS]
-
 class CommunicatingAgent(Agent):
     """
     A baseline agent for the TrafficJunction environment.
@@ -43,14 +34,16 @@ class CommunicatingAgent(Agent):
     but follows the convention of giving priority to the car if it's on his right.
     """
 
-    def __init__(self, agent_id, n_agents, communication_handler: CommunicationHandler):
+    def __init__(self, agent_id, n_agents, communication_handler: CommunicationHandler, grid_shape=(14, 14), blocks=(1, 1), id_encoding='onehot'):
         super(CommunicatingAgent, self).__init__(f"Communicating Agent")
         self.agent_id = agent_id
         self.n_agents = n_agents
+        self.encoding = ObservationEncoding(n_agents, N_ROUTES, grid_shape, id_encoding, dtype=int)
         self.n_actions = N_ACTIONS
+        self.geometry = junction_geometry(grid_shape, blocks)
         self.visited_positions = []
         self.moving_direction = ""
-        self.pre_junction_pos = []
+        self.pre_junction_pos = -1
         self.communication_handler = communication_handler
         self.waiting_time = 0
         self.has_entered_junction = False
@@ -59,10 +52,10 @@ class CommunicatingAgent(Agent):
     def action(self) -> int:
         max_time = None
 
-        # middle cell of a 5x5 grid, and position on the list of coordinates
-        agent_position = self.observation[2][2][self.n_agents:self.n_agents + 2]
+        # middle cell of the (2r + 1)x(2r + 1) view, and position on the list of coordinates
+        agent_position = self.center_cell()[self.encoding.coordinates]
 
-        agent_route = self.observation[2][2][self.n_agents + 2:]
+        agent_route = self.center_cell()[self.encoding.routes]
 
         # get all the positions nearby agents that it can observe, except himself
         near_agents = self.__get_near_agents(agent_position)
@@ -72,7 +65,7 @@ class CommunicatingAgent(Agent):
 
         action = self.__get_action(agent_position, near_agents)
         
-        if self.__is_in_junction(agent_position):
+        if self.geometry.in_junction(agent_position):
             self.has_entered_junction = True
         
         if not self.has_entered_junction:
@@ -89,46 +82,40 @@ class CommunicatingAgent(Agent):
 
     def get_agent_position(self):
         if len(self.observation) != 0:
-            return self.observation[2][2][self.n_agents:self.n_agents + 2]
+            return self.center_cell()[self.encoding.coordinates]
         return []
 
     def update_moving_direction(self):
-        agent_position = self.observation[2][2][self.n_agents:self.n_agents + 2]
+        agent_position = self.center_cell()[self.encoding.coordinates]
 
-        agent_route = self.observation[2][2][self.n_agents + 2:]
+        agent_route = self.center_cell()[self.encoding.routes]
 
-        if self.__is_in_junction(agent_position) and (list(agent_position) not in self.visited_positions):
+        in_junction = self.geometry.in_junction(agent_position)
+        if in_junction and (list(agent_position) not in self.visited_positions):
             self.visited_positions += [list(agent_position)]
 
-        if list(agent_position) in Junction_Pos.DIRECTION.value:
+        if in_junction:
             # Forward
             if agent_route[0] == 1:
                 # Turns 0 in counter-clockwise direction (stays the same direction)
                 pass
             # Right
             elif agent_route[1] == 1:
-                # Turns 1 in counter-clockwise direction (turns right)
-                index = Pre_Junction.DIRECTION.value.index(self.pre_junction_pos)
-                self.moving_direction = Movement.DIRECTION.value[(index + 3) % 4]
+                # Turns right
+                self.moving_direction = Movement.DIRECTION.value[(self.pre_junction_pos + 3) % 4]
             # Left
             elif agent_route[2] == 1:
                 # This means it's time to turn
                 # TODO - this is flimsy and should be fixed somewhere else (instead of 1 should be 2)
                 if len(self.visited_positions) == 2:
-                    # Turns 3 in counter-clockwise direction (turns left)
-                    index = Pre_Junction.DIRECTION.value.index(self.pre_junction_pos)
-                    self.moving_direction = Movement.DIRECTION.value[(index + 1) % 4]
+                    # Turns left
+                    self.moving_direction = Movement.DIRECTION.value[(self.pre_junction_pos + 1) % 4]
                 else:
                     # Turns 0 in counter-clockwise direction (stays the same direction)
                     pass
-        elif agent_position[1] == 6:
-            self.moving_direction = Movement.DOWNWARDS.value
-        elif agent_position[1] == 7:
-            self.moving_direction = Movement.UPWARDS.value
-        elif agent_position[0] == 7:
-            self.moving_direction = Movement.RIGHTWARDS.value
-        elif agent_position[0] == 6:
-            self.moving_direction = Movement.LEFTWARDS.value
+        # Outside the junction, the lane gives the direction
+        elif self.geometry.heading_at(agent_position) >= 0:
+            self.moving_direction = Movement.DIRECTION.value[self.geometry.heading_at(agent_position)]
     # ################# #
     # Auxiliary Methods #
     # ################# #
@@ -148,43 +135,21 @@ class CommunicatingAgent(Agent):
         Returns:
             list: List of arrays, each array has a nearby agent position and their respective route
         """
+        # the neighbor list already holds the cars in the view
+        if isinstance(self.observation, NeighborObservation):
+            return self.observation.near_agents(agent_position)
+
         near_agents = []
 
         # Goes through the whole observation row by row, checking each cell for nearby agents
         for row in self.observation:
             for cell in row:
                 # checks if it's not the agent itself
-                if 1 in cell and not np.array_equiv(cell[self.n_agents:self.n_agents + 2], agent_position):
-                    near_agents.append([cell[self.n_agents:self.n_agents + 2], cell[self.n_agents + 2:]])
+                if cell[self.encoding.ids].any() and not np.array_equiv(cell[self.encoding.coordinates], agent_position):
+                    near_agents.append([cell[self.encoding.coordinates], cell[self.encoding.routes]])
 
         return near_agents
 
-    # hardcoded see if its in the junction
-    def __is_in_junction(self, agent_position):
-
-        if np.array_equiv([6, 7], agent_position) \
-                or np.array_equiv([6, 6], agent_position) \
-                or np.array_equiv([7, 6], agent_position) \
-                or np.array_equiv([7, 7], agent_position):
-            return True
-        return False
-
-    def __pre_junction(self, agent_position):
-        if np.array_equiv(Pre_Junction.TOP.value, agent_position):
-            return Pre_Junction.TOP.value
-
-        elif np.array_equiv(Pre_Junction.RIGHT.value, agent_position):
-            return Pre_Junction.RIGHT.value
-
-        elif np.array_equiv(Pre_Junction.DOWN.value, agent_position):
-            return Pre_Junction.DOWN.value
-
-        elif np.array_equiv(Pre_Junction.LEFT.value, agent_position):
-            return Pre_Junction.LEFT.value
-        return []
-
-
-
     def __get_next_position(self, agent_position, moving_direction):
         if moving_direction == Movement.DOWNWARDS.value:
             return agent_position[0] + 1, agent_position[1]
@@ -213,9 +178,9 @@ class CommunicatingAgent(Agent):
 
         # agent[0] is agent position, agent[1] is agent route
 
-        # agent_pos will have only the list with positions if is in one of the 4 pre_junction_position
-        is_pre_junction = self.__pre_junction(agent_position)
-        if is_pre_junction:
+        # index of the approach if the agent is in one of the 4 pre_junction positions, -1 otherwise
+        is_pre_junction = self.geometry.pre_junction_at(agent_position)
+        if is_pre_junction >= 0:
             self.pre_junction_pos = is_pre_junction
         agent_next_position = self.__get_next_position(agent_position, self.moving_direction)
 
@@ -223,25 +188,24 @@ class CommunicatingAgent(Agent):
         if near_agents:
             for near_agent in near_agents:
                 # If it hasn't yet reached the entrance of the junction
-                if not is_pre_junction:
+                if is_pre_junction < 0:
                     if np.array_equiv(near_agent[0], agent_next_position):
                         return BREAK
                 # If it has already reached the entrance of the junction
                 else:
-                    index = Pre_Junction.DIRECTION.value.index(is_pre_junction)
+                    index = is_pre_junction
                     # If there is another agent in the junction
-                    if self.__is_in_junction(near_agent[0]):
-                        if self.__is_in_junction(self.__get_next_position(near_agent[0], self.communication_handler.request_moving_direction(near_agent[0]))):
+                    if self.geometry.in_junction(near_agent[0]):
+                        if self.geometry.in_junction(self.__get_next_position(near_agent[0], self.communication_handler.request_moving_direction(near_agent[0]))):
                             return BREAK
 
-                    near_agent_pos = self.__pre_junction(near_agent[0])
+                    near_agent_pos = self.geometry.pre_junction_at(near_agent[0])
                     # If another agent is in the entrance of the junction - obtains yield properties
-                    if near_agent_pos:
+                    if near_agent_pos >= 0:
                         # Checks if near agent is in the top - top is hardcoded as max priority
-                        if not (Pre_Junction.DIRECTION.value[index] == Pre_Junction.TOP.value) and near_agent_pos == \
-                                Pre_Junction.DIRECTION.value[(index + 1) % 4]:
+                        if not (index == Pre_Junction.TOP.value) and near_agent_pos == (index + 1) % 4:
                             return BREAK
                         # If top is max priority, left must yield to everyone
-                        if Pre_Junction.DIRECTION.value[index] == Pre_Junction.LEFT.value:
+                        if index == Pre_Junction.LEFT.value:
                             return BREAK
         return GAS
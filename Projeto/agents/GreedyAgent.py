@@ -1,5 +1,6 @@
 from aasma import Agent
-import numpy as np
+from aasma.utils_traffic_junction.observation_encoding import N_ROUTES, ObservationEncoding
+from aasma.utils_traffic_junction.geometry import junction_geometry
 
 N_ACTIONS = 2
 GAS, BREAK = range(N_ACTIONS)
@@ -13,11 +14,13 @@ class GreedyAgent(Agent):
     in order to reach its destination faster.
     """
 
-    def __init__(self, agent_id, n_agents):
+    def __init__(self, agent_id, n_agents, grid_shape=(14, 14), blocks=(1, 1), id_encoding='onehot'):
         super(GreedyAgent, self).__init__(f"Greedy Agent")
         self.agent_id = agent_id
         self.n_agents = n_agents
+        self.encoding = ObservationEncoding(n_agents, N_ROUTES, grid_shape, id_encoding, dtype=int)
         self.n_actions = N_ACTIONS
+        self.geometry = junction_geometry(grid_shape, blocks)
         self.waiting_time = 0
         self.has_entered_junction = False
         
@@ -25,9 +28,9 @@ class GreedyAgent(Agent):
     def action(self) -> int:  
         max_time = None
         # just to have the metric of waiting time
-        agent_position = self.observation[2][2][self.n_agents:self.n_agents + 2]
+        agent_position = self.center_cell()[self.encoding.coordinates]
         
-        if self.__is_in_junction(agent_position):
+        if self.geometry.in_junction(agent_position):
             self.has_entered_junction = True
         
         if not self.has_entered_junction:
@@ -38,17 +41,4 @@ class GreedyAgent(Agent):
             self.waiting_time = 0
       
         return GAS, max_time
-    
-    # ################# #
-    # Auxiliary Methods #
-    # ################# #
-    
-    def __is_in_junction(self, agent_position):
-
-        if np.array_equiv([6, 7], agent_position) \
-                or np.array_equiv([6, 6], agent_position) \
-                or np.array_equiv([7, 6], agent_position) \
-                or np.array_equiv([7, 7], agent_position):
-            return True
-        return False
         
\ No newline at end of file
@@ -7,9 +7,14 @@ class RandomAgent(Agent):
     The Random agent randomly decides if it will advance, or stop.
     """
 
-    def __init__(self, n_actions: int):
+    def __init__(self, n_actions: int, rng=None):
         super(RandomAgent, self).__init__("Random Agent")
         self.n_actions = n_actions
+        self.seed(rng)
+
+    def seed(self, seed=None):
+        # the actions are drawn from a generator of the agent, seeded like `np.random.default_rng`
+        self.rng = np.random.default_rng(seed)
 
     def action(self) -> int:        
-        return np.random.randint(self.n_actions), 0
\ No newline at end of file
+        return int(self.rng.integers(self.n_actions)), 0
\ No newline at end of file
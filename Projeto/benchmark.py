@@ -0,0 +1,74 @@
+import argparse
+import copy
+import pickle
+import timeit
+
+from aasma.traffic_junction import TrafficJunction, TrafficNetwork
+
+
+def warm_up(environment: TrafficJunction, n_steps: int):
+    # steps the environment with every car gassing, so that the state holds cars on the road, finished and waiting
+    environment.reset()
+    for _ in range(n_steps):
+        _, _, terminals, _ = environment.step([0] * environment.n_agents)
+        if all(terminals):
+            environment.reset()
+
+
+def best_time(statement, repeats: int, number: int) -> float:
+    # best of `repeats` runs, in microseconds per call
+    return min(timeit.repeat(statement, repeat=repeats, number=number)) / number * 1e6
+
+
+def benchmark_state(n_agents: int, repeats: int, number: int):
+    environment = TrafficJunction(grid_shape=(14, 14), n_max=n_agents, arrive_prob=0.5, max_steps=100, seed=0)
+    warm_up(environment, 30)
+    state = environment.get_state()
+
+    timings = {
+        "get_state": best_time(environment.get_state, repeats, number),
+        "set_state": best_time(lambda: environment.set_state(state), repeats, number),
+        "pickle state": best_time(lambda: pickle.loads(pickle.dumps(state)), repeats, number),
+        "deepcopy env": best_time(lambda: copy.deepcopy(environment), repeats, max(1, number // 100)),
+    }
+
+    print(f"State snapshot of a TrafficJunction with {n_agents} cars "
+          f"({len(pickle.dumps(state))} bytes pickled)")
+    for name, microseconds in timings.items():
+        print(f"  {name:<14}{microseconds:>12.1f} us")
+    print(f"  set_state is {timings['deepcopy env'] / timings['set_state']:.0f}x faster than deepcopy")
+
+
+def benchmark_network(blocks, n_cars: int, repeats: int, number: int):
+    environment = TrafficNetwork(blocks=blocks, n_max=n_cars, arrive_prob=1.0, max_steps=10 ** 6, seed=0)
+    buffers = environment.make_buffers()
+    environment.reset(out=buffers)
+    # every car gasses until the cars on the road stop growing, each step then moves thousands of cars
+    on_road = -1
+    while on_road < environment.curr_cars_count:
+        on_road = environment.curr_cars_count
+        for _ in range(sum(environment.geometry.grid_shape)):
+            environment.step(buffers.actions, out=buffers)
+
+    microseconds = best_time(lambda: environment.step(buffers.actions, out=buffers), repeats, max(1, number // 100))
+    observations = environment.get_agent_obs()
+    observation_microseconds = best_time(lambda: observations[0], repeats,
+                                         max(1, number // 100))
+    print(f"TrafficNetwork of {blocks[0]} x {blocks[1]} junctions on a {environment.geometry.grid_shape} grid "
+          f"with {environment.curr_cars_count} cars on the road")
+    print(f"  step          {microseconds:>12.1f} us ({1e6 / microseconds:.0f} steps/s)")
+    print(f"  observation   {observation_microseconds:>12.1f} us per agent read")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=255)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--number", type=int, default=1000)
+    parser.add_argument("--network", type=int, nargs=2, default=[16, 16], metavar=("ROWS", "COLS"))
+    parser.add_argument("--cars", type=int, default=20000)
+    opt = parser.parse_args()
+
+    benchmark_state(opt.agents, opt.repeats, opt.number)
+    benchmark_network(tuple(opt.network), opt.cars, opt.repeats, opt.number)
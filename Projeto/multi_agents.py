@@ -1,4 +1,5 @@
 import argparse
+import os
 import numpy as np
 from gym import Env
 from typing import Sequence
@@ -6,7 +7,12 @@ from statistics import mean
 
 from aasma import Agent
 from aasma.utils import compare_all_results, compare_results_and_collisions
-from aasma.traffic_junction import TrafficJunction
+from aasma.traffic_junction import ParallelTrafficJunction, TrafficJunction, TrafficJunctionPool, TrafficNetwork, VectorTrafficJunction
+from aasma.utils_traffic_junction.arrival_schedule import load_schedules, save_schedules
+from aasma.utils_traffic_junction.observation_encoding import ID_ENCODINGS
+from aasma.utils_traffic_junction.rng import spawn_rngs, stream_seed
+from aasma.utils_traffic_junction.step_profiler import StepProfiler, save_trace
+from aasma.wrappers import ParallelListAdapter, VectorTeamAdapter
 from agents.CommunicationHandler import CommunicationHandler
 
 from agents.RandomAgent import RandomAgent
@@ -16,7 +22,7 @@ from agents.CommunicatingAgent import CommunicatingAgent
 from agents.WaitingAgent import WaitingAgent
 
 
-def run_multi_agent(environment: Env, agents: Sequence[Agent], n_episodes: int, render: bool, random: bool) -> np.ndarray:
+def run_multi_agent(environment: Env, agents: Sequence[Agent], n_episodes: int, render: bool, random: bool, seed=None, schedules=None) -> np.ndarray:
 
     results = np.zeros(n_episodes)
     collisions = np.zeros(n_episodes)
@@ -24,14 +30,28 @@ def run_multi_agent(environment: Env, agents: Sequence[Agent], n_episodes: int,
 
     communication_handler.update_agents(list(agents))
 
+    # the environment writes observations, dones and collisions into these arrays and reads the actions from them
+    buffers = environment.make_buffers()
+    actions = buffers.actions
+
     for episode in range(n_episodes):
         steps = 0
-        terminals = [False for _ in range(len(agents))]
-        observations = environment.reset()
+        terminals = buffers.dones
+        # with a seed, an episode only depends on its own streams: the environment and each agent draw from a child
+        # of `stream_seed(seed, episode)`, so any episode can be re-run alone and every team gets the same streams
+        env_seed = None
+        if seed is not None:
+            env_seed, *agent_seeds = stream_seed(seed, episode).spawn(1 + len(agents))
+            for agent, agent_seed in zip(agents, agent_seeds):
+                agent.seed(agent_seed)
+        if schedules is not None:
+            # every team replays the same arrivals, so the teams are compared on the same traffic
+            observations = environment.reset(out=buffers, seed=env_seed, schedule=schedules[episode])
+        else:
+            observations = environment.reset(out=buffers, seed=env_seed)
         
         Timers = []
-        while not all(terminals):
-            actions = []
+        while not terminals.all():
             steps += 1
             for observations, agent in zip(observations, agents):
                 agent.see(observations)
@@ -39,17 +59,19 @@ def run_multi_agent(environment: Env, agents: Sequence[Agent], n_episodes: int,
             communication_handler.update_agents(list(agents))
             
             if not random:
-                for agent in agents:
+                for agent_i, agent in enumerate(agents):
                     action, TimeStep = agent.action()
                     if TimeStep != None and TimeStep != 0:
                         Timers += [TimeStep]
-                    actions += [action]
+                    actions[agent_i] = action
             else:
-                for agent in agents:
+                for agent_i, agent in enumerate(agents):
                     action, TimeStep = agent.action()
-                    actions += [action]
-            next_observations, rewards, terminals, info = environment.step(actions)
+                    actions[agent_i] = action
+            next_observations, rewards, terminals, info = environment.step(actions, out=buffers)
             collisions[episode] += info['step_collisions']
+            # steps of an empty road skipped by the fast-forward still count in the length of the episode
+            steps += int(info['skipped_steps'])
             
             if render:
                 environment.render()
@@ -68,6 +90,46 @@ def run_multi_agent(environment: Env, agents: Sequence[Agent], n_episodes: int,
     return results, collisions, waitingSteps
 
 
+def run_multi_agent_batched(environment: VectorTrafficJunction, team: VectorTeamAdapter, n_episodes: int, random: bool) -> np.ndarray:
+
+    results = []
+    collisions = []
+    waitingSteps = []
+
+    Timers = [[] for _ in range(environment.n_envs)]
+    observations = environment.reset()
+    while len(results) < n_episodes:
+        actions, waiting_times = team.act(observations)
+        if not random:
+            for env_i, env_waiting_times in enumerate(waiting_times):
+                Timers[env_i] += env_waiting_times[env_waiting_times != 0].tolist()
+
+        observations, rewards, terminals, info = environment.step(actions)
+
+        # finished junctions were already reset by the environment
+        finished = np.flatnonzero(info['episode_done'])
+        for env_i in finished:
+            results.append(info['episode_steps'][env_i])
+            collisions.append(info['episode_collisions'][env_i])
+            if not random:
+                waitingSteps.append(mean(Timers[env_i]) if Timers[env_i] else 0)
+            Timers[env_i] = []
+        team.reset(finished)
+
+    results = np.array(results[:n_episodes])
+    collisions = np.array(collisions[:n_episodes])
+    waitingSteps = np.array(waitingSteps[:n_episodes]) if not random else np.zeros(n_episodes)
+    return results, collisions, waitingSteps
+
+
+def communicating_team(agent_class, n_agents, grid_shape, id_encoding):
+    # each team gets its own handler, so teams acting on different junctions never talk to each other
+    handler = CommunicationHandler()
+    agents = [agent_class(agent_id=i, n_agents=n_agents, communication_handler=handler, grid_shape=grid_shape, id_encoding=id_encoding) for i in range(1, n_agents + 1)]
+    handler.update_agents(agents)
+    return agents
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -75,6 +137,9 @@ if __name__ == '__main__':
     parser.add_argument("--episodes", type=int, default=20)
     parser.add_argument("--agents", type=int, default=10)
     parser.add_argument("--maxsteps", type=int, default=100)
+    parser.add_argument("--grid", type=int, nargs=2, default=[14, 14], metavar=("ROWS", "COLS"))
+    parser.add_argument("--network", type=int, nargs=2, default=None, metavar=("ROWS", "COLS"))
+    parser.add_argument("--viewradius", type=int, default=2)
     parser.add_argument("--render", action='store_true')
     parser.add_argument("--random", "-r", action='store_true')
     parser.add_argument("--greedy", "-g", action='store_true')
@@ -82,9 +147,40 @@ if __name__ == '__main__':
     parser.add_argument("--communicating", "-com", action='store_true')
     parser.add_argument("--waiting", "-w", action='store_true')
     parser.add_argument("--all", "-a", action='store_true')
+    parser.add_argument("--batch", "-b", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--jit", action='store_true')
+    parser.add_argument("--fastforward", action='store_true')
+    parser.add_argument("--neighbors", action='store_true')
+    parser.add_argument("--idencoding", type=str, default='onehot', choices=ID_ENCODINGS)
+    parser.add_argument("--parallel", action='store_true')
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--schedules", type=str, default=None, metavar="PATH")
+    parser.add_argument("--profile", type=str, default=None, metavar="PATH")
 
     opt = parser.parse_args()
 
+    grid_shape = tuple(opt.grid)
+    # with --network, the grid is a network of ROWS x COLS junctions, each on a --grid block
+    blocks = tuple(opt.network) if opt.network else (1, 1)
+    if opt.network and (opt.batch or opt.workers):
+        parser.error("--network runs a single environment, it cannot be combined with --batch or --workers")
+    if opt.neighbors and (opt.network or opt.batch or opt.workers):
+        parser.error("--neighbors only applies to a single TrafficJunction")
+    if opt.parallel and (opt.network or opt.batch or opt.workers):
+        parser.error("--parallel only applies to a single TrafficJunction")
+    if opt.schedules and (opt.network or opt.batch or opt.workers):
+        parser.error("--schedules only applies to a single TrafficJunction")
+    if opt.profile and (opt.network or opt.batch or opt.workers):
+        parser.error("--profile only applies to a single TrafficJunction")
+    if opt.idencoding != 'onehot' and opt.network:
+        parser.error("--idencoding does not apply to --network, its observations always use one-hot ids")
+    # --workers takes precedence over --batch, the pool steps each junction with the options of a single one
+    if opt.fastforward and (opt.network or (opt.batch and not opt.workers)):
+        parser.error("--fastforward does not apply to --batch or --network")
+    if opt.jit and (opt.network or (opt.batch and not opt.workers)):
+        parser.error("--jit does not apply to --batch or --network")
+
     if opt.all:
         opt.random = True
         opt.greedy = True
@@ -92,34 +188,93 @@ if __name__ == '__main__':
         opt.communicating = True
         opt.waiting = True
 
-    # 1 - Setup the environment
-    environment = TrafficJunction(grid_shape=(14, 14), step_cost=-0.01, n_max=opt.agents, collision_reward=-10, arrive_prob=0.5, max_steps=opt.maxsteps)
-    communication_handler = CommunicationHandler()
+    if opt.batch or opt.workers:
+        # 1 - Setup a batch of environments, stepped together in this process or by a pool of worker processes
+        env_kwargs = dict(grid_shape=grid_shape, step_cost=-0.01, n_max=opt.agents, collision_reward=-10, arrive_prob=0.5, max_steps=opt.maxsteps, view_radius=opt.viewradius, id_encoding=opt.idencoding)
+        if opt.workers:
+            environment = TrafficJunctionPool(opt.workers, dict(env_kwargs, jit=opt.jit, fast_forward=opt.fastforward), seed=stream_seed(opt.seed, 0))
+        else:
+            environment = VectorTrafficJunction(opt.batch, **env_kwargs, seed=stream_seed(opt.seed, 0))
+        # the random agents of every copy of the team draw from their own child stream
+        agent_rngs = iter(spawn_rngs(stream_seed(opt.seed, 1), environment.n_envs * environment.n_agents))
 
-    # 2 - Set up the teams
-    teams = {}
-    if opt.random:
-        teams["Random Team"] = [RandomAgent(environment.action_space[i].n) for i in range(environment.n_agents)]
-    if opt.greedy: teams["Greedy Team"] = []
-    if opt.conventional: teams["Convention Team"] = []
-    if opt.communicating: teams["Communicating Team"] = []
-    if opt.waiting: teams["Waiting Team"] = []
-
-    for i in range(1, opt.agents + 1):
-        if opt.greedy: teams["Greedy Team"].append(GreedyAgent(agent_id=i, n_agents=opt.agents))
-        if opt.conventional: teams["Convention Team"].append(ConventionAgent(agent_id=i, n_agents=opt.agents))
-        if opt.communicating: teams["Communicating Team"].append(CommunicatingAgent(agent_id=i, n_agents=opt.agents, communication_handler=communication_handler))
-        if opt.waiting: teams["Waiting Team"].append(WaitingAgent(agent_id=i, n_agents=opt.agents, communication_handler=communication_handler))
-
-    # 3 - Evaluate teams
-    results = {}
-    collisions = {}
-    waitingTime = {}
-    for team, agents in teams.items():
-        result, collision, wait = run_multi_agent(environment, agents, opt.episodes, opt.render, opt.random)
-        results[team] = result
-        collisions[team] = collision
-        waitingTime[team] = wait
+        # 2 - Set up the teams, one copy per environment of the batch
+        team_factories = {}
+        if opt.random: team_factories["Random Team"] = lambda: [RandomAgent(environment.action_space[i].n, rng=next(agent_rngs)) for i in range(environment.n_agents)]
+        if opt.greedy: team_factories["Greedy Team"] = lambda: [GreedyAgent(agent_id=i, n_agents=opt.agents, grid_shape=grid_shape, id_encoding=opt.idencoding) for i in range(1, opt.agents + 1)]
+        if opt.conventional: team_factories["Convention Team"] = lambda: [ConventionAgent(agent_id=i, n_agents=opt.agents, grid_shape=grid_shape, id_encoding=opt.idencoding) for i in range(1, opt.agents + 1)]
+        if opt.communicating: team_factories["Communicating Team"] = lambda: communicating_team(CommunicatingAgent, opt.agents, grid_shape, opt.idencoding)
+        if opt.waiting: team_factories["Waiting Team"] = lambda: communicating_team(WaitingAgent, opt.agents, grid_shape, opt.idencoding)
+
+        # 3 - Evaluate teams
+        results = {}
+        collisions = {}
+        waitingTime = {}
+        for team, team_factory in team_factories.items():
+            result, collision, wait = run_multi_agent_batched(environment, VectorTeamAdapter(team_factory, environment.n_envs), opt.episodes, opt.random)
+            results[team] = result
+            collisions[team] = collision
+            waitingTime[team] = wait
+        environment.close()
+
+    else:
+        # 1 - Setup the environment
+        if opt.network:
+            environment = TrafficNetwork(blocks=blocks, block_shape=grid_shape, step_cost=-0.01, n_max=opt.agents, collision_reward=-10, arrive_prob=0.5, max_steps=opt.maxsteps, view_radius=opt.viewradius)
+            grid_shape = environment.geometry.grid_shape
+        else:
+            junction = environment = TrafficJunction(grid_shape=grid_shape, step_cost=-0.01, n_max=opt.agents, collision_reward=-10, arrive_prob=0.5, max_steps=opt.maxsteps, view_radius=opt.viewradius, jit=opt.jit, fast_forward=opt.fastforward, neighbor_obs=opt.neighbors, id_encoding=opt.idencoding)
+            if opt.parallel:
+                # only the live cars are exchanged with the environment, see `ParallelTrafficJunction`
+                environment = ParallelListAdapter(ParallelTrafficJunction(environment))
+        communication_handler = CommunicationHandler()
+
+        # one arrival schedule per episode, replayed for every team: loaded when the file exists, else sampled and saved
+        schedules = None
+        if opt.schedules:
+            if os.path.exists(opt.schedules):
+                schedules = load_schedules(opt.schedules)
+                if len(schedules) < opt.episodes:
+                    parser.error("{} only holds {} episodes".format(opt.schedules, len(schedules)))
+            else:
+                schedule_rng = np.random.default_rng(stream_seed(opt.seed, 2))
+                schedules = [junction.sample_schedule(schedule_rng) for _ in range(opt.episodes)]
+                save_schedules(opt.schedules, schedules)
+
+        # 2 - Set up the teams
+        teams = {}
+        if opt.random:
+            teams["Random Team"] = [RandomAgent(environment.action_space[i].n) for i in range(environment.n_agents)]
+        if opt.greedy: teams["Greedy Team"] = []
+        if opt.conventional: teams["Convention Team"] = []
+        if opt.communicating: teams["Communicating Team"] = []
+        if opt.waiting: teams["Waiting Team"] = []
+
+        for i in range(1, opt.agents + 1):
+            if opt.greedy: teams["Greedy Team"].append(GreedyAgent(agent_id=i, n_agents=opt.agents, grid_shape=grid_shape, blocks=blocks, id_encoding=opt.idencoding))
+            if opt.conventional: teams["Convention Team"].append(ConventionAgent(agent_id=i, n_agents=opt.agents, grid_shape=grid_shape, blocks=blocks, id_encoding=opt.idencoding))
+            if opt.communicating: teams["Communicating Team"].append(CommunicatingAgent(agent_id=i, n_agents=opt.agents, communication_handler=communication_handler, grid_shape=grid_shape, blocks=blocks, id_encoding=opt.idencoding))
+            if opt.waiting: teams["Waiting Team"].append(WaitingAgent(agent_id=i, n_agents=opt.agents, communication_handler=communication_handler, grid_shape=grid_shape, blocks=blocks, id_encoding=opt.idencoding))
+
+        # 3 - Evaluate teams
+        results = {}
+        collisions = {}
+        waitingTime = {}
+        profilers = {}
+        for team, agents in teams.items():
+            if opt.profile:
+                # the steps of each team are profiled apart, see `StepProfiler`
+                junction.profiler = profilers[team] = StepProfiler()
+            result, collision, wait = run_multi_agent(environment, agents, opt.episodes, opt.render, opt.random, opt.seed, schedules)
+            results[team] = result
+            collisions[team] = collision
+            waitingTime[team] = wait
+
+        if opt.profile:
+            for team, profiler in profilers.items():
+                print(team)
+                print(profiler.summary())
+            save_trace(opt.profile, profilers)
 
     # 4 - Compare results
     if opt.random:
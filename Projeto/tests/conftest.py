@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import `aasma` and `agents` from the project directory, the tests do the same
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
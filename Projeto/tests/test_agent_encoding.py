@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import multi_agents
+from aasma.traffic_junction import TrafficJunction
+from agents.CommunicatingAgent import CommunicatingAgent
+from agents.CommunicationHandler import CommunicationHandler
+from agents.ConventionAgent import ConventionAgent
+from agents.GreedyAgent import GreedyAgent
+from agents.WaitingAgent import WaitingAgent
+
+N_AGENTS = 10
+
+
+def run_team(monkeypatch, agent_class, id_encoding, neighbor_obs):
+    handler = CommunicationHandler()
+    monkeypatch.setattr(multi_agents, 'communication_handler', handler, raising=False)
+    kwargs = dict(communication_handler=handler) if agent_class in (CommunicatingAgent, WaitingAgent) else {}
+    agents = [agent_class(agent_id=i, n_agents=N_AGENTS, id_encoding=id_encoding, **kwargs)
+              for i in range(1, N_AGENTS + 1)]
+    environment = TrafficJunction(n_max=N_AGENTS, max_steps=60, id_encoding=id_encoding, neighbor_obs=neighbor_obs)
+    return multi_agents.run_multi_agent(environment, agents, 3, False, False, seed=5)
+
+
+@pytest.mark.parametrize("neighbor_obs", [False, True])
+@pytest.mark.parametrize("agent_class", [GreedyAgent, ConventionAgent, CommunicatingAgent, WaitingAgent])
+def test_agents_act_the_same_whatever_the_id_encoding(monkeypatch, agent_class, neighbor_obs):
+    onehot = run_team(monkeypatch, agent_class, 'onehot', neighbor_obs)
+    index = run_team(monkeypatch, agent_class, 'index', neighbor_obs)
+    for onehot_metric, index_metric in zip(onehot, index):
+        assert np.array_equal(onehot_metric, index_metric)
@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+
+from aasma.utils_traffic_junction.collisions import (resolve_collisions, resolve_collisions_batched,
+                                                     resolve_collisions_sparse)
+
+N_CELLS = 16
+
+
+def baseline_resolve(curr_cells, next_cells):
+    """
+    Direct port of the restart loop of the original `TrafficJunction.__update_agent_pos`, on flat cells with [] for
+    the finished cars.
+
+    :return: the cell of each car after the step and the number of collided cars
+    :rtype: tuple
+    """
+    agent_curr_positions = [[] if cell < 0 else int(cell) for cell in curr_cells]
+    agent_next_positions = [[] if cell < 0 else int(cell) for cell in next_cells]
+    collided_agents_i = []
+    new_agents_positions = []
+    agent_i = 0
+    while agent_i < len(agent_next_positions):
+        next_pos = agent_next_positions[agent_i]
+        if next_pos == []:
+            agent_i += 1
+            new_agents_positions.append(next_pos)
+            continue
+        n_next_pos = agent_next_positions.count(next_pos)
+        if n_next_pos == 1:
+            if next_pos == agent_curr_positions[agent_i]:
+                agent_i += 1
+                new_agents_positions.append(next_pos)
+                continue
+            else:
+                new_collision = False
+                if agent_i in collided_agents_i:
+                    for pos in agent_next_positions:
+                        if agent_curr_positions[agent_i] == pos and (agent_next_positions.index(pos) not in collided_agents_i):
+                            new_collision = True
+                            collided_agents_i.append(agent_next_positions.index(pos))
+                            agent_i = -1
+                            new_agents_positions.clear()
+                            break
+                    if not new_collision:
+                        new_agents_positions.append(agent_curr_positions[agent_i])
+                else:
+                    new_agents_positions.append(next_pos)
+        elif n_next_pos > 1:
+            if next_pos == agent_curr_positions[agent_i]:
+                agent_i += 1
+                new_agents_positions.append(next_pos)
+                continue
+            new_collision = False
+            if agent_i in collided_agents_i:
+                for pos in agent_next_positions:
+                    if agent_curr_positions[agent_i] == pos and (agent_next_positions.index(pos) not in collided_agents_i):
+                        new_collision = True
+                        collided_agents_i.append(agent_next_positions.index(pos))
+                        agent_i = -1
+                        new_agents_positions.clear()
+                        break
+                if not new_collision:
+                    new_agents_positions.append(agent_curr_positions[agent_i])
+            else:
+                agents_ids = [idx for idx, value in enumerate(agent_next_positions) if value == next_pos]
+                flag_agent_stopped = False
+                for i in agents_ids:
+                    if agent_next_positions[i] == agent_curr_positions[i]:
+                        flag_agent_stopped = True
+                        break
+                if flag_agent_stopped:
+                    if i != agent_i:
+                        if agent_i not in collided_agents_i:
+                            collided_agents_i.append(agent_i)
+                            agent_i = -1
+                            new_agents_positions.clear()
+                else:
+                    new_collision = False
+                    for ids in agents_ids:
+                        if (ids != agents_ids[0]) and (ids not in collided_agents_i):
+                            new_collision = True
+                            collided_agents_i.append(ids)
+                    if agent_i == agents_ids[0] and not new_collision:
+                        new_agents_positions.append(next_pos)
+                    if new_collision:
+                        agent_i = -1
+                        new_agents_positions.clear()
+        agent_i += 1
+
+    new_cells = np.array([-1 if cell == [] else cell for cell in new_agents_positions], dtype=np.int64)
+    return new_cells, len(collided_agents_i)
+
+
+def cascade_rounds(curr_cells, next_cells, new_cells):
+    """
+    :return: rounds needed to stop the collided cars of a resolved step: a car that lost its target cell to a stopped
+        car or to a lower id stops in round 1, a car that wanted the cell kept by a car stopped in round k stops in
+        round k + 1
+    :rtype: int
+    """
+    collided = (next_cells >= 0) & (next_cells != curr_cells) & (new_cells == curr_cells)
+    rounds = np.zeros(len(next_cells), dtype=np.int64)
+    for _ in range(len(next_cells)):
+        for car in np.flatnonzero(collided):
+            rivals = np.flatnonzero(next_cells == next_cells[car])
+            stopped_rival = (next_cells[rivals] == curr_cells[rivals]).any()
+            if stopped_rival or rivals[0] != car:
+                rounds[car] = 1
+            else:
+                occupant = np.flatnonzero(curr_cells == next_cells[car])[0]
+                rounds[car] = rounds[occupant] + 1 if rounds[occupant] else 0
+    return int(rounds.max(initial=0))
+
+
+def random_step(rng, n_cars):
+    """
+    Random cars on a small grid: each one is finished, brakes, or wants the cell of another car (chains, swaps,
+    cycles and cars blocked by a stopped one) or a free cell.
+    """
+    curr_cells = rng.permutation(N_CELLS)[:n_cars].astype(np.int64)
+    next_cells = curr_cells.copy()
+    for car in range(n_cars):
+        kind = rng.integers(4)
+        if kind == 0:
+            curr_cells[car] = next_cells[car] = -1
+        elif kind == 2:
+            next_cells[car] = curr_cells[rng.integers(n_cars)]
+        elif kind == 3:
+            next_cells[car] = rng.integers(N_CELLS)
+    # a car that picked the cell of a finished car brakes instead
+    next_cells[(curr_cells >= 0) & (next_cells < 0)] = curr_cells[(curr_cells >= 0) & (next_cells < 0)]
+    return curr_cells, next_cells
+
+
+# (current cells, wanted cells) of hand-made steps
+CASES = {
+    'moving_chain': ([0, 1, 2, 3], [1, 2, 3, 4]),
+    'chain_behind_stopped': ([0, 1, 2, 3], [1, 2, 3, 3]),
+    'chain_behind_conflict': ([5, 0, 1, 2], [3, 1, 2, 3]),
+    'swap': ([0, 1], [1, 0]),
+    'cycle': ([0, 1, 2, 3], [1, 2, 3, 0]),
+    'blocked_by_stopped': ([4, 0, 5], [4, 4, 4]),
+    'lowest_id_wins': ([2, 0, 1], [3, 3, 3]),
+    'finished_cars': ([-1, 0, -1, 1], [-1, 1, -1, 2]),
+}
+
+
+def check_all_resolvers(curr_cells, next_cells):
+    curr_cells, next_cells = np.asarray(curr_cells, dtype=np.int64), np.asarray(next_cells, dtype=np.int64)
+    expected_cells, expected_collisions = baseline_resolve(curr_cells, next_cells)
+    expected_rounds = cascade_rounds(curr_cells, next_cells, expected_cells)
+
+    new_cells, n_collisions, rounds = resolve_collisions(curr_cells, next_cells, N_CELLS)
+    assert np.array_equal(new_cells, expected_cells)
+    assert (n_collisions, rounds) == (expected_collisions, expected_rounds)
+
+    new_cells, n_collisions, rounds = resolve_collisions_sparse(curr_cells, next_cells)
+    assert np.array_equal(new_cells, expected_cells)
+    assert (n_collisions, rounds) == (expected_collisions, expected_rounds)
+    return expected_cells, expected_collisions, expected_rounds
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_resolvers_follow_the_baseline_on_hand_made_steps(case):
+    check_all_resolvers(*CASES[case])
+
+
+def test_hand_made_steps_resolve_as_expected():
+    assert check_all_resolvers(*CASES['moving_chain'])[1:] == (0, 0)
+    assert check_all_resolvers(*CASES['chain_behind_stopped'])[1:] == (3, 3)
+    assert check_all_resolvers(*CASES['chain_behind_conflict'])[1:] == (3, 3)
+    assert check_all_resolvers(*CASES['swap'])[1:] == (0, 0)
+    assert check_all_resolvers(*CASES['cycle'])[1:] == (0, 0)
+    assert check_all_resolvers(*CASES['blocked_by_stopped'])[1:] == (2, 1)
+    assert check_all_resolvers(*CASES['lowest_id_wins'])[1:] == (2, 1)
+
+
+@pytest.mark.parametrize("n_cars", [2, 5, 10, 16])
+def test_resolvers_follow_the_baseline_on_random_steps(n_cars):
+    rng = np.random.default_rng(n_cars)
+    for _ in range(300):
+        check_all_resolvers(*random_step(rng, n_cars))
+
+
+@pytest.mark.parametrize("n_cars", [3, 10])
+def test_batched_resolver_follows_the_baseline(n_cars):
+    rng = np.random.default_rng(100 + n_cars)
+    for _ in range(50):
+        steps = [random_step(rng, n_cars) for _ in range(8)]
+        # cells offset by junction, the finished cars stay at -1
+        offsets = np.arange(len(steps))[:, None] * N_CELLS
+        curr_cells = np.stack([curr for curr, _ in steps])
+        next_cells = np.stack([wanted for _, wanted in steps])
+        new_cells, n_collisions, rounds = resolve_collisions_batched(
+            np.where(curr_cells >= 0, curr_cells + offsets, -1), np.where(next_cells >= 0, next_cells + offsets, -1),
+            len(steps) * N_CELLS)
+
+        for env_i, (curr, wanted) in enumerate(steps):
+            expected_cells, expected_collisions, expected_rounds = check_all_resolvers(curr, wanted)
+            assert np.array_equal(np.where(new_cells[env_i] >= 0, new_cells[env_i] - offsets[env_i], -1),
+                                  expected_cells)
+            assert (n_collisions[env_i], rounds[env_i]) == (expected_collisions, expected_rounds)
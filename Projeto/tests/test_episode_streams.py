@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from aasma.traffic_junction import TrafficJunction, TrafficJunctionPool, TrafficNetwork, VectorTrafficJunction
+
+
+def run_batch(environment, n_agents, n_steps, seed):
+    """
+    Steps a batch with random actions and records each finished episode of each environment: its actions and its dones,
+    collisions and cascade rounds at each step.
+    """
+    actions_rng = np.random.default_rng(seed)
+    environment.reset()
+    episodes = [[] for _ in range(environment.n_envs)]
+    current = [[] for _ in range(environment.n_envs)]
+    for _ in range(n_steps):
+        # mostly gas, so the cars collide and finish their episodes
+        actions = (actions_rng.random((environment.n_envs, n_agents)) < 0.2).astype(np.int8)
+        _, _, dones, info = environment.step(actions)
+        for env_i in range(environment.n_envs):
+            current[env_i].append((actions[env_i].copy(), dones[env_i].copy(), int(info['step_collisions'][env_i]),
+                                   int(info['cascade_rounds'][env_i])))
+            if info['episode_done'][env_i]:
+                episodes[env_i].append(current[env_i])
+                current[env_i] = []
+    return episodes
+
+
+def assert_replays(junction, episode_steps, reset_kwargs):
+    junction.reset(**reset_kwargs)
+    for actions, dones, step_collisions, cascade_rounds in episode_steps:
+        _, _, junction_dones, info = junction.step(actions.tolist())
+        assert np.array_equal(junction_dones, dones)
+        assert info['step_collisions'] == step_collisions
+        assert info['cascade_rounds'] == cascade_rounds
+    assert all(junction_dones)
+
+
+@pytest.mark.parametrize("n_max, arrive_prob", [(4, 0.5), (10, 0.5), (20, 1.0)])
+def test_vector_episodes_replay_alone(n_max, arrive_prob):
+    kwargs = dict(grid_shape=(14, 14), n_max=n_max, arrive_prob=arrive_prob, max_steps=40)
+    vector = VectorTrafficJunction(3, **kwargs, seed=7)
+    episodes = run_batch(vector, n_max, 200, seed=0)
+
+    assert all(len(env_episodes) >= 2 for env_episodes in episodes)
+    junction = TrafficJunction(**kwargs)
+    for env_i, env_episodes in enumerate(episodes):
+        for episode, episode_steps in enumerate(env_episodes):
+            assert_replays(junction, episode_steps, dict(schedule=vector.episode_schedule(env_i, episode)))
+
+
+def test_vector_seed_restarts_the_episode_streams():
+    vector = VectorTrafficJunction(2, n_max=10, max_steps=40, seed=3)
+    first = vector.reset().copy()
+    vector.reset()
+    assert vector.seed(3) == [3]
+    assert np.array_equal(vector.reset(), first)
+
+
+def test_pool_episodes_replay_alone():
+    kwargs = dict(grid_shape=(14, 14), n_max=6, max_steps=30)
+    with TrafficJunctionPool(2, kwargs, seed=4) as pool:
+        pool.seed(5)
+        episodes = run_batch(pool, 6, 120, seed=1)
+        assert all(len(env_episodes) >= 2 for env_episodes in episodes)
+        junction = TrafficJunction(**kwargs)
+        for worker_i, worker_episodes in enumerate(episodes):
+            for episode, episode_steps in enumerate(worker_episodes):
+                assert_replays(junction, episode_steps, dict(seed=pool.episode_seed(worker_i, episode)))
+
+
+def test_network_seed_replaces_the_generator():
+    network = TrafficNetwork(blocks=(2, 2), n_max=40, max_steps=20, seed=0)
+    network.seed(11)
+    network.reset()
+    first = network._agents.pos.copy()
+    network.reset(seed=11)
+    assert np.array_equal(network._agents.pos, first)
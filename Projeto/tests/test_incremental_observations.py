@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from aasma.traffic_junction import TrafficJunction
+
+
+def observations_array(observations):
+    return np.array(np.stack(observations) if isinstance(observations, list) else observations)
+
+
+class Lockstep:
+    """
+    An `incremental_obs` environment and a full-rebuild environment stepped with the same seed and actions, each with
+    two sets of buffers so the observations can be asked into different arrays during an episode.
+    """
+
+    def __init__(self, **kwargs):
+        self.incremental = TrafficJunction(**kwargs, incremental_obs=True)
+        self.full = TrafficJunction(**kwargs)
+        self.buffers = {'a': (self.incremental.make_buffers(), self.full.make_buffers()),
+                        'b': (self.incremental.make_buffers(), self.full.make_buffers())}
+
+    def reset(self, seed, out):
+        self.check(self.incremental.reset(out=self.__out(out, 0), seed=seed),
+                   self.full.reset(out=self.__out(out, 1), seed=seed))
+
+    def step(self, actions, out):
+        incremental_result = self.incremental.step(actions, out=self.__out(out, 0))
+        full_result = self.full.step(actions, out=self.__out(out, 1))
+        self.check(incremental_result[0], full_result[0])
+        assert np.array_equal(incremental_result[2], full_result[2])
+        return all(full_result[2])
+
+    def set_state(self, state, out):
+        self.incremental.set_state(state)
+        self.full.set_state(state)
+        out_incremental, out_full = self.__out(out, 0), self.__out(out, 1)
+        self.check(self.incremental.get_agent_obs(None if out_incremental is None else out_incremental.observations),
+                   self.full.get_agent_obs(None if out_full is None else out_full.observations))
+
+    def __out(self, out, env_i):
+        # None steps through the list API
+        return None if out is None else self.buffers[out][env_i]
+
+    @staticmethod
+    def check(incremental_observations, full_observations):
+        assert np.array_equal(observations_array(incremental_observations), observations_array(full_observations))
+
+
+@pytest.mark.parametrize("n_max, view_radius, jit", [(6, 2, False), (10, 1, False), (30, 2, True), (60, 3, False)])
+def test_incremental_observations_equal_full_rebuild(n_max, view_radius, jit):
+    lockstep = Lockstep(grid_shape=(14, 14), n_max=n_max, arrive_prob=0.7, max_steps=60, view_radius=view_radius,
+                        jit=jit)
+    actions_rng = np.random.default_rng(n_max)
+    # the observations go to buffers 'a', then buffers 'b', then to the list API and back to 'a', switching in the
+    # middle of the episodes
+    outs = ['a', 'b', None, 'a']
+    n_spawned = n_finished = 0
+
+    for episode in range(4):
+        out = outs[episode]
+        lockstep.reset(seed=[n_max, episode], out=out)
+        snapshot = None
+        for step_i in range(200):
+            if step_i % 7 == 3:
+                out = outs[(episode + step_i) % len(outs)]
+            if step_i == 10:
+                snapshot = lockstep.incremental.get_state()
+            if step_i == 20:
+                # back to an earlier step: every window changed since the last build
+                lockstep.set_state(snapshot, out)
+
+            waiting = len(lockstep.full._waiting_cars)
+            arrived = int(lockstep.full._agents.dones.sum())
+            actions = (actions_rng.random(n_max) < 0.2).astype(np.int8)
+            done = lockstep.step(actions, out)
+            n_spawned += waiting - len(lockstep.full._waiting_cars)
+            n_finished += int(lockstep.full._agents.dones.sum()) - arrived
+            if done:
+                break
+
+    # the episodes went through spawns and cars reaching their destination
+    assert n_spawned > 0 and n_finished > 0
+
+
+def test_incremental_observations_after_set_state_from_other_environment():
+    kwargs = dict(grid_shape=(14, 14), n_max=10, arrive_prob=0.5, max_steps=60)
+    source = TrafficJunction(**kwargs, seed=3)
+    source.reset()
+    for _ in range(15):
+        source.step([0] * 10)
+
+    lockstep = Lockstep(**kwargs)
+    lockstep.reset(seed=0, out='a')
+    lockstep.step(np.zeros(10, dtype=np.int8), 'a')
+    lockstep.set_state(source.get_state(), 'a')
+    for _ in range(10):
+        lockstep.step(np.zeros(10, dtype=np.int8), 'a')
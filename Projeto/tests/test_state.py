@@ -0,0 +1,75 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from aasma.traffic_junction import TrafficJunction
+
+N_AGENTS = 30
+KWARGS = dict(grid_shape=(14, 14), n_max=N_AGENTS, arrive_prob=0.5, max_steps=60)
+
+
+def random_actions(seed, n_steps):
+    # mostly gas, so the cars collide and leave the gates free for the waiting cars
+    return (np.random.default_rng(seed).random((n_steps, N_AGENTS)) < 0.2).astype(int).tolist()
+
+
+def roll_out(env, actions):
+    """
+    Steps `env` with `actions`, starting a new episode (drawn from the generator of the environment) whenever one
+    ends, and records everything the steps return along with the cars, the waiting queue and the gates.
+    """
+    trajectory = []
+    for agents_action in actions:
+        observations, rewards, dones, info = env.step(agents_action)
+        trajectory.append((np.stack(observations), list(rewards), np.array(dones), dict(info),
+                           env._agents.pos.copy(), env.next_waiting_agent(), env.get_state().gates_taken))
+        if all(dones):
+            trajectory.append(('reset', np.stack(env.reset())))
+    return trajectory
+
+
+def assert_same_trajectory(trajectory, expected):
+    assert len(trajectory) == len(expected)
+    for step, expected_step in zip(trajectory, expected):
+        assert len(step) == len(expected_step)
+        for value, expected_value in zip(step, expected_step):
+            if isinstance(value, np.ndarray):
+                assert np.array_equal(value, expected_value)
+            else:
+                assert value == expected_value
+
+
+@pytest.mark.parametrize("use_schedule", [False, True])
+@pytest.mark.parametrize("incremental_obs", [False, True])
+@pytest.mark.parametrize("jit", [False, True])
+def test_restored_snapshot_replays_the_same_continuation(jit, incremental_obs, use_schedule):
+    env = TrafficJunction(**KWARGS, jit=jit, incremental_obs=incremental_obs, seed=1)
+    env.reset(schedule=env.sample_schedule() if use_schedule else None)
+    # the snapshot is taken while cars wait to enter and gates are taken
+    for agents_action in random_actions(2, 40):
+        env.step(agents_action)
+        state = env.get_state()
+        if state.waiting_cars and state.gates_taken:
+            break
+    assert state.waiting_cars and state.gates_taken
+    assert (state.schedule is not None) == use_schedule
+
+    actions = random_actions(3, 150)
+    expected = roll_out(env, actions)
+    assert any(isinstance(step[0], str) for step in expected)
+
+    # restored on the environment that moved on
+    env.set_state(state)
+    assert_same_trajectory(roll_out(env, actions), expected)
+
+    # pickled and restored on another instance, seeded differently and in the middle of its own episode
+    other = TrafficJunction(**KWARGS, jit=jit, incremental_obs=incremental_obs, seed=99)
+    other.reset()
+    for agents_action in random_actions(4, 7):
+        other.step(agents_action)
+    other.set_state(pickle.loads(pickle.dumps(state)))
+    restored = other.get_state()
+    assert restored.waiting_cars == state.waiting_cars and restored.gates_taken == state.gates_taken
+    assert restored.rng_state == state.rng_state
+    assert_same_trajectory(roll_out(other, actions), expected)
@@ -0,0 +1,56 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from aasma.traffic_junction import TrafficJunction
+
+MAX_STEPS = 100
+N_EPISODES = 30
+# bytes the measurement itself may leave behind (the ints it returns, the generator replaced by the reseed), far
+# below what a leak of a few bytes per step or per episode adds up to over `N_EPISODES`
+SLACK = 512
+
+
+def traced_episode(environment, buffers, step_peaks):
+    """
+    Runs the same episode every time (same seed and actions) through the buffers, writing the peak of the bytes
+    traced during each step into `step_peaks`.
+
+    :return: bytes traced once the episode is over
+    :rtype: int
+    """
+    actions_rng = np.random.default_rng(0)
+    environment.reset(out=buffers, seed=0)
+    step_peaks.fill(0)
+    step_i = 0
+    while not buffers.dones.all():
+        buffers.actions[:] = actions_rng.random(environment.n_agents) < 0.2
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        environment.step(buffers.actions, out=buffers)
+        step_peaks[step_i] = tracemalloc.get_traced_memory()[1] - before
+        step_i += 1
+    return tracemalloc.get_traced_memory()[0]
+
+
+@pytest.mark.parametrize("jit", [False, True])
+def test_buffered_step_allocations_do_not_grow(jit):
+    environment = TrafficJunction(grid_shape=(14, 14), n_max=50, arrive_prob=1.0, max_steps=MAX_STEPS, jit=jit)
+    buffers = environment.make_buffers()
+    first_peaks, last_peaks = np.zeros(MAX_STEPS, dtype=np.int64), np.zeros(MAX_STEPS, dtype=np.int64)
+    traced_episode(environment, buffers, first_peaks)  # warms up caches and compiled kernels
+
+    tracemalloc.start()
+    try:
+        first_traced = traced_episode(environment, buffers, first_peaks)
+        for _ in range(N_EPISODES - 1):
+            last_traced = traced_episode(environment, buffers, last_peaks)
+    finally:
+        tracemalloc.stop()
+
+    # the same episode allocates no more at each step, and keeps nothing allocated, in episode N than in episode 1
+    assert np.all(last_peaks <= first_peaks)
+    assert last_traced - first_traced < SLACK
+    # what a step allocates is small temporaries, no array the size of the observations
+    assert first_peaks.max() < buffers.observations.nbytes // 4
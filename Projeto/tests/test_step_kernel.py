@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from aasma.traffic_junction import TrafficJunction
+from aasma.utils_traffic_junction.step_kernel import JIT_AVAILABLE
+
+pytestmark = pytest.mark.skipif(not JIT_AVAILABLE, reason="numba is not installed")
+
+
+def assert_same_state(numpy_env, jit_env, numpy_result, jit_result):
+    numpy_observations, _, numpy_dones, numpy_info = numpy_result
+    jit_observations, _, jit_dones, jit_info = jit_result
+    assert np.array_equal(numpy_env._agents.pos, jit_env._agents.pos)
+    assert np.array_equal(numpy_env._full_obs, jit_env._full_obs)
+    assert np.array_equal(numpy_dones, jit_dones)
+    assert np.array_equal(np.stack(numpy_observations), np.stack(jit_observations))
+    assert numpy_info['step_collisions'] == jit_info['step_collisions']
+    assert numpy_info['cascade_rounds'] == jit_info['cascade_rounds']
+    assert numpy_env._gates_taken == jit_env._gates_taken
+    assert numpy_env.curr_cars_count == jit_env.curr_cars_count
+
+
+@pytest.mark.parametrize("n_max, arrive_prob", [(4, 0.5), (10, 0.5), (20, 1.0)])
+@pytest.mark.parametrize("seed", range(5))
+def test_jit_and_numpy_steps_give_identical_trajectories(seed, n_max, arrive_prob):
+    kwargs = dict(grid_shape=(14, 14), n_max=n_max, arrive_prob=arrive_prob, max_steps=60)
+    numpy_env = TrafficJunction(**kwargs, jit=False)
+    jit_env = TrafficJunction(**kwargs, jit=True)
+    actions_rng = np.random.default_rng(seed)
+
+    for episode in range(3):
+        numpy_observations = numpy_env.reset(seed=[seed, episode])
+        jit_observations = jit_env.reset(seed=[seed, episode])
+        assert np.array_equal(np.stack(numpy_observations), np.stack(jit_observations))
+
+        dones = [False]
+        while not all(dones):
+            # mostly gas, so the cars queue behind each other and the collisions cascade
+            actions = (actions_rng.random(n_max) < 0.2).astype(int).tolist()
+            numpy_result = numpy_env.step(actions)
+            jit_result = jit_env.step(actions)
+            assert_same_state(numpy_env, jit_env, numpy_result, jit_result)
+            dones = numpy_result[2]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_jit_and_numpy_buffered_steps_give_identical_trajectories(seed):
+    kwargs = dict(grid_shape=(14, 14), n_max=10, max_steps=60, fast_forward=True)
+    numpy_env, jit_env = TrafficJunction(**kwargs, jit=False), TrafficJunction(**kwargs, jit=True)
+    numpy_buffers, jit_buffers = numpy_env.make_buffers(), jit_env.make_buffers()
+    actions_rng = np.random.default_rng(seed)
+
+    numpy_env.reset(out=numpy_buffers, seed=seed)
+    jit_env.reset(out=jit_buffers, seed=seed)
+    while not numpy_buffers.dones.all():
+        numpy_buffers.actions[:] = actions_rng.random(10) < 0.3
+        jit_buffers.actions[:] = numpy_buffers.actions
+        numpy_result = numpy_env.step(numpy_buffers.actions, out=numpy_buffers)
+        jit_result = jit_env.step(jit_buffers.actions, out=jit_buffers)
+        assert_same_state(numpy_env, jit_env, numpy_result, jit_result)
+        assert numpy_buffers.skipped_steps == jit_buffers.skipped_steps